@@ -1,294 +1,197 @@
-import os
-import shutil
 import subprocess
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import configparser
-from datetime import datetime
-
-# Function to check and update the configuration file version
-def check_config_version():
-    config = configparser.ConfigParser()
-    config_file = 'config.ini'
-
-    # Check if the config file exists
-    if os.path.exists(config_file):
-        config.read(config_file)
-
-        # Check if the 'Settings' section exists
-        if 'Settings' not in config:
-            config['Settings'] = {}
-
-        # Get the current version number
-        current_version = config['Settings'].get('version', '0.0')
-
-        # Compare the current version with the required version
-        if float(current_version) < 3.22:
-            # Delete the existing config file
-            os.remove(config_file)
-            config['Settings'] = {}
-            config['Settings']['version'] = '3.22'
-            with open(config_file, 'w') as configfile:
-                config.write(configfile)
-            messagebox.showinfo("Config Updated", "The configuration file has been updated to version 3.22.")
-        else:
-            # Ensure the version number is set in the config
-            config['Settings']['version'] = '3.22'
-            with open(config_file, 'w') as configfile:
-                config.write(configfile)
-    else:  # Create a new config file with version 3.22
-        config['Settings'] = {}
-        config['Settings']['version'] = '3.22'
-        with open(config_file, 'w') as configfile:
-            config.write(configfile)
-        messagebox.showinfo("Config Created", "A new configuration file has been created with version 3.22.")
-
-# Load configuration from config.ini
-def load_config():
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-
-    # Ensure the 'Settings' section exists
-    if 'Settings' not in config:
-        config['Settings'] = {}
-
-    # Retrieve configuration values with default values if not present
-    values = {
-        'model_name': config['Settings'].get('model_name', ''),
-        'raw_weights_dir': config['Settings'].get('raw_weights_dir', ''),
-        'bits_per_head': config['Settings'].get('bits_per_head', '6'),
-        'bpw_values': config['Settings'].get('bpw_values', ''),
-        'venv_path': config['Settings'].get('venv_path', ''),
-        'author_name': config['Settings'].get('author_name', ''),
-        'exllamav2_dir': config['Settings'].get('exllamav2_dir', ''),
-        'cuda_device': config['Settings'].get('cuda_device', '0'),
-        'version': config['Settings'].get('version', '3.22')  # Ensure version is included
-    }
-    return values
-
-# Save configuration to config.ini
-def save_config(values):
-    config = configparser.ConfigParser()
-    config['Settings'] = values
-    with open('config.ini', 'w') as configfile:
-        config.write(configfile)
-
-# Function to run quantization on a specific GPU
-def run_quantization_on_gpu(model_name, raw_weights_dir, bits_per_head, bpw, venv_path, author_name, cuda_device, exllamav2_dir, job_dir, measurement_json_path):
-    try:
-        # Construct the bpw string (e.g., "4bpw")
-        bpw_str = f"{bpw}bpw"
-
-        # Construct the temporary quantization directory
-        temp_quant_dir = os.path.join(job_dir, f"temp_{model_name}_{bpw_str}_H{bits_per_head}")
-
-        # Construct the final output directory with _EXL2_ in the name
-        output_dir = os.path.join(job_dir, f"{model_name}_EXL2_{bpw_str}_H{bits_per_head}")
-
-        # If an author name is provided, include it in the output directory name
-        if author_name:
-            output_dir = os.path.join(job_dir, f"{author_name}_{model_name}_EXL2_{bpw_str}_H{bits_per_head}")
-
-        # Remove existing temp quant directory if it exists
-        if os.path.exists(temp_quant_dir):
-            shutil.rmtree(temp_quant_dir)
-
-        # Create new temp quant directory
-        os.makedirs(temp_quant_dir)
-
-        # Remove existing output directory if it exists
-        if os.path.exists(output_dir):
-            shutil.rmtree(output_dir)
-
-        # Create new output directory
-        os.makedirs(output_dir)
-
-        # Get the activate command based on the operating system
-        activate_command = get_activate_command(venv_path)
-
-        # Construct the path to the convert.py script
-        convert_script_path = os.path.join(exllamav2_dir, 'convert.py')
-
-        # Construct the quantization command
-        quant_command = (
-            f'{activate_command} && '
-            f'set CUDA_VISIBLE_DEVICES={cuda_device} && '
-            f'python {convert_script_path} '
-            f'-i "{raw_weights_dir}" '
-            f'-o "{temp_quant_dir}" '
-            f'-m "{measurement_json_path}" '
-            f'-cf "{output_dir}" '
-            f'-b {bpw} '
-            f'-hb {bits_per_head}'
-        )
-
-        # Adjust the command for non-Windows systems
-        if os.name != 'nt':
-            quant_command = quant_command.replace('set ', '')
-
-        # Run the quantization command
-        subprocess.run(quant_command, shell=True, check=True)
-
-        # Clean up temporary directories
-        if os.path.exists(temp_quant_dir):
-            shutil.rmtree(temp_quant_dir)
-
-        # Copy measurement.json to the output directory
-        shutil.copy(measurement_json_path, output_dir)
-
-    except subprocess.CalledProcessError as e:
-        messagebox.showerror("Command Error", f"An error occurred while running a command on GPU {cuda_device}: {e}")
-    except Exception as e:
-        messagebox.showerror("Error", f"An unexpected error occurred on GPU {cuda_device}: {e}")
-    finally:
-        # Update the progress bar
-        progress_bar.step(1)
-        root.update_idletasks()
+import event_bus
+import process_control
+import progress_parser
+import quant_engine
 
 # Run commands in a separate thread
-def run_commands_thread():
-    try:  # Save the current values to the config file first
-        values = {
-            'model_name': model_name_entry.get(),
-            'raw_weights_dir': raw_weights_entry.get(),
-            'bits_per_head': ','.join([bits_per_head.get() for bits_per_head in bits_per_head_vars if bits_per_head.get() != ""]),
-            'bpw_values': ','.join([bpw.get() for bpw in bpw_vars if bpw.get() != ""]) + ',' + ','.join(custom_bpw_entry.get().strip().split(',')),
-            'venv_path': venv_path_entry.get(),
-            'author_name': author_name_entry.get(),
-            'exllamav2_dir': exllamav2_dir_entry.get(),
-            'cuda_device': cuda_device_entry.get(),
-            'version': '3.22'  # Ensure version is included
-        }
-        save_config(values)  # Save configuration
-
-        # Get user inputs
-        model_name = values['model_name']
-        raw_weights_dir = values['raw_weights_dir']
-        bits_per_head_values = [bits_per_head.get() for bits_per_head in bits_per_head_vars if bits_per_head.get() != ""] if values['bits_per_head'] else []
-        venv_path = values['venv_path']
-        author_name = values['author_name']
-        exllamav2_dir = values['exllamav2_dir']
-        cuda_device = values['cuda_device']
-
-        # Get selected bpw values from checkboxes and custom entry
-        bpw_values = [bpw.get() for bpw in bpw_vars if bpw.get() != ""] if values['bpw_values'] else []
-        custom_bpw_values = custom_bpw_entry.get().strip().split(',')
-        custom_bpw_values = [bpw.strip() for bpw in custom_bpw_values if bpw.strip()]
-
-        # Combine bpw values
-        bpw_values.extend(custom_bpw_values)
-
-        # Check if bpw_values is empty after combining
-        if not bpw_values:
-            messagebox.showerror("Input Error", "Please select or enter at least one bpw value.")
-            return
-
-        # Check if bits_per_head_values is empty
-        if not bits_per_head_values:
-            messagebox.showerror("Input Error", "Please select at least one bits per head value.")
-            return
-
-        # Create job directory based on model name and current time
-        current_time = datetime.now().strftime("%H%M%S")
-        job_dir = os.path.join(os.getcwd(), f"{model_name}_{current_time}")
-        os.makedirs(job_dir, exist_ok=True)
-
-        # Step 2: Set up directories
-        temp_measurement_dir = os.path.join(job_dir, "temp_measurement")
-
-        # Remove existing temp directory if it exists
-        if os.path.exists(temp_measurement_dir):
-            shutil.rmtree(temp_measurement_dir)
-
-        # Create new temp directory
-        os.makedirs(temp_measurement_dir)
-
-        # Prepare output directories
-        for bits_per_head in bits_per_head_values:
-            for bpw in bpw_values:
-                bpw_str = f"{bpw}bpw"
-                output_dir = os.path.join(job_dir, f"{model_name}_EXL2_{bpw_str}_H{bits_per_head}")
-
-                # If an author name is provided, include it in the output directory name
-                if author_name:
-                    output_dir = os.path.join(job_dir, f"{author_name}_{model_name}_EXL2_{bpw_str}_H{bits_per_head}")
-
-                # Create the output directory
-                os.makedirs(output_dir, exist_ok=True)
-
-        # Step 3: Check if measurement.json is provided
-        measurement_path = measurement_path_entry.get()
+# With resume_dir set, the job recorded in that directory is resumed, with `job` overriding its settings
+# Widgets are never touched from here: everything reaches the window through the event bus
+# The Cancel button stops the run through cancel_token
+def run_commands_thread(job, resume_dir=None, cancel_token=None):
+    reporter = event_bus.BusReporter(events)
+    try:
+        if resume_dir:
+            results = quant_engine.resume_job(resume_dir, reporter, job, cancel_token=cancel_token)
+        else:
+            results = quant_engine.run_job(job, reporter, cancel_token=cancel_token)
 
-        if measurement_path and os.path.exists(measurement_path):
-            # Check if measurement.json is already in the correct location
-            if os.path.abspath(measurement_path) != os.path.abspath(os.path.join(job_dir, "measurement.json")):
-                # Copy measurement.json to the job directory
-                shutil.copy(measurement_path, os.path.join(job_dir, "measurement.json"))
+        # Show success message, or list the variants that failed
+        title, message, succeeded = quant_engine.summarize_results(results)
+        if succeeded:
+            reporter.info(title, message)
         else:
-            # First command to take measurements
-            activate_command = get_activate_command(venv_path)
-            convert_script_path = os.path.join(exllamav2_dir, 'convert.py')
-            measurement_command = (
-                f'{activate_command} && '
-                f'set CUDA_VISIBLE_DEVICES={cuda_device} && '
-                f'python {convert_script_path} '
-                f'-i "{raw_weights_dir}" '
-                f'-o "{temp_measurement_dir}" '
-                f'-om "{os.path.join(job_dir, "measurement.json")}"'
-            )
-
-            # Adjust the command for non-Windows systems
-            if os.name != 'nt':
-                measurement_command = measurement_command.replace('set ', '')
-
-            # Run the measurement command
-            subprocess.run(measurement_command, shell=True, check=True)
-
-        # Initialize progress bar
-        total_tasks = len(bits_per_head_values) * len(bpw_values)
-        progress_bar['maximum'] = total_tasks
-        progress_bar.grid(row=12, column=1, columnspan=2, padx=10, pady=10)
-        progress_bar.start(500)  # Start the indeterminate progress bar with a smooth speed
-
-        # Run quantization tasks sequentially
-        measurement_json_path = os.path.join(job_dir, "measurement.json")
-        for bits_per_head in bits_per_head_values:
-            for bpw in bpw_values:
-                run_quantization_on_gpu(model_name, raw_weights_dir, bits_per_head, bpw, venv_path, author_name, cuda_device, exllamav2_dir, job_dir, measurement_json_path)
-
-        # Remove measurement.json from the job directory
-        if os.path.exists(os.path.join(job_dir, "measurement.json")):
-            os.remove(os.path.join(job_dir, "measurement.json"))
-
-        # Remove temp_measurement directory
-        if os.path.exists(temp_measurement_dir):
-            shutil.rmtree(temp_measurement_dir)
-
-        # Show success message
-        messagebox.showinfo("Success", "All processes completed.")
+            reporter.warning(title, message)
 
+    except quant_engine.JobInputError as e:
+        reporter.error("Input Error", str(e))
+    except process_control.ConvertStopped as e:
+        reporter.warning("Job Stopped", f"The measurement was stopped: {e.reason}")
     except subprocess.CalledProcessError as e:
-        messagebox.showerror("Command Error", f"An error occurred while running a command: {e}")
+        reporter.error("Command Error", f"An error occurred while running a command: {e}")
     except Exception as e:
-        messagebox.showerror("Error", f"An unexpected error occurred: {e}")
+        reporter.error("Error", f"An unexpected error occurred: {e}")
     finally:
-        # Stop the progress bar
-        progress_bar.stop()
-        progress_bar.grid_forget()
+        events.publish({'type': 'run_finished'})
 
-        # Enable the Run button
-        run_button.config(state="normal")
+# Build a new job from the form values, saving them to the config file unless save=False
+def collect_new_job(save=True):
+    values = {
+        'model_name': model_name_entry.get(),
+        'raw_weights_dir': raw_weights_entry.get(),
+        'bits_per_head': ','.join([bits_per_head.get() for bits_per_head in bits_per_head_vars if bits_per_head.get() != ""]),
+        'bpw_values': ','.join([bpw.get() for bpw in bpw_vars if bpw.get() != ""]) + ',' + ','.join(custom_bpw_entry.get().strip().split(',')),
+        'venv_path': venv_path_entry.get(),
+        'author_name': author_name_entry.get(),
+        'exllamav2_dir': exllamav2_dir_entry.get(),
+        'cuda_device': cuda_device_entry.get(),
+        'measurement_cache_dir': config_values['measurement_cache_dir'],
+        'measurement_cache_max_mb': config_values['measurement_cache_max_mb'],
+        'execution_mode': config_values['execution_mode'],
+        'scratch_dir': config_values['scratch_dir'],
+        'disk_preflight': config_values['disk_preflight'],
+        'scheduler': config_values['scheduler'],
+        'vram_budget_gb': config_values['vram_budget_gb'],
+        'memory_provider': config_values['memory_provider'],
+        'postprocess_steps': config_values['postprocess_steps'],
+        'postprocess_workers': config_values['postprocess_workers'],
+        'postprocess_queue': config_values['postprocess_queue'],
+        'weights_staging_dir': config_values['weights_staging_dir'],
+        'weights_staging_max_gb': config_values['weights_staging_max_gb'],
+        'timing_db': config_values['timing_db'],
+        'schedule_order': config_values['schedule_order'],
+        'dedup_outputs': config_values['dedup_outputs'],
+        'phase_timeouts': config_values['phase_timeouts'],
+        'stall_timeout_min': config_values['stall_timeout_min'],
+        'metrics_dir': config_values['metrics_dir'],
+        'measurement_devices': config_values['measurement_devices'],
+        'measurement_concurrency': config_values['measurement_concurrency'],
+        'measure_ahead': config_values['measure_ahead'],
+        'version': '3.22'  # Ensure version is included
+    }
+    if save:
+        quant_engine.save_config(values)  # Save configuration
 
-        # Re-enable form controls
-        enable_form_controls()
+    # Hand the form values to the engine as a single job
+    job = dict(values)
+    job.pop('version')
+    job['measurement_path'] = measurement_path_entry.get()
+    return job
 
-# Get activate command based on OS
-def get_activate_command(venv_path):
-    if os.name == 'nt':  # Windows
-        return f'"{venv_path}\\Scripts\\activate.bat"'
-    else:  # Unix or Linux
-        return f'source "{venv_path}/bin/activate"'
+# Check the form's variant matrix and show the plan with its estimated cost; returns the plan, or None if it has errors
+def show_plan(confirm=False, job=None):
+    try:
+        plan = quant_engine.plan_job(job or collect_new_job(save=False))
+    except quant_engine.JobInputError as e:
+        messagebox.showerror("Input Error", str(e))
+        return None
+    if plan['errors']:
+        messagebox.showerror("Plan Errors", quant_engine.format_plan(plan))
+        return None
+    if confirm:
+        return plan if messagebox.askokcancel("Start Job?", quant_engine.format_plan(plan)) else None
+    messagebox.showinfo("Plan", quant_engine.format_plan(plan))
+    return plan
+
+# Handle one engine event in the Tk main loop
+def handle_event(event):
+    kind = event['type']
+    changed = status_table.apply(event)
+    if kind == 'job_started':
+        show_status_table()
+    elif changed:
+        update_status_row(changed)
+
+    if kind == 'progress':
+        # Switch to determinate bars once real progress is known
+        if str(progress_bar['mode']) != 'determinate':
+            progress_bar.stop()
+            progress_bar.config(mode='determinate', maximum=100)
+        progress = event['event']
+        progress_bar['value'] = progress['job_fraction'] * 100
+        variant_progress_bar['value'] = progress['fraction'] * 100
+        progress_label.config(text=quant_engine.describe_progress(event_bus.decode_variant(event['variant']), progress))
+    elif kind == 'notice':
+        progress_label.config(text=event['message'])
+    elif kind in ('info', 'warning', 'error'):
+        # A dialog is in the list while it is shown, so a new chain only starts when none is open
+        pending_dialogs.append(event)
+        if len(pending_dialogs) == 1:
+            root.after_idle(show_next_dialog)
+    elif kind == 'run_finished':
+        finish_run()
+
+# Show the oldest pending dialog, then the next one once it is closed.
+# Dialogs run a nested event loop, in which poll_events keeps draining the event bus.
+def show_next_dialog():
+    event = pending_dialogs[0]
+    dialog = {'info': messagebox.showinfo, 'warning': messagebox.showwarning, 'error': messagebox.showerror}[event['type']]
+    dialog(event['title'], event['message'])
+    pending_dialogs.pop(0)
+    if pending_dialogs:
+        root.after_idle(show_next_dialog)
+
+# Drain the event queue on a timer; a bounded batch per tick keeps the window responsive
+def poll_events():
+    for event in event_bus.drain(ui_events, 200):
+        handle_event(event)
+
+    # Refresh the elapsed time of running variants
+    for variant in status_table.order:
+        if status_table.rows[variant]['state'] == 'running':
+            update_status_row(variant)
+    root.after(100, poll_events)
+
+# Rebuild the per-variant status table for a new job
+def show_status_table():
+    status_tree.delete(*status_tree.get_children())
+    for variant in status_table.order:
+        status_tree.insert('', 'end', iid=str(variant), values=status_row_values(variant))
+    status_tree.grid(row=15, column=0, columnspan=3, padx=10, pady=5, sticky="we")
+
+# Column values of one variant in the status table
+def status_row_values(variant):
+    row = status_table.rows[variant]
+    bits_per_head, bpw = variant
+    elapsed = status_table.elapsed(variant)
+    return (
+        f"{bpw}bpw H{bits_per_head}",
+        row['state'],
+        row['device'],
+        row['phase'],
+        f"{row['fraction']:.0%}",
+        progress_parser.format_duration(elapsed) if elapsed is not None else '',
+    )
+
+def update_status_row(variant):
+    if status_tree.exists(str(variant)):
+        status_tree.item(str(variant), values=status_row_values(variant))
+    else:
+        status_tree.insert('', 'end', iid=str(variant), values=status_row_values(variant))
+
+# Put the window back into its idle state after a run
+def finish_run():
+    # Stop and hide the progress bars
+    progress_bar.stop()
+    progress_bar.config(mode='indeterminate', value=0)
+    progress_bar.grid_forget()
+    variant_progress_bar.config(value=0)
+    variant_progress_bar.grid_forget()
+    progress_label.config(text="")
+    progress_label.grid_forget()
+
+    # Enable the Run buttons
+    run_button.config(state="normal")
+    resume_button.config(state="normal")
+    estimate_button.config(state="normal")
+    cancel_button.config(state="normal", text="Cancel")
+    cancel_button.grid_forget()
+
+    # Re-enable form controls
+    enable_form_controls()
 
 # Browse weights directory
 def browse_weights():
@@ -319,20 +222,52 @@ def browse_exllamav2():
         exllamav2_dir_entry.insert(0, folder_selected)  # Update the entry with the selected path
 
 # Start the run commands in a separate thread
-def start_run_commands():
-    run_button.config(state="disabled")  # Disable the Run button
+def start_run_commands(resume_dir=None):
+    # Read the form here, in the Tk thread; a resumed job only takes the GPU selection from it
+    # A new job only starts once its checked plan has been confirmed
+    if resume_dir:
+        job = {'cuda_device': cuda_device_entry.get()}
+    else:
+        plan = show_plan(confirm=True, job=collect_new_job())
+        if plan is None:
+            return
+        job = plan['job']
+
+    run_button.config(state="disabled")  # Disable the Run buttons
+    resume_button.config(state="disabled")
+    estimate_button.config(state="disabled")
 
     # Disable form controls
     disable_form_controls()
 
-    # Show the progress bar
+    # Show the progress bars
     progress_bar.grid(row=12, column=1, columnspan=2, padx=10, pady=10)  # Display the progress bar
     progress_bar.start(500)  # Start the indeterminate progress bar with a smooth speed
+    variant_progress_bar.grid(row=13, column=1, columnspan=2, padx=10, pady=5)
+    progress_label.grid(row=14, column=0, columnspan=3, padx=10, pady=5)
+
+    # Show the Cancel button
+    global cancel_token
+    cancel_token = process_control.CancelToken()
+    cancel_button.grid(row=12, column=0, padx=10, pady=10, sticky="e")
 
     # Start the run commands in a separate thread
-    thread = threading.Thread(target=run_commands_thread)
+    thread = threading.Thread(target=run_commands_thread, args=(job, resume_dir, cancel_token), daemon=True)
     thread.start()
 
+# Stop the running job: its conversions are killed right away and no new variant starts
+def cancel_run():
+    if not messagebox.askyesno("Cancel Job", "Stop the running job? Finished variants are kept and the job can be resumed later."):
+        return
+    cancel_button.config(state="disabled", text="Cancelling...")
+    cancel_token.cancel()
+
+# Pick an interrupted job directory and resume it
+def start_resume_job():
+    folder_selected = filedialog.askdirectory()
+    if folder_selected:  # Check if a directory was selected
+        start_run_commands(folder_selected)
+
 # Disable form controls
 def disable_form_controls():
     model_name_entry.config(state="disabled")
@@ -372,10 +307,18 @@ def enable_form_controls():
     exllamav2_dir_button.config(state="normal")
 
 # Check and update the configuration file version
-check_config_version()
+config_message = quant_engine.check_config_version()
+if config_message:
+    messagebox.showinfo(*config_message)
 
 # Load configuration
-config_values = load_config()
+config_values = quant_engine.load_config()
+
+# Engine events reach the window through a queue that the Tk main loop drains
+events = event_bus.EventBus()
+ui_events = events.subscribe()
+status_table = event_bus.VariantStatusTable()
+pending_dialogs = []
 
 # Create the main window
 root = tk.Tk()
@@ -432,7 +375,7 @@ bpw_label.grid(row=3, column=0, padx=10, pady=5, sticky="e")
 
 bpw_vars = []
 bpw_checkboxes = []
-bpw_options = [1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8]  # Add more options as needed
+bpw_options = [2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8]  # Add more options as needed
 
 bpw_frame = ttk.Frame(root)
 bpw_frame.grid(row=3, column=1, columnspan=2, padx=10, pady=5, sticky="w")
@@ -472,7 +415,7 @@ venv_path_button = ttk.Button(root, text="Browse", command=browse_venv, style='N
 venv_path_button.grid(row=6, column=2, padx=5, pady=5, sticky="w")
 
 # CUDA Device Entry
-cuda_device_label = ttk.Label(root, text="CUDA Device Number:", anchor="e")
+cuda_device_label = ttk.Label(root, text="CUDA Device Number(s), comma-separated:", anchor="e")
 cuda_device_label.grid(row=7, column=0, padx=10, pady=5, sticky="e")
 cuda_device_entry = ttk.Entry(root, width=50)
 cuda_device_entry.grid(row=7, column=1, columnspan=2, padx=10, pady=5, sticky="w")
@@ -508,9 +451,33 @@ progress_bar = ttk.Progressbar(root, mode='indeterminate', length=200)
 progress_bar.grid(row=12, column=1, columnspan=2, padx=10, pady=10)
 progress_bar.grid_forget()  # Hide the progress bar initially
 
+# Per-variant progress and status line, shown while a job runs
+variant_progress_bar = ttk.Progressbar(root, mode='determinate', length=200, maximum=100)
+progress_label = ttk.Label(root, text="")
+
 # Run Button
 run_button = ttk.Button(root, text="Run", command=start_run_commands, style='Nice.TButton')
-run_button.grid(row=11, column=1, columnspan=2, padx=10, pady=20, sticky="w")
+run_button.grid(row=11, column=1, padx=10, pady=20, sticky="w")
+
+# Resume Button
+resume_button = ttk.Button(root, text="Resume Job", command=start_resume_job, style='Nice.TButton')
+resume_button.grid(row=11, column=2, padx=5, pady=20, sticky="w")
+
+# Cancel Button, shown while a job runs
+cancel_token = None
+cancel_button = ttk.Button(root, text="Cancel", command=cancel_run, style='Nice.TButton')
+
+# Plan Button
+estimate_button = ttk.Button(root, text="Show Plan", command=show_plan, style='Nice.TButton')
+estimate_button.grid(row=11, column=0, padx=10, pady=20, sticky="e")
+
+# Per-variant status table, shown once a job starts
+status_columns = ('variant', 'state', 'device', 'phase', 'progress', 'elapsed')
+status_tree = ttk.Treeview(root, columns=status_columns, show='headings', height=8)
+for column in status_columns:
+    status_tree.heading(column, text=column.capitalize())
+    status_tree.column(column, width=90, anchor="center")
 
 # Start the GUI event loop
+root.after(100, poll_events)
 root.mainloop()
@@ -0,0 +1,217 @@
+# Long-lived conversion worker. Run inside the exllamav2 virtual environment, one per GPU,
+# it imports torch and exllamav2 once and then runs convert.py in-process for every job it is sent.
+#
+# Protocol (one JSON object per line):
+#   stdin:  {"id": 1, "argv": ["-i", "...", "-o", "..."]}   or   {"command": "exit"}
+#   stdout: convert.py's normal output, plus control lines starting with CONTROL_PREFIX:
+#           {"event": "ready"} once imports are done, {"event": "done", "id": 1, "returncode": 0} after each job
+import argparse
+import contextlib
+import json
+import os
+import queue
+import runpy
+import subprocess
+import sys
+import threading
+import traceback
+import process_control
+from progress_parser import start_line_reader
+
+# Marks protocol lines in the worker's stdout
+CONTROL_PREFIX = '@@convert_worker '
+
+# Write a protocol line after flushing any pending job output
+def send_control(message):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    sys.stdout.write(CONTROL_PREFIX + json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+# Import the heavy modules up front so every job skips their startup cost
+def preload():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.init()
+    except ImportError:
+        pass
+    try:
+        import exllamav2  # noqa: F401
+    except ImportError:
+        pass
+
+# Free what a finished job left behind on the GPU
+def release_memory():
+    import gc
+    gc.collect()
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+# Run convert.py in this interpreter as if it had been started from the command line
+def run_convert(convert_script_path, argv):
+    saved_argv = sys.argv
+    sys.argv = [convert_script_path] + list(argv)
+    try:
+        runpy.run_path(convert_script_path, run_name='__main__')
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.argv = saved_argv
+        release_memory()
+
+# Worker main loop: read jobs from stdin until told to exit
+def serve(exllamav2_dir, no_preload=False):
+    convert_script_path = os.path.join(exllamav2_dir, 'convert.py')
+
+    # convert.py imports its neighbours the same way it would when run as a script
+    sys.path.insert(0, exllamav2_dir)
+    if not no_preload:
+        preload()
+    send_control({'event': 'ready', 'pid': os.getpid()})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get('command') == 'exit':
+            break
+        returncode = run_convert(convert_script_path, request['argv'])
+        send_control({'event': 'done', 'id': request['id'], 'returncode': returncode})
+
+# Raised when a worker exits or breaks the protocol
+class WorkerError(RuntimeError):
+    pass
+
+# Engine-side handle on one worker process pinned to a GPU
+class WorkerClient:
+    def __init__(self, command, cuda_device):
+        self.command = command
+        self.cuda_device = cuda_device
+        self.process = None
+        self.lines = queue.Queue()
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    # Start the worker and wait until its imports are done
+    def start(self):
+        env = os.environ.copy()
+        env['CUDA_VISIBLE_DEVICES'] = str(self.cuda_device)
+        env['PYTHONUNBUFFERED'] = '1'
+        self.process = process_control.start_process(self.command, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.lines = queue.Queue()
+        start_line_reader(self.process.stdout, self.lines)
+
+        startup_output = []
+        while True:
+            line = self.lines.get()
+            if line is None:
+                self.process.wait()
+                raise WorkerError(f"Worker on GPU {self.cuda_device} exited during startup: {' | '.join(startup_output[-5:])}")
+            message = self.parse_control(line)
+            if message and message.get('event') == 'ready':
+                return
+            startup_output.append(line)
+
+    # Decode a protocol line, or None for ordinary output
+    @staticmethod
+    def parse_control(line):
+        if line.startswith(CONTROL_PREFIX):
+            return json.loads(line[len(CONTROL_PREFIX):])
+        return None
+
+    # Check whether the worker process is still running
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    # Run one convert.py job; every output line is passed to on_line. Returns the exit code.
+    # A tripped watchdog kills the worker (it is restarted for the next job) and raises ConvertStopped.
+    def run(self, argv, on_line, watchdog=None):
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+            watchdog = watchdog or process_control.Watchdog(None)
+
+            request_id = self.next_id
+            self.next_id += 1
+            try:
+                self.process.stdin.write((json.dumps({'id': request_id, 'argv': argv}) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+            except OSError as e:
+                raise WorkerError(f"Worker on GPU {self.cuda_device} is not accepting jobs: {e}")
+
+            watchdog.register(self.process)
+            try:
+                while True:
+                    line = process_control.next_line(self.process, self.lines, watchdog)
+                    if line is None:
+                        self.process.wait()
+                        raise WorkerError(f"Worker on GPU {self.cuda_device} exited with code {self.process.returncode} during a job")
+                    message = self.parse_control(line)
+                    if message is None:
+                        on_line(line)
+                    elif message.get('event') == 'done' and message.get('id') == request_id:
+                        return message['returncode']
+            finally:
+                watchdog.unregister(self.process)
+                if not self.is_alive():
+                    process_control.forget_process(self.process)
+
+    # Ask the worker to exit, killing it if it does not
+    def close(self):
+        if not self.is_alive():
+            return
+        try:
+            self.process.stdin.write((json.dumps({'command': 'exit'}) + '\n').encode('utf-8'))
+            self.process.stdin.close()
+            self.process.wait(timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            process_control.kill_process_group(self.process)
+        process_control.forget_process(self.process)
+
+# Keeps warm workers per (start command, GPU), started on first use. Normally there is one per GPU;
+# when several conversions share a GPU at once, each gets its own worker.
+class WorkerPool:
+    def __init__(self):
+        self.workers = {}
+        self.busy = set()
+        self.lock = threading.Lock()
+
+    # Borrow an idle worker for a start command and GPU, creating one if all are busy
+    @contextlib.contextmanager
+    def lease(self, command, cuda_device):
+        key = (command, str(cuda_device))
+        with self.lock:
+            workers = self.workers.setdefault(key, [])
+            worker = next((worker for worker in workers if worker not in self.busy), None)
+            if worker is None:
+                worker = WorkerClient(command, cuda_device)
+                workers.append(worker)
+            self.busy.add(worker)
+        try:
+            yield worker
+        finally:
+            with self.lock:
+                self.busy.discard(worker)
+
+    # Shut down every worker
+    def close(self):
+        with self.lock:
+            workers = [worker for key_workers in self.workers.values() for worker in key_workers]
+            self.workers = {}
+        for worker in workers:
+            worker.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Warm exllamav2 conversion worker")
+    parser.add_argument('--exllamav2-dir', required=True, help="Directory containing exllamav2's convert.py")
+    parser.add_argument('--no-preload', action='store_true', help="Skip importing torch and exllamav2 at startup")
+    args = parser.parse_args()
+    serve(args.exllamav2_dir, args.no_preload)
@@ -0,0 +1,462 @@
+import collections
+import hmac
+import itertools
+import json
+import os
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from job_manifest import variant_key
+from output_manifest import hash_file
+
+# Agents send a heartbeat this often, in seconds
+HEARTBEAT_INTERVAL = 5
+
+# An agent not heard from for this long is considered dead and its variants are handed to other agents
+HEARTBEAT_TIMEOUT = 30
+
+# Times a variant is handed out again after its agent died before it is given up as failed
+MAX_ATTEMPTS = 3
+
+# Seconds a job waits while variants are pending and no live agent is connected, before they are failed
+AGENT_WAIT_TIMEOUT = 600
+
+# How often a waiting job checks the cancel flag and the agent timeout, in seconds
+WAIT_POLL_INTERVAL = 1.0
+
+# Header carrying the shared token, when one is configured
+TOKEN_HEADER = 'X-Quantizer-Token'
+
+# Bytes read from or written to a socket at once when moving artifacts
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+
+# Raised by the client helpers when the coordinator answers with an error status
+class CoordinatorError(RuntimeError):
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+# Check that an artifact path stays inside its output directory
+def safe_relative_path(relative_path):
+    normalized = os.path.normpath(relative_path)
+    if os.path.isabs(normalized) or normalized.startswith('..') or normalized in ('', '.'):
+        raise ValueError(f"Invalid artifact path '{relative_path}'")
+    return normalized
+
+# Send one request to the coordinator; returns the decoded JSON answer, or the raw body for binary answers
+def request(base_url, path, payload=None, method=None, token=None, body=None, headers=None, timeout=60):
+    headers = dict(headers or {})
+    if token:
+        headers[TOKEN_HEADER] = token
+    if payload is not None:
+        body = json.dumps(payload).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    http_request = urllib.request.Request(base_url.rstrip('/') + path, data=body, method=method or ('POST' if body is not None else 'GET'), headers=headers)
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            data = response.read()
+            if response.headers.get('Content-Type') == 'application/json':
+                return json.loads(data)
+            return data
+    except urllib.error.HTTPError as e:
+        raise CoordinatorError(e.code, e.read().decode('utf-8', errors='replace'))
+
+# Hands the variants of a job to remote agents over HTTP and collects their outputs.
+# The coordinator keeps the job directory, the manifest and measurement.json; agents lease one
+# variant at a time, send heartbeats while they work, upload the finished files and report back.
+class Coordinator:
+    def __init__(self, host='127.0.0.1', port=8765, token=None, heartbeat_interval=HEARTBEAT_INTERVAL, heartbeat_timeout=HEARTBEAT_TIMEOUT, max_attempts=MAX_ATTEMPTS, agent_wait_timeout=AGENT_WAIT_TIMEOUT):
+        self.token = token
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.agent_wait_timeout = agent_wait_timeout
+        self.condition = threading.Condition()
+        self.agents = {}
+        self.leases = {}
+        self.pending = collections.deque()
+        self.attempts = {}
+        self.remaining = 0
+        self.context = None
+        self.job_id = 0
+        self.job_key = None
+        self.measurement_sha256 = None
+        self.closing = False
+        self.ids = itertools.count(1)
+
+        coordinator = self
+
+        class Handler(CoordinatorHandler):
+            pass
+        Handler.coordinator = coordinator
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+        self.monitor_thread.start()
+
+    # URL agents should use to reach this coordinator
+    def url(self):
+        return f"http://{self.address[0]}:{self.address[1]}"
+
+    # Run a job's variants on the agents and block until each one is done or has failed.
+    # context carries the job, job_dir, measurement_json_path, manifest, postprocessor,
+    # reporter, report_progress(variant, event) and finish_variant(variant, agent, succeeded).
+    # With cancel_token, a cancel returns at once and leaves the unfinished variants pending for a resume.
+    # Pending variants fail when no live agent has been connected for agent_wait_timeout seconds.
+    def run(self, variants, context, cancel_token=None):
+        # Agents cache measurement.json by job key and check it against the hash, so a later job never reuses it
+        measurement_sha256 = hash_file(context['measurement_json_path'])
+        with self.condition:
+            self.job_id += 1
+            self.job_key = uuid.uuid4().hex
+            self.measurement_sha256 = measurement_sha256
+            self.context = context
+            self.pending = collections.deque(variants)
+            self.attempts = {variant: 0 for variant in variants}
+            self.remaining = len(variants)
+            context['reporter'].notice(f"Waiting for agents at {self.url()} to take {len(variants)} variants")
+            without_agents_since = None
+            while self.remaining > 0:
+                if cancel_token and cancel_token.is_cancelled():
+                    self.stop_job()
+                    break
+                if self.pending and not any(agent['alive'] for agent in self.agents.values()):
+                    without_agents_since = without_agents_since or time.monotonic()
+                    if time.monotonic() - without_agents_since > self.agent_wait_timeout:
+                        self.fail_pending(f"No agent connected for {self.agent_wait_timeout / 60:g} minutes")
+                        self.stop_job()
+                        break
+                else:
+                    without_agents_since = None
+                self.condition.wait(WAIT_POLL_INTERVAL)
+            self.context = None
+
+    # Fail every variant no agent has taken yet (caller holds the lock)
+    def fail_pending(self, error):
+        while self.pending:
+            self.fail_variant({'variant': self.pending.popleft(), 'agent_name': '-', 'job_id': self.job_id}, error)
+
+    # Stop handing out the current job: drop its queue and leases, so late results are rejected and the
+    # agents discard their work; leased variants go back to pending in the manifest (caller holds the lock)
+    def stop_job(self):
+        self.pending.clear()
+        for lease_id in [lease_id for lease_id, lease in self.leases.items() if lease['job_id'] == self.job_id]:
+            lease = self.leases.pop(lease_id)
+            shutil.rmtree(lease['staging_dir'], ignore_errors=True)
+            self.context['manifest'].update_variant(*lease['variant'], state='pending', agent=None)
+
+    # Tell agents there is no more work, give them a moment to hear it, and stop serving
+    def close(self):
+        deadline = time.monotonic() + 2 * self.heartbeat_interval
+        with self.condition:
+            self.closing = True
+            while any(agent['alive'] and not agent['told_done'] for agent in self.agents.values()):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self.condition.wait(left)
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Drop agents that stopped sending heartbeats and queue their variants again
+    def monitor(self):
+        while True:
+            time.sleep(max(0.2, self.heartbeat_interval / 2))
+            with self.condition:
+                now = time.monotonic()
+                for agent_id, agent in self.agents.items():
+                    if agent['alive'] and now - agent['last_seen'] > self.heartbeat_timeout:
+                        agent['alive'] = False
+                        if self.context:
+                            self.context['reporter'].notice(f"Agent {agent['name']} stopped responding")
+                        for lease_id in [lease_id for lease_id, lease in self.leases.items() if lease['agent_id'] == agent_id]:
+                            self.release_lease(lease_id, f"agent {agent['name']} stopped responding")
+
+    # Give a leased variant back: requeue it, or fail it when it has been tried too often (caller holds the lock)
+    def release_lease(self, lease_id, reason):
+        lease = self.leases.pop(lease_id)
+        shutil.rmtree(lease['staging_dir'], ignore_errors=True)
+        if lease['job_id'] != self.job_id or not self.context:
+            return
+        variant = lease['variant']
+        self.attempts[variant] += 1
+        if self.attempts[variant] < self.max_attempts:
+            self.context['manifest'].update_variant(*variant, state='pending', agent=None, error=reason)
+            self.pending.appendleft(variant)
+        else:
+            self.fail_variant(lease, f"Gave up after {self.attempts[variant]} attempts, last: {reason}")
+
+    # Record a failed variant (caller holds the lock). context is the lease's job, which is passed
+    # explicitly when the failure may arrive after run() has returned.
+    def fail_variant(self, lease, error, context=None):
+        context = context or self.context
+        bits_per_head, bpw = lease['variant']
+        context['manifest'].update_variant(bits_per_head, bpw, state='failed', error=error)
+        context['reporter'].error("Agent Error", f"{bpw}bpw H{bits_per_head} on {lease['agent_name']} failed: {error}")
+        context['finish_variant'](lease['variant'], lease['agent_name'], False)
+        self.variant_settled(lease)
+
+    # One variant of the running job is completely done or failed (caller holds the lock)
+    def variant_settled(self, lease):
+        if lease['job_id'] != self.job_id:
+            return
+        self.remaining -= 1
+        self.condition.notify_all()
+
+    # The lease with this id, if the agent holds it; raises KeyError otherwise (caller holds the lock)
+    def owned_lease(self, lease_id, agent_id):
+        lease = self.leases.get(lease_id)
+        if lease is None or lease['agent_id'] != agent_id:
+            raise KeyError(lease_id)
+        return lease
+
+    # Look up a live agent for a request; raises KeyError when it is unknown or was declared dead
+    def touch_agent(self, agent_id):
+        agent = self.agents.get(agent_id)
+        if agent is None or not agent['alive']:
+            raise KeyError(agent_id)
+        agent['last_seen'] = time.monotonic()
+        return agent
+
+    def register(self, payload):
+        with self.condition:
+            agent_id = f"agent-{next(self.ids)}"
+            self.agents[agent_id] = {
+                'name': payload.get('name') or agent_id,
+                'devices': payload.get('devices', []),
+                'last_seen': time.monotonic(),
+                'alive': True,
+                'told_done': False,
+            }
+            return {'agent_id': agent_id, 'heartbeat_interval': self.heartbeat_interval, 'heartbeat_timeout': self.heartbeat_timeout}
+
+    def heartbeat(self, payload):
+        with self.condition:
+            self.touch_agent(payload['agent_id'])
+            cancelled = []
+            for lease_id, event in payload.get('progress', {}).items():
+                lease = self.leases.get(lease_id)
+                if lease is None or lease['agent_id'] != payload['agent_id']:
+                    cancelled.append(lease_id)
+                elif event and self.context:
+                    self.context['report_progress'](lease['variant'], event)
+            return {'cancelled': cancelled}
+
+    def lease(self, payload):
+        with self.condition:
+            agent = self.touch_agent(payload['agent_id'])
+            if self.closing:
+                agent['told_done'] = True
+                self.condition.notify_all()
+                return {'done': True}
+            if not self.context or not self.pending:
+                return {'wait': self.heartbeat_interval}
+
+            variant = self.pending.popleft()
+            bits_per_head, bpw = variant
+            job = self.context['job']
+            lease_id = f"lease-{next(self.ids)}"
+            agent_name = f"{agent['name']}/{payload.get('device', '')}"
+            staging_dir = os.path.join(self.context['job_dir'], f".upload_{variant_key(bits_per_head, bpw)}_{lease_id}")
+            self.leases[lease_id] = {
+                'variant': variant,
+                'agent_id': payload['agent_id'],
+                'agent_name': agent_name,
+                'job_id': self.job_id,
+                'staging_dir': staging_dir,
+            }
+            self.context['manifest'].update_variant(bits_per_head, bpw, state='running', phase='convert', agent=agent_name, error=None)
+            return {
+                'lease': {
+                    'lease_id': lease_id,
+                    'job_id': self.job_id,
+                    'job_key': self.job_key,
+                    'measurement_sha256': self.measurement_sha256,
+                    'model_name': job['model_name'],
+                    'author_name': job['author_name'],
+                    'raw_weights_dir': job['raw_weights_dir'],
+                    'bits_per_head': bits_per_head,
+                    'bpw': bpw,
+                }
+            }
+
+    # Path of measurement.json for a lease of the agent
+    def measurement_path(self, lease_id, agent_id):
+        with self.condition:
+            self.owned_lease(lease_id, agent_id)
+            if not self.context:
+                raise KeyError(lease_id)
+            return self.context['measurement_json_path']
+
+    # Staging path for an uploaded file of a lease of the agent
+    def artifact_path(self, lease_id, agent_id, relative_path):
+        with self.condition:
+            lease = self.owned_lease(lease_id, agent_id)
+            return os.path.join(lease['staging_dir'], safe_relative_path(relative_path))
+
+    def report(self, payload):
+        with self.condition:
+            self.touch_agent(payload['agent_id'])
+            lease = self.owned_lease(payload['lease_id'], payload['agent_id'])
+            del self.leases[payload['lease_id']]
+            if not payload.get('succeeded'):
+                shutil.rmtree(lease['staging_dir'], ignore_errors=True)
+                self.fail_variant(lease, payload.get('error') or "Conversion failed on the agent")
+                return {}
+
+            # Every reported file must have arrived complete
+            for relative_path, size in payload.get('files', {}).items():
+                path = os.path.join(lease['staging_dir'], safe_relative_path(relative_path))
+                if not os.path.isfile(path) or os.path.getsize(path) != size:
+                    self.leases[payload['lease_id']] = lease
+                    self.release_lease(payload['lease_id'], f"incomplete upload of {relative_path}")
+                    return {}
+            context = self.context
+
+        # Place the uploaded output like a local one; post-processing may block while its queue is full
+        bits_per_head, bpw = lease['variant']
+        context['manifest'].update_variant(bits_per_head, bpw, phase='finalize')
+        item = {
+            'variant': lease['variant'],
+            'job_dir': context['job_dir'],
+            'temp_quant_dir': None,
+            'compile_dir': lease['staging_dir'],
+            'output_dir': context['output_dir_for'](lease['variant']),
+            'measurement_json_path': context['measurement_json_path'],
+            'manifest': context['manifest'],
+        }
+
+        # The job may have ended (cancel, agent timeout) by the time this runs, so use its own context
+        def on_postprocessed(error):
+            with self.condition:
+                if error is None:
+                    context['finish_variant'](lease['variant'], lease['agent_name'], True)
+                    self.variant_settled(lease)
+                else:
+                    self.fail_variant(lease, f"Post-processing failed: {error}", context)
+
+        context['postprocessor'].submit(item, on_postprocessed)
+        return {}
+
+    # Snapshot of agents and leases for monitoring
+    def status(self):
+        with self.condition:
+            now = time.monotonic()
+            return {
+                'job_id': self.job_id,
+                'remaining': self.remaining,
+                'pending': [variant_key(*variant) for variant in self.pending],
+                'agents': {
+                    agent_id: {'name': agent['name'], 'alive': agent['alive'], 'seconds_since_heartbeat': round(now - agent['last_seen'], 1)}
+                    for agent_id, agent in self.agents.items()
+                },
+                'leases': {lease_id: {'variant': variant_key(*lease['variant']), 'agent': lease['agent_name']} for lease_id, lease in self.leases.items()},
+            }
+
+# HTTP front end of the coordinator
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    coordinator = None
+
+    # Keep the console for job output
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        token = self.coordinator.token
+        if token and not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ''), token):
+            self.send_json(403, {'error': 'bad token'})
+            return False
+        return True
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        routes = {
+            '/register': self.coordinator.register,
+            '/heartbeat': self.coordinator.heartbeat,
+            '/lease': self.coordinator.lease,
+            '/report': self.coordinator.report,
+        }
+        route = routes.get(urllib.parse.urlparse(self.path).path)
+        if route is None:
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            self.send_json(200, route(self.read_json()))
+        except KeyError as e:
+            # Unknown or dead agent, or a lease that was handed to someone else
+            self.send_json(410, {'error': f"unknown {e}"})
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {'error': str(e)})
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/status':
+            self.send_json(200, self.coordinator.status())
+        elif url.path == '/measurement':
+            try:
+                path = self.coordinator.measurement_path(query.get('lease', [''])[0], query.get('agent', [''])[0])
+            except KeyError as e:
+                self.send_json(410, {'error': f"unknown {e}"})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.path.getsize(path)))
+            self.end_headers()
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile, TRANSFER_CHUNK_SIZE)
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    # Upload of one output file: PUT /artifact?lease=<id>&agent=<agent id>&path=<relative path>
+    def do_PUT(self):
+        if not self.authorized():
+            return
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path != '/artifact':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            path = self.coordinator.artifact_path(query.get('lease', [''])[0], query.get('agent', [''])[0], query.get('path', [''])[0])
+        except KeyError as e:
+            self.send_json(410, {'error': f"unknown {e}"})
+            return
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        remaining = int(self.headers.get('Content-Length') or 0)
+        with open(path, 'wb') as f:
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, TRANSFER_CHUNK_SIZE))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        self.send_json(200 if remaining == 0 else 400, {'received': os.path.getsize(path)})
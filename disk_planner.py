@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import shutil
+from measurement_cache import read_safetensors_header
+
+# Bytes per element of the safetensors dtypes we expect in raw weights
+DTYPE_SIZES = {
+    'F64': 8, 'F32': 4, 'F16': 2, 'BF16': 2, 'F8_E4M3': 1, 'F8_E5M2': 1,
+    'I64': 8, 'I32': 4, 'I16': 2, 'I8': 1, 'U8': 1, 'BOOL': 1,
+}
+
+# Calibration defaults of exllamav2's convert.py: rows x length tokens, fp16 hidden states
+MEASUREMENT_ROWS = 16
+QUANTIZATION_ROWS = 100
+CALIBRATION_LENGTH = 2048
+
+# Headroom for files the estimate does not cover (job state, shard rounding, filesystem overhead)
+SAFETY_MARGIN = 1.1
+
+# Raised when the planned job does not fit on disk
+class DiskSpaceError(RuntimeError):
+    pass
+
+# Count the parameters of a model from its safetensors headers
+def read_parameter_count(raw_weights_dir):
+    parameter_count = 0
+    for file_name in os.listdir(raw_weights_dir):
+        if not file_name.endswith('.safetensors'):
+            continue
+        header = json.loads(read_safetensors_header(os.path.join(raw_weights_dir, file_name)))
+        for name, tensor in header.items():
+            if name == '__metadata__':
+                continue
+            parameter_count += math.prod(tensor['shape'])
+    return parameter_count
+
+# Read the settings that decide how large hidden states and the head layer are
+def read_model_config(raw_weights_dir):
+    try:
+        with open(os.path.join(raw_weights_dir, 'config.json')) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return config.get('text_config', config)
+
+# Size of the non-weight files (tokenizer, configs) convert.py copies into every output
+def companion_files_size(raw_weights_dir):
+    total = 0
+    for file_name in os.listdir(raw_weights_dir):
+        path = os.path.join(raw_weights_dir, file_name)
+        if os.path.isfile(path) and not file_name.endswith(('.safetensors', '.bin', '.pt', '.pth')):
+            total += os.path.getsize(path)
+    return total
+
+# Estimate the final output and peak scratch size of one variant, in bytes
+def estimate_variant(parameter_count, config, companion_bytes, bits_per_head, bpw, staged_output=False):
+    hidden_size = config.get('hidden_size', 0)
+    head_parameters = config.get('vocab_size', 0) * hidden_size
+    body_parameters = max(parameter_count - head_parameters, 0)
+
+    quantized_bytes = body_parameters * float(bpw) / 8 + head_parameters * float(bits_per_head) / 8
+    output_bytes = quantized_bytes + companion_bytes
+
+    # convert.py keeps the quantized tensors plus input and output hidden states in its work directory;
+    # with a scratch directory the compiled output is also assembled there before it is moved
+    hidden_state_bytes = 2 * QUANTIZATION_ROWS * CALIBRATION_LENGTH * hidden_size * 2
+    scratch_bytes = quantized_bytes + hidden_state_bytes
+    if staged_output:
+        scratch_bytes += output_bytes
+
+    return {
+        'output_bytes': int(output_bytes * SAFETY_MARGIN),
+        'scratch_bytes': int(scratch_bytes * SAFETY_MARGIN),
+    }
+
+# Estimate the peak scratch size of the measurement pass, in bytes
+def estimate_measurement_scratch(config):
+    hidden_size = config.get('hidden_size', 0)
+    return int(2 * MEASUREMENT_ROWS * CALIBRATION_LENGTH * hidden_size * 2 * SAFETY_MARGIN)
+
+# Free space of the filesystem a path is (or will be) created on
+def free_space(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return shutil.disk_usage(path).free
+
+# Check whether two paths (existing or not) live on the same filesystem
+def same_filesystem(first, second):
+    def existing(path):
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return path
+    return os.stat(existing(first)).st_dev == os.stat(existing(second)).st_dev
+
+# Check that a job fits on disk, reordering variants if that makes it fit.
+# Outputs accumulate over the job while scratch is freed after each variant, and up to
+# `concurrency` variants hold scratch at the same time. Returns (ordered variants, plan rows);
+# raises DiskSpaceError naming the variants that do not fit.
+def plan_disk_usage(variants, estimates, measurement_scratch, output_root, scratch_root, concurrency):
+    output_free = free_space(output_root)
+    scratch_free = free_space(scratch_root)
+    shared = same_filesystem(output_root, scratch_root)
+
+    # Simulate the job in a given order and return the variants that would not fit
+    def simulate(order):
+        output_used = 0
+        failures = []
+        scratch_peaks = sorted((estimates[variant]['scratch_bytes'] for variant in order), reverse=True)
+        # Worst case: this variant runs next to the largest other scratch users
+        concurrent_scratch = sum(scratch_peaks[:max(concurrency - 1, 0)])
+        if measurement_scratch > scratch_free:
+            failures.append(None)
+        for variant in order:
+            estimate = estimates[variant]
+            scratch_needed = estimate['scratch_bytes'] + concurrent_scratch
+            output_needed = output_used + estimate['output_bytes']
+            if shared:
+                fits = output_needed + scratch_needed <= output_free
+            else:
+                fits = output_needed <= output_free and scratch_needed <= scratch_free
+            if fits:
+                output_used = output_needed
+            else:
+                failures.append(variant)
+        return failures
+
+    order = list(variants)
+    failures = simulate(order)
+
+    # On a shared disk, running the variants with the largest scratch first uses it while it is emptiest
+    if failures and shared:
+        reordered = sorted(order, key=lambda variant: estimates[variant]['scratch_bytes'], reverse=True)
+        if len(simulate(reordered)) < len(failures):
+            order = reordered
+            failures = simulate(order)
+
+    plan = [dict(estimates[variant], variant=variant) for variant in order]
+    if failures:
+        names = ["measurement" if variant is None else f"{variant[1]}bpw H{variant[0]}" for variant in failures]
+        raise DiskSpaceError(
+            f"Not enough disk space for: {', '.join(names)}. "
+            f"Needs about {format_bytes(sum(row['output_bytes'] for row in plan))} of output space "
+            f"({format_bytes(output_free)} free) and {format_bytes(max(row['scratch_bytes'] for row in plan))} "
+            f"of scratch space per running variant ({format_bytes(scratch_free)} free)."
+        )
+    return order, plan
+
+# Format a byte count for messages
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+# Move a finished directory into place. A rename is atomic on the same filesystem; across
+# filesystems the copy goes to a temporary name next to the destination and is renamed at the end.
+def move_into_place(source, destination):
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    try:
+        os.replace(source, destination)
+        return
+    except OSError:
+        pass
+
+    partial = f"{destination}.partial"
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    shutil.copytree(source, partial)
+    os.replace(partial, destination)
+    shutil.rmtree(source)
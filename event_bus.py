@@ -0,0 +1,185 @@
+import json
+import queue
+import sys
+import threading
+import time
+
+# Fans engine events out to any number of consumers (the GUI, a JSON-lines log, ...).
+# Events are plain JSON-friendly dicts with a 'type' and a 'time'; publishing never blocks,
+# so engine threads are not held up by a slow consumer.
+class EventBus:
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    # New queue receiving every event published from now on
+    def subscribe(self):
+        subscriber = queue.Queue()
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.remove(subscriber)
+
+    def publish(self, event):
+        event = dict(event, time=event.get('time', time.time()))
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put_nowait(event)
+
+# Take up to `limit` waiting events from a subscriber queue without blocking
+def drain(subscriber, limit=None):
+    events = []
+    while limit is None or len(events) < limit:
+        try:
+            events.append(subscriber.get_nowait())
+        except queue.Empty:
+            break
+    return events
+
+# Variant key used in events: [bits_per_head, bpw], or None for the measurement
+def encode_variant(variant):
+    return list(variant) if variant is not None else None
+
+def decode_variant(variant):
+    return tuple(variant) if variant is not None else None
+
+# Reporter publishing every engine callback as an event instead of acting on it
+class BusReporter:
+    def __init__(self, bus):
+        self.bus = bus
+
+    def job_started(self, job, total_variants):
+        variants = [[bits_per_head, bpw] for bits_per_head in job['bits_per_head'] for bpw in job['bpw_values']]
+        self.bus.publish({'type': 'job_started', 'model_name': job['model_name'], 'total_variants': total_variants, 'variants': variants})
+
+    def progress(self, variant, event):
+        self.bus.publish({'type': 'progress', 'variant': encode_variant(variant), 'event': event})
+
+    def variant_finished(self, variant, cuda_device, succeeded):
+        self.bus.publish({'type': 'variant_finished', 'variant': encode_variant(variant), 'device': str(cuda_device), 'succeeded': succeeded})
+
+    def variant_skipped(self, variant):
+        self.bus.publish({'type': 'variant_skipped', 'variant': encode_variant(variant)})
+
+    def notice(self, message):
+        self.bus.publish({'type': 'notice', 'message': message})
+
+    def info(self, title, message):
+        self.bus.publish({'type': 'info', 'title': title, 'message': message})
+
+    def warning(self, title, message):
+        self.bus.publish({'type': 'warning', 'title': title, 'message': message})
+
+    def error(self, title, message):
+        self.bus.publish({'type': 'error', 'title': title, 'message': message})
+
+# Hand an event back to an ordinary reporter, so any reporter can consume the stream
+def replay(event, reporter):
+    kind = event['type']
+    if kind == 'progress':
+        reporter.progress(decode_variant(event['variant']), event['event'])
+    elif kind == 'variant_finished':
+        reporter.variant_finished(decode_variant(event['variant']), event['device'], event['succeeded'])
+    elif kind == 'variant_skipped':
+        reporter.variant_skipped(decode_variant(event['variant']))
+    elif kind == 'notice':
+        reporter.notice(event['message'])
+    elif kind in ('info', 'warning', 'error'):
+        getattr(reporter, kind)(event['title'], event['message'])
+    elif kind == 'job_started':
+        job = {'model_name': event['model_name'], 'variants': event['variants']}
+        reporter.job_started(job, event['total_variants'])
+
+# Live state of every variant (queued, running, done, failed, skipped) built from the event stream
+class VariantStatusTable:
+    def __init__(self):
+        self.rows = {}
+        self.order = []
+
+    def row(self, variant):
+        if variant not in self.rows:
+            self.rows[variant] = {'variant': variant, 'state': 'queued', 'device': '', 'phase': '', 'fraction': 0.0, 'started': None, 'finished': None}
+            self.order.append(variant)
+        return self.rows[variant]
+
+    # Update the table from one event; returns the variant whose row changed, or None
+    def apply(self, event):
+        kind = event['type']
+        if kind == 'job_started':
+            self.rows = {}
+            self.order = []
+            for variant in event['variants']:
+                self.row(tuple(variant))
+            return None
+        if kind not in ('progress', 'variant_finished', 'variant_skipped') or event['variant'] is None:
+            return None
+
+        variant = decode_variant(event['variant'])
+        row = self.row(variant)
+        if kind == 'progress':
+            progress = event['event']
+            if progress['phase'] in ('done', 'failed', 'skipped'):
+                return variant
+            if row['state'] == 'queued':
+                row['state'] = 'running'
+                row['started'] = event['time']
+            row['phase'] = progress['phase']
+            row['fraction'] = progress['fraction']
+        elif kind == 'variant_finished':
+            row['state'] = 'done' if event['succeeded'] else 'failed'
+            row['device'] = event['device']
+            row['fraction'] = 1.0 if event['succeeded'] else row['fraction']
+            row['finished'] = event['time']
+            row['started'] = row['started'] or event['time']
+        else:
+            row['state'] = 'skipped'
+            row['fraction'] = 1.0
+        return variant
+
+    # Seconds a variant has been running, or ran for
+    def elapsed(self, variant, now=None):
+        row = self.rows[variant]
+        if row['started'] is None:
+            return None
+        return (row['finished'] or now or time.time()) - row['started']
+
+# Call handle(event) for every event on a background thread; returns a function that stops it
+# once the events published so far have been handled
+def start_consumer(bus, handle):
+    subscriber = bus.subscribe()
+
+    def consume():
+        while True:
+            event = subscriber.get()
+            if event is None:
+                return
+            handle(event)
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+
+    def stop():
+        bus.unsubscribe(subscriber)
+        subscriber.put(None)
+        thread.join()
+    return stop
+
+# Stream the bus to a JSON-lines file ('-' for standard output); returns a function that stops it
+def start_json_lines_writer(bus, path):
+    stream = sys.stdout if path == '-' else open(path, 'a', encoding='utf-8')
+
+    def write(event):
+        stream.write(json.dumps(event) + '\n')
+        stream.flush()
+
+    stop_consumer = start_consumer(bus, write)
+
+    def stop():
+        stop_consumer()
+        if stream is not sys.stdout:
+            stream.close()
+    return stop
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+# File name of the manifest inside a job directory
+MANIFEST_NAME = 'job_manifest.json'
+
+# Key identifying a variant in the manifest (e.g. "4.5bpw_H6")
+def variant_key(bits_per_head, bpw):
+    return f"{bpw}bpw_H{bits_per_head}"
+
+# Record the size of every file in an output directory
+def list_output_files(output_dir):
+    files = {}
+    for dir_path, _, file_names in os.walk(output_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            files[os.path.relpath(path, output_dir)] = os.path.getsize(path)
+    return files
+
+# Persistent record of a job's settings and the state of its measurement and variants.
+# Every change is written straight to disk so a crashed or rebooted job can be resumed.
+class JobManifest:
+    def __init__(self, job_dir, data):
+        self.job_dir = job_dir
+        self.path = os.path.join(job_dir, MANIFEST_NAME)
+        self.data = data
+        self.lock = threading.Lock()
+
+    # Start a new manifest with every variant pending
+    @classmethod
+    def create(cls, job_dir, job, variants):
+        data = {
+            'version': 1,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'job': job,
+            'measurement': {'state': 'pending'},
+            'variants': {},
+        }
+        for bits_per_head, bpw in variants:
+            data['variants'][variant_key(bits_per_head, bpw)] = {
+                'bits_per_head': bits_per_head,
+                'bpw': bpw,
+                'state': 'pending',
+                'phase': None,
+            }
+        manifest = cls(job_dir, data)
+        manifest.save()
+        return manifest
+
+    # Load the manifest of an existing job directory
+    @classmethod
+    def load(cls, job_dir):
+        with open(os.path.join(job_dir, MANIFEST_NAME)) as f:
+            return cls(job_dir, json.load(f))
+
+    # Check whether a job directory has a manifest
+    @staticmethod
+    def exists(job_dir):
+        return os.path.exists(os.path.join(job_dir, MANIFEST_NAME))
+
+    # Write the manifest atomically so a crash never leaves it half written
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    # Update the measurement record
+    def update_measurement(self, **fields):
+        with self.lock:
+            self.data['measurement'].update(fields)
+            self.save()
+
+    # Update one variant's record, adding it if the job matrix grew
+    def update_variant(self, bits_per_head, bpw, **fields):
+        with self.lock:
+            record = self.data['variants'].setdefault(variant_key(bits_per_head, bpw), {
+                'bits_per_head': bits_per_head,
+                'bpw': bpw,
+                'state': 'pending',
+                'phase': None,
+            })
+            record.update(fields)
+            self.save()
+
+    # Get a copy of one variant's record
+    def variant(self, bits_per_head, bpw):
+        with self.lock:
+            return dict(self.data['variants'].get(variant_key(bits_per_head, bpw), {}))
+
+    # Mark a variant complete and remember its output files for later verification
+    def mark_variant_done(self, bits_per_head, bpw, output_dir):
+        self.update_variant(
+            bits_per_head, bpw,
+            state='done',
+            phase=None,
+            finished=datetime.now().isoformat(timespec='seconds'),
+            output_dir=output_dir,
+            files=list_output_files(output_dir),
+        )
+
+    # A variant counts as complete only if its recorded output files are all still there
+    def is_variant_verified(self, bits_per_head, bpw):
+        record = self.variant(bits_per_head, bpw)
+        if record.get('state') != 'done' or not record.get('files'):
+            return False
+
+        output_dir = record['output_dir']
+        for relative_path, size in record['files'].items():
+            path = os.path.join(output_dir, relative_path)
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+import threading
+
+# Serialize cache writes and evictions between concurrent jobs in this process
+cache_lock = threading.Lock()
+
+# Read the raw JSON header of a safetensors file
+def read_safetensors_header(path):
+    with open(path, 'rb') as f:
+        header_length = struct.unpack('<Q', f.read(8))[0]
+        return f.read(header_length)
+
+# Identify the exllamav2 checkout (git commit when available, plus the converter sources)
+def describe_exllamav2_checkout(exllamav2_dir):
+    description = {}
+
+    # Resolve the current git commit without calling git
+    head_path = os.path.join(exllamav2_dir, '.git', 'HEAD')
+    if os.path.exists(head_path):
+        with open(head_path) as f:
+            head = f.read().strip()
+        if head.startswith('ref: '):
+            ref = head[5:]
+            ref_path = os.path.join(exllamav2_dir, '.git', ref)
+            packed_refs_path = os.path.join(exllamav2_dir, '.git', 'packed-refs')
+            if os.path.exists(ref_path):
+                with open(ref_path) as f:
+                    head = f.read().strip()
+            elif os.path.exists(packed_refs_path):
+                with open(packed_refs_path) as f:
+                    for line in f:
+                        if line.strip().endswith(' ' + ref):
+                            head = line.split()[0]
+                            break
+        description['git_head'] = head
+
+    # Hash the files that decide what the measurement looks like
+    for relative_path in ('convert.py', os.path.join('exllamav2', 'version.py')):
+        path = os.path.join(exllamav2_dir, relative_path)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                description[relative_path] = hashlib.sha256(f.read()).hexdigest()
+    return description
+
+# Compute the cache key for a model, exllamav2 checkout and calibration settings
+def compute_measurement_key(raw_weights_dir, exllamav2_dir, calibration=None):
+    key_data = {
+        'weights': {},
+        'exllamav2': describe_exllamav2_checkout(exllamav2_dir),
+        'calibration': calibration or {},
+    }
+
+    for file_name in sorted(os.listdir(raw_weights_dir)):
+        path = os.path.join(raw_weights_dir, file_name)
+        if not os.path.isfile(path):
+            continue
+
+        if file_name == 'config.json':
+            with open(path, 'rb') as f:
+                key_data['weights'][file_name] = hashlib.sha256(f.read()).hexdigest()
+        elif file_name.endswith('.safetensors'):
+            stat = os.stat(path)
+            key_data['weights'][file_name] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'header': hashlib.sha256(read_safetensors_header(path)).hexdigest(),
+            }
+
+    encoded = json.dumps(key_data, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+# Return the cached measurement.json for a key, or None on a miss
+def lookup_measurement(cache_dir, key):
+    path = os.path.join(cache_dir, f"{key}.json")
+    with cache_lock:
+        if not os.path.exists(path):
+            return None
+
+        # Touch the entry so it counts as recently used
+        os.utime(path)
+    return path
+
+# Store a measurement.json under its key and evict old entries beyond the size cap
+def store_measurement(cache_dir, key, measurement_json_path, max_bytes):
+    with cache_lock:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, f"{key}.json")
+
+        # Copy to a temporary name first so readers never see a partial file
+        temp_path = f"{path}.tmp"
+        shutil.copy(measurement_json_path, temp_path)
+        os.replace(temp_path, path)
+
+        evict_measurements(cache_dir, max_bytes, keep=path)
+    return path
+
+# Remove the least recently used entries until the cache fits under max_bytes
+def evict_measurements(cache_dir, max_bytes, keep=None):
+    entries = []
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.json'):
+            path = os.path.join(cache_dir, file_name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total_bytes -= size
@@ -0,0 +1,175 @@
+import json
+import os
+import socket
+import threading
+import time
+
+# Files written into the metrics directory
+EVENTS_FILE_NAME = 'metrics.jsonl'
+TEXTFILE_NAME = 'exl2_quantizer.prom'
+
+# Every exported metric: Prometheus type, help text and the labels it is split by
+METRICS = {
+    'exl2_stage_seconds': ('summary', "Seconds spent in each pipeline stage (measurement, prepare, convert, postprocess)", ('stage',)),
+    'exl2_convert_phase_seconds': ('summary', "Seconds spent in each convert.py phase (tokenize, measure, quantize, compile, ...)", ('phase',)),
+    'exl2_variants_total': ('counter', "Variants finished, by result", ('result',)),
+    'exl2_jobs_total': ('counter', "Jobs finished, by result", ('result',)),
+    'exl2_bytes_read_total': ('counter', "Raw weight bytes read by convert.py runs", ()),
+    'exl2_bytes_written_total': ('counter', "Bytes of finished outputs written to job directories", ()),
+    'exl2_scratch_used_bytes': ('gauge', "Temporary bytes the last finished conversion used on its work disk", ()),
+    'exl2_scratch_free_bytes': ('gauge', "Free bytes on the work disk after the last conversion", ()),
+    'exl2_gpu_idle_seconds': ('summary', "Gaps between one convert.py run ending on a GPU and the next one starting", ('device',)),
+    'exl2_last_update_timestamp_seconds': ('gauge', "Unix time of the last recorded metric", ()),
+}
+
+# Total size of the files below a directory
+def directory_size(path):
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.path.getsize(os.path.join(dir_path, file_name))
+            except OSError:
+                pass
+    return total
+
+# Format a label set for the textfile, e.g. {phase="quantize",device="0"}
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+# Collects pipeline metrics and exports them as JSON lines (one per observation, with the model and variant)
+# and as a Prometheus textfile for node_exporter's textfile collector, rewritten on every observation.
+# Disabled by simply not creating one: the engine only measures anything when it has a recorder.
+class MetricsRecorder:
+    def __init__(self, metrics_dir):
+        self.metrics_dir = os.path.abspath(metrics_dir)
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        self.host = socket.gethostname()
+        self.values = {}
+        self.busy_devices = {}
+        self.released_at = {}
+        self.lock = threading.Lock()
+        self.events_file = open(os.path.join(self.metrics_dir, EVENTS_FILE_NAME), 'a', encoding='utf-8')
+
+    # Record one observation: counters add, gauges replace, summaries add to their sum and count.
+    # context (model, bpw, ...) only goes to the JSON lines, so the textfile's label sets stay small.
+    def observe(self, name, value, labels=None, context=None):
+        kind, _, label_names = METRICS[name]
+        labels = {label_name: str((labels or {})[label_name]) for label_name in label_names}
+        now = time.time()
+        with self.lock:
+            key = (name, tuple(labels.items()))
+            if kind == 'gauge':
+                self.values[key] = value
+            elif kind == 'counter':
+                self.values[key] = self.values.get(key, 0) + value
+            else:
+                total, count = self.values.get(key, (0.0, 0))
+                self.values[key] = (total + value, count + 1)
+            self.values[('exl2_last_update_timestamp_seconds', ())] = now
+
+            event = {'time': now, 'host': self.host, 'metric': name, 'value': value}
+            event.update(labels)
+            event.update(context or {})
+            self.events_file.write(json.dumps(event) + '\n')
+            self.events_file.flush()
+            self.write_textfile()
+
+    # Rewrite the textfile atomically so the collector never reads half of it. Caller holds the lock.
+    def write_textfile(self):
+        lines = []
+        for name, (kind, help_text, _) in METRICS.items():
+            samples = [(dict(labels), value) for (sample_name, labels), value in sorted(self.values.items()) if sample_name == name]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labels = dict(labels, host=self.host)
+                if kind == 'summary':
+                    lines.append(f"{name}_sum{format_labels(labels)} {value[0]:.3f}")
+                    lines.append(f"{name}_count{format_labels(labels)} {value[1]}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+        path = os.path.join(self.metrics_dir, TEXTFILE_NAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    def stage(self, stage, seconds, context=None):
+        self.observe('exl2_stage_seconds', seconds, {'stage': stage}, context)
+
+    def variant_finished(self, succeeded, context=None):
+        self.observe('exl2_variants_total', 1, {'result': 'succeeded' if succeeded else 'failed'}, context)
+
+    def job_finished(self, succeeded, seconds, context=None):
+        self.observe('exl2_jobs_total', 1, {'result': 'succeeded' if succeeded else 'failed'}, dict(context or {}, seconds=seconds))
+
+    def bytes_read(self, size, context=None):
+        self.observe('exl2_bytes_read_total', size, context=context)
+
+    def bytes_written(self, size, context=None):
+        self.observe('exl2_bytes_written_total', size, context=context)
+
+    def scratch_usage(self, used_bytes, free_bytes, context=None):
+        self.observe('exl2_scratch_used_bytes', used_bytes, context=context)
+        self.observe('exl2_scratch_free_bytes', free_bytes, context=context)
+
+    # A convert.py run starts on a device; records how long the device sat idle since its last run ended
+    def gpu_busy(self, device, context=None):
+        device = str(device)
+        with self.lock:
+            self.busy_devices[device] = self.busy_devices.get(device, 0) + 1
+            released_at = self.released_at.pop(device, None) if self.busy_devices[device] == 1 else None
+        if released_at is not None:
+            self.observe('exl2_gpu_idle_seconds', time.monotonic() - released_at, {'device': device}, context)
+
+    # A convert.py run on a device has ended
+    def gpu_released(self, device):
+        device = str(device)
+        with self.lock:
+            self.busy_devices[device] -= 1
+            if self.busy_devices[device] == 0:
+                self.released_at[device] = time.monotonic()
+
+    # Progress callback timing convert.py's phases; call finish() once the run has ended
+    def phase_timer(self, context=None):
+        return PhaseTimer(self, context)
+
+# Times the phases of one convert.py run from its progress events
+class PhaseTimer:
+    def __init__(self, recorder, context=None):
+        self.recorder = recorder
+        self.context = context
+        self.phase = None
+        self.started = None
+
+    def __call__(self, event):
+        if event['phase'] != self.phase:
+            self.finish()
+            self.phase = event['phase']
+            self.started = time.monotonic()
+
+    # Record the phase in progress; 'finished' is only a marker, not a phase of its own
+    def finish(self):
+        if self.phase not in (None, 'finished'):
+            self.recorder.observe('exl2_convert_phase_seconds', time.monotonic() - self.started, {'phase': self.phase}, self.context)
+        self.phase = None
+
+# One recorder per metrics directory, shared by every job of the process so counters keep adding up
+recorders = {}
+recorders_lock = threading.Lock()
+
+# The recorder for a metrics directory, or None when metrics are off (empty directory)
+def get_recorder(metrics_dir):
+    if not metrics_dir:
+        return None
+    metrics_dir = os.path.abspath(metrics_dir)
+    with recorders_lock:
+        if metrics_dir not in recorders:
+            recorders[metrics_dir] = MetricsRecorder(metrics_dir)
+        return recorders[metrics_dir]
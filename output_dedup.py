@@ -0,0 +1,121 @@
+import os
+import shutil
+import threading
+from output_manifest import OUTPUT_MANIFEST_NAME, hash_file
+
+# Quantized tensors differ between variants, so only the companion files are compared
+TENSOR_EXTENSIONS = ('.safetensors', '.bin', '.pt', '.pth')
+
+# Linux ioctl that clones a file's extents (btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+# Clone source into a new destination file sharing its blocks; returns False when the filesystem can't
+def reflink(source, destination):
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        return True
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        return False
+
+# Replace destination with the contents of source: a reflink where supported, else a hardlink,
+# else (across filesystems) a copy. The swap is atomic. Returns 'reflink', 'hardlink' or 'copy'.
+def link_file(source, destination):
+    temp_path = f"{destination}.dedup"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    if reflink(source, temp_path):
+        method = 'reflink'
+    else:
+        try:
+            os.link(source, temp_path)
+            method = 'hardlink'
+        except OSError:
+            shutil.copy2(source, temp_path)
+            method = 'copy'
+    os.replace(temp_path, destination)
+    return method
+
+# Companion files of an output directory, relative to it
+def list_companion_files(output_dir):
+    paths = []
+    for dir_path, _, file_names in os.walk(output_dir):
+        for file_name in file_names:
+            if file_name.endswith(TENSOR_EXTENSIONS) or file_name == OUTPUT_MANIFEST_NAME or file_name.endswith(('.tmp', '.dedup')):
+                continue
+            paths.append(os.path.relpath(os.path.join(dir_path, file_name), output_dir))
+    return paths
+
+# Content index of the companion files in a job's outputs, shared by the post-processing threads
+class DedupIndex:
+    def __init__(self, job_dir):
+        self.job_dir = job_dir
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.scanned = False
+
+    # Hash the companion files of every output a previous run of the job left behind (e.g. before a resume)
+    def scan_existing(self, skip_dir):
+        found = []
+        for name in sorted(os.listdir(self.job_dir)):
+            output_dir = os.path.join(self.job_dir, name)
+            if '_EXL2_' in name and os.path.isdir(output_dir) and output_dir != skip_dir:
+                for relative_path in list_companion_files(output_dir):
+                    path = os.path.join(output_dir, relative_path)
+                    found.append(((os.path.getsize(path), hash_file(path)), path))
+        return found
+
+    # Link every companion file of output_dir that duplicates one already indexed.
+    # Files are hashed without holding the lock, so workers hash in parallel; it only guards the lookups.
+    # The first caller scans the existing outputs while later ones wait on scan_lock until it is merged.
+    # Returns (files linked, bytes no longer stored twice)
+    def dedup_output(self, output_dir):
+        linked = 0
+        saved_bytes = 0
+        with self.scan_lock:
+            if not self.scanned:
+                found = self.scan_existing(output_dir)
+                with self.lock:
+                    for key, path in found:
+                        self.entries.setdefault(key, path)
+                self.scanned = True
+
+        for relative_path in list_companion_files(output_dir):
+            path = os.path.join(output_dir, relative_path)
+            size = os.path.getsize(path)
+            key = (size, hash_file(path))
+            with self.lock:
+                canonical = self.entries.get(key)
+
+                # The first copy becomes the canonical one; also when the old one was removed
+                if canonical is None or not os.path.isfile(canonical) or os.path.getsize(canonical) != size:
+                    self.entries[key] = path
+                    continue
+            if os.path.samefile(canonical, path):
+                continue
+            if link_file(canonical, path) != 'copy':
+                linked += 1
+                saved_bytes += size
+        return linked, saved_bytes
+
+# One index per job directory
+indexes = {}
+indexes_lock = threading.Lock()
+
+def get_index(job_dir):
+    with indexes_lock:
+        if job_dir not in indexes:
+            indexes[job_dir] = DedupIndex(job_dir)
+        return indexes[job_dir]
+
+# Drop a job's index once the job is over
+def forget_index(job_dir):
+    with indexes_lock:
+        indexes.pop(job_dir, None)
@@ -0,0 +1,183 @@
+import argparse
+import hashlib
+import json
+import math
+import mmap
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from measurement_cache import read_safetensors_header
+
+# File name of the integrity manifest written into each output directory
+OUTPUT_MANIFEST_NAME = 'output_manifest.json'
+
+# Bytes hashed per update; large updates let hashlib release the GIL so threads hash in parallel
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Files hashed at once
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# SHA-256 of a file, read through a memory map in chunks
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, chunk_size):
+                    digest.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+# Tensor count, parameter count, dtypes and metadata from a safetensors header
+def summarize_safetensors(path):
+    header = json.loads(read_safetensors_header(path))
+    dtypes = {}
+    parameters = 0
+    for name, tensor in header.items():
+        if name == '__metadata__':
+            continue
+        dtypes[tensor['dtype']] = dtypes.get(tensor['dtype'], 0) + 1
+        parameters += math.prod(tensor['shape'])
+    return {
+        'tensors': sum(dtypes.values()),
+        'parameters': parameters,
+        'dtypes': dtypes,
+        'metadata': header.get('__metadata__', {}),
+    }
+
+# Load the manifest of an output directory, or None when there is none
+def load_output_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, OUTPUT_MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Relative paths of the files an output manifest covers
+def list_manifest_files(output_dir):
+    paths = []
+    for dir_path, _, file_names in os.walk(output_dir):
+        for file_name in file_names:
+            relative_path = os.path.relpath(os.path.join(dir_path, file_name), output_dir)
+            if relative_path != OUTPUT_MANIFEST_NAME and not relative_path.endswith('.tmp'):
+                paths.append(relative_path)
+    return sorted(paths)
+
+# Describe one file; a previous entry with the same size and mtime is reused instead of rehashing
+def describe_file(output_dir, relative_path, previous_entry=None):
+    path = os.path.join(output_dir, relative_path)
+    stat = os.stat(path)
+    if previous_entry and previous_entry.get('size') == stat.st_size and previous_entry.get('mtime_ns') == stat.st_mtime_ns:
+        return previous_entry, False
+
+    entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': hash_file(path)}
+    if relative_path.endswith('.safetensors'):
+        try:
+            entry['safetensors'] = summarize_safetensors(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            entry['safetensors'] = None
+    return entry, True
+
+# Hash every file of an output directory in parallel and write its manifest.
+# Files whose size and mtime match the existing manifest are not read again unless full=True.
+# Returns (manifest, number of files hashed).
+def write_output_manifest(output_dir, workers=HASH_WORKERS, full=False):
+    previous = load_output_manifest(output_dir) or {}
+    previous_files = {} if full else previous.get('files', {})
+    relative_paths = list_manifest_files(output_dir)
+
+    # Largest files first, so one big shard does not start last
+    relative_paths.sort(key=lambda relative_path: os.path.getsize(os.path.join(output_dir, relative_path)), reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        described = list(executor.map(lambda relative_path: describe_file(output_dir, relative_path, previous_files.get(relative_path)), relative_paths))
+
+    files = {relative_path: entry for relative_path, (entry, _) in sorted(zip(relative_paths, described))}
+    manifest = {
+        'version': 1,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'total_bytes': sum(entry['size'] for entry in files.values()),
+        'files': files,
+    }
+
+    # Write atomically so a crash never leaves a truncated manifest
+    path = os.path.join(output_dir, OUTPUT_MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest, sum(1 for _, hashed in described if hashed)
+
+# Check an output directory against its manifest; returns a list of problems (empty when intact).
+# Files whose size and mtime are unchanged are trusted unless full=True.
+def verify_output_manifest(output_dir, workers=HASH_WORKERS, full=False):
+    manifest = load_output_manifest(output_dir)
+    if manifest is None:
+        return [f"{output_dir}: no {OUTPUT_MANIFEST_NAME}"]
+
+    expected = manifest.get('files', {})
+    present = set(list_manifest_files(output_dir))
+    problems = [f"{output_dir}: missing {relative_path}" for relative_path in sorted(set(expected) - present)]
+    problems += [f"{output_dir}: unexpected {relative_path}" for relative_path in sorted(present - set(expected))]
+
+    # Check one listed file, returning a problem or None
+    def check(relative_path):
+        entry = expected[relative_path]
+        stat = os.stat(os.path.join(output_dir, relative_path))
+        if stat.st_size != entry['size']:
+            return f"{output_dir}: size mismatch in {relative_path}"
+        if full or stat.st_mtime_ns != entry.get('mtime_ns'):
+            if hash_file(os.path.join(output_dir, relative_path)) != entry['sha256']:
+                return f"{output_dir}: sha256 mismatch in {relative_path}"
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        problems += [problem for problem in executor.map(check, sorted(present & set(expected))) if problem]
+    return problems
+
+# Output directories to work on: the given directory itself, or every output directory inside a job directory
+def find_output_dirs(path):
+    if any(file_name.endswith('.safetensors') for file_name in os.listdir(path)):
+        return [path]
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if os.path.isdir(os.path.join(path, name)) and '_EXL2_' in name
+    )
+
+# Build the command line parser
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Write or verify sha256 manifests of quantized output directories")
+    parser.add_argument('command', choices=('write', 'verify'))
+    parser.add_argument('paths', nargs='+', help="Output directories, or job directories containing them")
+    parser.add_argument('--full', action='store_true', help="Rehash every file, even when its size and mtime are unchanged")
+    parser.add_argument('--workers', type=int, default=HASH_WORKERS, help="Files hashed at once")
+    return parser
+
+# Command line entry point
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    output_dirs = [output_dir for path in args.paths for output_dir in find_output_dirs(path)]
+    if not output_dirs:
+        print("No output directories found.")
+        return 1
+
+    failed = False
+    for output_dir in output_dirs:
+        if args.command == 'write':
+            manifest, hashed = write_output_manifest(output_dir, args.workers, args.full)
+            print(f"{output_dir}: {len(manifest['files'])} files, {hashed} hashed")
+        else:
+            problems = verify_output_manifest(output_dir, args.workers, args.full)
+            for problem in problems:
+                print(problem)
+            if not problems:
+                print(f"{output_dir}: OK")
+            failed = failed or bool(problems)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import importlib
+import os
+import queue
+import shutil
+import sys
+import threading
+import traceback
+import disk_planner
+import output_dedup
+import output_manifest
+
+# Post-processing runs on CPU threads after convert.py has finished, so the GPU can start the next
+# variant straight away. Each step is a function taking the variant's item dict:
+#   variant, job_dir, temp_quant_dir, compile_dir, output_dir, measurement_json_path, manifest
+
+# Remove the variant's temporary quantization directory
+def cleanup_temp(item):
+    if item['temp_quant_dir'] and os.path.exists(item['temp_quant_dir']):
+        shutil.rmtree(item['temp_quant_dir'])
+
+# Copy measurement.json next to the quantized weights
+def copy_measurement(item):
+    shutil.copy(item['measurement_json_path'], item['compile_dir'])
+
+# Move an output assembled on the scratch disk into the job directory
+def move_output(item):
+    if item['compile_dir'] != item['output_dir']:
+        disk_planner.move_into_place(item['compile_dir'], item['output_dir'])
+
+# Replace companion files that duplicate another output of the job with links
+def dedup_companions(item):
+    output_dedup.get_index(item['job_dir']).dedup_output(item['output_dir'])
+
+# Record the finished output in the job manifest
+def mark_done(item):
+    if item.get('manifest'):
+        bits_per_head, bpw = item['variant']
+        item['manifest'].mark_variant_done(bits_per_head, bpw, item['output_dir'])
+
+# Write the sha256 integrity manifest into the placed output directory
+def write_manifest(item):
+    output_manifest.write_output_manifest(item['output_dir'])
+
+# Optional steps that can be listed in the postprocess_steps setting
+OPTIONAL_STEPS = {
+    'manifest': write_manifest,
+}
+
+# Look up a step by name, or import it from "module:function" for custom steps
+def resolve_step(name):
+    name = name.strip()
+    if name in OPTIONAL_STEPS:
+        return OPTIONAL_STEPS[name]
+    if ':' in name:
+        module_name, function_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    raise ValueError(f"Unknown post-processing step '{name}'. Available: {', '.join(sorted(OPTIONAL_STEPS)) or 'none'}, or module:function.")
+
+# Full list of steps: cleanup and placing the output first, deduplication, the configured extras, then marking it done
+def build_steps(extra_step_names='', dedup=False):
+    extra_steps = [resolve_step(name) for name in str(extra_step_names).split(',') if name.strip()]
+    dedup_steps = [dedup_companions] if dedup else []
+    return [cleanup_temp, copy_measurement, move_output] + dedup_steps + extra_steps + [mark_done]
+
+# Run every step on one item; returns None on success or the exception that stopped it
+def run_steps(steps, item):
+    try:
+        for step in steps:
+            step(item)
+    except Exception as e:
+        return e
+    return None
+
+# Thread pool that post-processes finished variants from a bounded queue.
+# submit() blocks while the queue is full, so a slow disk holds back the GPU workers
+# instead of letting finished-but-unprocessed outputs pile up on the scratch disk.
+class PostProcessor:
+    def __init__(self, steps, workers=2, max_pending=4):
+        self.steps = steps
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    # Queue a finished variant; on_finished(error) is called from a pool thread when it is done
+    def submit(self, item, on_finished):
+        self.queue.put((item, on_finished))
+
+    def worker(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            item, on_finished = entry
+            error = run_steps(self.steps, item)
+            # A failing callback must not take the thread with it: once every worker is gone, submit() blocks for good
+            try:
+                on_finished(error)
+            except Exception:
+                print(f"Post-processing callback for {item['output_dir']} failed:", file=sys.stderr)
+                traceback.print_exc()
+
+    # Wait for every queued variant to be processed and stop the threads
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
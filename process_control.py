@@ -0,0 +1,172 @@
+import atexit
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+
+# How often a waiting run checks its timeouts and the cancel flag, in seconds
+POLL_INTERVAL = 1.0
+
+# Every process group started through start_process that has not been forgotten yet.
+# convert.py runs in its own group so the shell, the python child and anything it forks can be killed
+# together; that also means Ctrl+C in a terminal no longer reaches it, so whatever is left is killed on exit.
+live_processes = set()
+live_processes_lock = threading.Lock()
+
+# Raised when a conversion is killed by a timeout, the no-output watchdog or a cancel.
+# It is a CalledProcessError so every caller handling a failed convert.py handles this too.
+class ConvertStopped(subprocess.CalledProcessError):
+    def __init__(self, reason, command=None):
+        super().__init__(-1, command or 'convert.py')
+        self.reason = reason
+
+    def __str__(self):
+        return f"convert.py was stopped: {self.reason}"
+
+# Start a shell command in a new process group
+def start_process(command, **kwargs):
+    if os.name == 'nt':
+        kwargs['creationflags'] = kwargs.get('creationflags', 0) | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    process = subprocess.Popen(command, shell=True, **kwargs)
+    with live_processes_lock:
+        live_processes.add(process)
+    return process
+
+# Stop tracking a process that has exited
+def forget_process(process):
+    with live_processes_lock:
+        live_processes.discard(process)
+
+# Kill a process and everything else in its group, so no child is left holding GPU memory
+def kill_process_group(process):
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        # The shell may already be gone while its python child still runs in the group
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        pass
+
+@atexit.register
+def kill_live_processes():
+    with live_processes_lock:
+        processes = list(live_processes)
+    for process in processes:
+        kill_process_group(process)
+
+# Lets another thread (the GUI's Cancel button, Ctrl+C) stop a job: running conversions are killed at once
+# and no new variant starts
+class CancelToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        self.event.set()
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            kill_process_group(process)
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    # Track a running process so a cancel kills it; one started after the cancel is killed right away
+    def register(self, process):
+        with self.lock:
+            self.processes.add(process)
+        if self.is_cancelled():
+            kill_process_group(process)
+
+    def unregister(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+# Parse "measure=240, quantize=480" (minutes per convert.py phase) into seconds per phase
+def parse_phase_timeouts(text):
+    timeouts = {}
+    for part in str(text or '').split(','):
+        if not part.strip():
+            continue
+        phase, _, minutes = part.partition('=')
+        try:
+            timeouts[phase.strip()] = float(minutes) * 60
+        except ValueError:
+            raise ValueError(f"Invalid phase timeout '{part.strip()}', expected phase=minutes")
+    return timeouts
+
+# Run limits of a job: {'phase_timeouts': {phase: seconds}, 'stall_timeout': seconds or None, 'cancel_token': token or None}
+def build_limits(phase_timeouts='', stall_timeout_min='', cancel_token=None):
+    stall_minutes = float(stall_timeout_min) if str(stall_timeout_min or '').strip() else 0
+    return {
+        'phase_timeouts': parse_phase_timeouts(phase_timeouts),
+        'stall_timeout': stall_minutes * 60 if stall_minutes > 0 else None,
+        'cancel_token': cancel_token,
+    }
+
+# Watches one convert.py run: how long its current phase has lasted, when it last printed anything,
+# and whether the job was cancelled. The phase comes from the run's ProgressParser, if it has one.
+class Watchdog:
+    def __init__(self, parser, limits=None):
+        limits = limits or {}
+        self.parser = parser
+        self.phase_timeouts = limits.get('phase_timeouts') or {}
+        self.stall_timeout = limits.get('stall_timeout')
+        self.cancel_token = limits.get('cancel_token')
+        self.last_output = time.monotonic()
+
+    def output_seen(self):
+        self.last_output = time.monotonic()
+
+    def is_cancelled(self):
+        return self.cancel_token is not None and self.cancel_token.is_cancelled()
+
+    # Why the run has to be stopped, or None
+    def check(self):
+        if self.is_cancelled():
+            return "cancelled"
+        now = time.monotonic()
+        if self.stall_timeout and now - self.last_output > self.stall_timeout:
+            return f"no output for {self.stall_timeout / 60:g} minutes"
+        limit = self.phase_timeouts.get(self.parser.phase) if self.parser else None
+        if limit and now - self.parser.phase_started > limit:
+            return f"phase '{self.parser.phase}' took longer than {limit / 60:g} minutes"
+        return None
+
+    def register(self, process):
+        if self.cancel_token:
+            self.cancel_token.register(process)
+
+    def unregister(self, process):
+        if self.cancel_token:
+            self.cancel_token.unregister(process)
+
+# Next output line of a watched process from its line queue, or None once its output has ended.
+# When the watchdog trips, the whole process group is killed and ConvertStopped is raised.
+def next_line(process, line_queue, watchdog):
+    while True:
+        reason = watchdog.check()
+        if reason:
+            kill_process_group(process)
+            raise ConvertStopped(reason)
+        try:
+            line = line_queue.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if line is None:
+            # A cancel kills the process, which ends its output
+            if watchdog.is_cancelled():
+                raise ConvertStopped("cancelled")
+            return None
+        watchdog.output_seen()
+        return line
@@ -0,0 +1,224 @@
+import json
+import os
+import queue
+import re
+import subprocess
+import threading
+import time
+import process_control
+
+# Lines in convert.py's output that start a new phase
+PHASE_MARKERS = [
+    ('Tokenizing samples', 'tokenize'),
+    ('Token embeddings', 'embeddings'),
+    ('Resuming job', 'resume'),
+    ('Measuring quantization impact', 'measure'),
+    ('Optimizing', 'optimize'),
+    ('Quantizing', 'quantize'),
+    ('Compiling output file', 'compile'),
+    ('Finished', 'finished'),
+]
+
+# Share of a variant's runtime spent before and after the per-module quantization
+COMPILE_FRACTION = 0.05
+
+# " -- Layer: model.layers.12 (MLP)"
+LAYER_PATTERN = re.compile(r'--\s*Layer:\s*(\S+)\s*\(([^)]*)\)')
+LAYER_INDEX_PATTERN = re.compile(r'\.layers\.(\d+)$')
+
+# Count the modules convert.py steps through: an attention and an MLP block per layer plus the head
+def count_modules(raw_weights_dir):
+    config_path = os.path.join(raw_weights_dir, 'config.json')
+    try:
+        with open(config_path) as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Multimodal configs keep the language model settings in a sub-config
+    config = config.get('text_config', config)
+    num_layers = config.get('num_hidden_layers') or config.get('n_layer')
+    if not num_layers:
+        return None
+    return 2 * int(num_layers) + 1
+
+# Turns convert.py output lines into structured progress events
+class ProgressParser:
+    def __init__(self, module_count=None):
+        self.module_count = module_count
+        self.phase = 'starting'
+        self.module_index = -1
+        self.module_name = None
+        self.phase_started = time.monotonic()
+        self.modules_in_phase = 0
+
+    # Module index from the layer name, so a resumed run continues at the right place
+    def module_index_for(self, name, kind):
+        match = LAYER_INDEX_PATTERN.search(name)
+        if match:
+            return 2 * int(match.group(1)) + (0 if 'Attention' in kind else 1)
+        if name == 'lm_head' and self.module_count:
+            return self.module_count - 1
+        return self.module_index + 1
+
+    # How far through the current run we are, from 0 to 1
+    def fraction(self):
+        if self.phase in ('compile', 'finished'):
+            return 1.0 if self.phase == 'finished' else 1.0 - COMPILE_FRACTION
+        if self.phase in ('measure', 'quantize') and self.module_count and self.module_index >= 0:
+            done = min(self.module_index, self.module_count) / self.module_count
+            return done * (1.0 - COMPILE_FRACTION)
+        return 0.0
+
+    # Modules per second in the current phase
+    def rate(self):
+        elapsed = time.monotonic() - self.phase_started
+        if self.modules_in_phase < 2 or elapsed <= 0:
+            return None
+        return (self.modules_in_phase - 1) / elapsed
+
+    # Feed one output line; returns an event dict when progress changed, otherwise None
+    def feed(self, line):
+        for marker, phase in PHASE_MARKERS:
+            if marker in line and line.lstrip().startswith('--'):
+                if phase != self.phase:
+                    self.phase = phase
+                    self.phase_started = time.monotonic()
+                    self.modules_in_phase = 0
+                    return self.event()
+                return None
+
+        match = LAYER_PATTERN.search(line)
+        if match:
+            self.module_name = match.group(1)
+            self.module_index = self.module_index_for(match.group(1), match.group(2))
+            self.modules_in_phase += 1
+            return self.event()
+        return None
+
+    # Snapshot of the current progress
+    def event(self):
+        return {
+            'phase': self.phase,
+            'module_index': self.module_index,
+            'module_count': self.module_count,
+            'module_name': self.module_name,
+            'rate': self.rate(),
+            'fraction': self.fraction(),
+        }
+
+# Read a pipe in a background thread and hand out complete lines through a queue,
+# splitting on carriage returns too so progress redraws are seen as they happen
+def start_line_reader(pipe, line_queue):
+    def reader():
+        pending = b''
+        for chunk in iter(lambda: pipe.read1(65536), b''):
+            pending += chunk
+            parts = re.split(rb'\r\n|\r|\n', pending)
+            pending = parts.pop()
+            for part in parts:
+                line_queue.put(part.decode('utf-8', errors='replace'))
+        if pending:
+            line_queue.put(pending.decode('utf-8', errors='replace'))
+        line_queue.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    return thread
+
+# Writes each output line to a log file and turns it into progress events
+class OutputHandler:
+    def __init__(self, log_path=None, on_event=None, module_count=None):
+        self.parser = ProgressParser(module_count)
+        self.on_event = on_event
+        self.log_file = None
+        if log_path:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            self.log_file = open(log_path, 'a', encoding='utf-8')
+
+    def __call__(self, line):
+        if self.log_file:
+            self.log_file.write(line + '\n')
+            self.log_file.flush()
+        event = self.parser.feed(line)
+        if event and self.on_event:
+            self.on_event(event)
+
+    def close(self):
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
+
+# Run a shell command, streaming its combined output to a log file and progress events to on_event.
+# Raises subprocess.CalledProcessError on a non-zero exit, like subprocess.run(check=True).
+# The command runs in its own process group; limits (see process_control.build_limits) set phase timeouts,
+# the no-output watchdog and a cancel token, any of which kills the whole group and raises ConvertStopped.
+def run_streaming(command, env, log_path=None, on_event=None, module_count=None, limits=None):
+    # Python buffers output heavily when it is not a terminal
+    env = dict(env)
+    env['PYTHONUNBUFFERED'] = '1'
+
+    handler = OutputHandler(log_path, on_event, module_count)
+    watchdog = process_control.Watchdog(handler.parser, limits)
+    line_queue = queue.Queue()
+    process = None
+    try:
+        process = process_control.start_process(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        watchdog.register(process)
+        reader = start_line_reader(process.stdout, line_queue)
+        while True:
+            line = process_control.next_line(process, line_queue, watchdog)
+            if line is None:
+                break
+            handler(line)
+        reader.join()
+        returncode = process.wait()
+    finally:
+        handler.close()
+        if process is not None:
+            watchdog.unregister(process)
+            process_control.forget_process(process)
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+# Tracks how far a whole job is and estimates the time left
+class JobProgress:
+    def __init__(self, total_units):
+        self.total_units = max(total_units, 1)
+        self.fractions = {}
+        self.baseline = {}
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Record progress (0 to 1) of one unit of work, such as a variant or the measurement.
+    # With baseline=True the progress was made before this run (a cached measurement, a variant skipped
+    # on resume), so it counts towards the fraction done but not towards the rate the ETA is based on.
+    def update(self, unit, fraction, baseline=False):
+        fraction = max(0.0, min(1.0, fraction))
+        with self.lock:
+            self.fractions[unit] = fraction
+            if baseline:
+                self.baseline[unit] = fraction
+
+    # Fraction of the whole job that is done
+    def fraction(self):
+        with self.lock:
+            return sum(self.fractions.values()) / self.total_units
+
+    # Seconds left, extrapolated from the progress made since the job started
+    def eta(self):
+        with self.lock:
+            done = sum(self.fractions.values()) / self.total_units
+            worked = done - sum(self.baseline.values()) / self.total_units
+        if worked <= 0:
+            return None
+        elapsed = time.monotonic() - self.started
+        return elapsed * (1.0 - done) / worked
+
+# Format a number of seconds as H:MM:SS
+def format_duration(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
@@ -0,0 +1,270 @@
+import argparse
+import os
+import shutil
+import socket
+import sys
+import threading
+import urllib.parse
+import convert_worker
+import metrics
+import process_control
+import progress_parser
+import quant_engine
+from coordinator import CoordinatorError, request
+from job_manifest import list_output_files
+from output_manifest import hash_file
+
+# Reporter that keeps the last error of each variant so it can be sent to the coordinator
+class AgentReporter(quant_engine.Reporter):
+    def __init__(self, name):
+        self.name = name
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def notice(self, message):
+        print(f"[{self.name}] {message}", flush=True)
+
+    def info(self, title, message):
+        print(f"[{self.name}] {title}: {message}", flush=True)
+
+    def warning(self, title, message):
+        print(f"[{self.name}] {title}: {message}", flush=True)
+
+    def error(self, title, message):
+        with self.lock:
+            self.errors[threading.get_ident()] = message
+        print(f"[{self.name}] {title}: {message}", file=sys.stderr, flush=True)
+
+    # Take the last error reported on the calling thread
+    def take_error(self):
+        with self.lock:
+            return self.errors.pop(threading.get_ident(), None)
+
+# Pulls variants from a coordinator and runs them on this host's GPUs, one lease loop per device
+class Agent:
+    def __init__(self, coordinator_url, name, cuda_devices, venv_path, exllamav2_dir, work_dir, path_map=None, token=None, worker_pool=None, limits=None, recorder=None):
+        self.coordinator_url = coordinator_url
+        self.name = name
+        self.cuda_devices = cuda_devices
+        self.venv_path = venv_path
+        self.exllamav2_dir = exllamav2_dir
+        self.work_dir = os.path.abspath(work_dir)
+        self.path_map = path_map or []
+        self.token = token
+        self.worker_pool = worker_pool
+        self.limits = limits
+        self.recorder = recorder
+        self.reporter = AgentReporter(name)
+        self.agent_id = None
+        self.heartbeat_interval = 5
+        self.heartbeat_timeout = 30
+        self.progress = {}
+        self.cancelled = set()
+        self.lock = threading.Lock()
+        self.measurement_locks = {}
+        self.running_jobs = {}
+        self.stopped = threading.Event()
+
+    # Call the coordinator, registering again if it has forgotten us (e.g. after a network outage)
+    def call(self, path, payload):
+        for _ in range(2):
+            try:
+                return request(self.coordinator_url, path, dict(payload, agent_id=self.agent_id), token=self.token)
+            except CoordinatorError as e:
+                if e.status != 410 or path == '/report':
+                    raise
+                self.register()
+        raise CoordinatorError(410, "coordinator keeps rejecting this agent")
+
+    def register(self):
+        answer = request(self.coordinator_url, '/register', {'name': self.name, 'devices': self.cuda_devices}, token=self.token)
+        self.agent_id = answer['agent_id']
+        self.heartbeat_interval = answer['heartbeat_interval']
+        self.heartbeat_timeout = answer['heartbeat_timeout']
+        self.reporter.notice(f"Registered with {self.coordinator_url} as {self.agent_id}")
+
+    # Send the progress of every running lease until the agent stops
+    def send_heartbeats(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            with self.lock:
+                progress = dict(self.progress)
+            try:
+                answer = self.call('/heartbeat', {'progress': progress})
+                with self.lock:
+                    self.cancelled.update(answer.get('cancelled', []))
+            except (OSError, CoordinatorError) as e:
+                self.reporter.notice(f"Heartbeat failed: {e}")
+
+    # Raw weights path on this host for the coordinator's path
+    def map_path(self, path):
+        for remote_prefix, local_prefix in self.path_map:
+            if path.startswith(remote_prefix):
+                return local_prefix + path[len(remote_prefix):]
+        return path
+
+    # Download the job's measurement.json once per job; a copy not matching the lease's hash is downloaded again
+    def fetch_measurement(self, lease, job_dir):
+        path = os.path.join(job_dir, 'measurement.json')
+        with self.lock:
+            lock = self.measurement_locks.setdefault(lease['job_key'], threading.Lock())
+        with lock:
+            if not os.path.exists(path) or hash_file(path) != lease['measurement_sha256']:
+                os.makedirs(job_dir, exist_ok=True)
+                data = request(self.coordinator_url, '/measurement?' + urllib.parse.urlencode({'lease': lease['lease_id'], 'agent': self.agent_id}), token=self.token)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                if hash_file(path + '.tmp') != lease['measurement_sha256']:
+                    os.remove(path + '.tmp')
+                    raise OSError("Downloaded measurement.json does not match the coordinator's hash")
+                os.replace(path + '.tmp', path)
+        return path
+
+    # Count a lease against its job, and remove the directories of earlier jobs that have no lease running
+    def start_job_lease(self, job_key):
+        with self.lock:
+            self.running_jobs[job_key] = self.running_jobs.get(job_key, 0) + 1
+            finished = [key for key, count in self.running_jobs.items() if count == 0]
+            for key in finished:
+                del self.running_jobs[key]
+                self.measurement_locks.pop(key, None)
+        for key in finished:
+            shutil.rmtree(os.path.join(self.work_dir, f"job_{key}"), ignore_errors=True)
+
+    def finish_job_lease(self, job_key):
+        with self.lock:
+            self.running_jobs[job_key] -= 1
+
+    # Remove the directories of every job this agent worked on
+    def remove_job_dirs(self):
+        with self.lock:
+            keys = list(self.running_jobs)
+            self.running_jobs.clear()
+        for key in keys:
+            shutil.rmtree(os.path.join(self.work_dir, f"job_{key}"), ignore_errors=True)
+
+    # Upload every file of a finished output directory; returns {relative path: size}
+    def upload_output(self, lease, output_dir):
+        files = list_output_files(output_dir)
+        for relative_path, size in files.items():
+            query = urllib.parse.urlencode({'lease': lease['lease_id'], 'agent': self.agent_id, 'path': relative_path})
+            with open(os.path.join(output_dir, relative_path), 'rb') as f:
+                request(self.coordinator_url, '/artifact?' + query, method='PUT', token=self.token, body=f, headers={'Content-Length': str(size)}, timeout=600)
+        return files
+
+    # Run one leased variant and report the outcome
+    def run_lease(self, lease, cuda_device):
+        lease_id = lease['lease_id']
+        bits_per_head, bpw = lease['bits_per_head'], lease['bpw']
+        job_dir = os.path.join(self.work_dir, f"job_{lease['job_key']}")
+        raw_weights_dir = self.map_path(lease['raw_weights_dir'])
+        self.reporter.notice(f"GPU {cuda_device}: {lease['model_name']} {bpw}bpw H{bits_per_head}")
+
+        def on_event(event):
+            with self.lock:
+                self.progress[lease_id] = event
+
+        report = {'lease_id': lease_id, 'succeeded': False}
+        output_dir = quant_engine.variant_output_dir(job_dir, lease['model_name'], lease['author_name'], bits_per_head, bpw)
+        self.start_job_lease(lease['job_key'])
+        try:
+            measurement_path = self.fetch_measurement(lease, job_dir)
+            module_count = progress_parser.count_modules(raw_weights_dir)
+            succeeded = quant_engine.run_quantization_on_gpu(lease['model_name'], raw_weights_dir, bits_per_head, bpw, self.venv_path, lease['author_name'], cuda_device, self.exllamav2_dir, job_dir, measurement_path, self.reporter, on_event=on_event, module_count=module_count, worker_pool=self.worker_pool, limits=self.limits, recorder=self.recorder)
+            if succeeded:
+                with self.lock:
+                    cancelled = lease_id in self.cancelled
+                if cancelled:
+                    self.reporter.notice(f"{bpw}bpw H{bits_per_head} was handed to another agent; discarding it")
+                    return
+                report['files'] = self.upload_output(lease, output_dir)
+                report['succeeded'] = True
+            else:
+                report['error'] = self.reporter.take_error()
+        except (OSError, CoordinatorError) as e:
+            report['error'] = str(e)
+        finally:
+            with self.lock:
+                self.progress.pop(lease_id, None)
+            shutil.rmtree(output_dir, ignore_errors=True)
+            self.finish_job_lease(lease['job_key'])
+
+        try:
+            self.call('/report', report)
+        except CoordinatorError as e:
+            self.reporter.notice(f"Coordinator rejected the result of {bpw}bpw H{bits_per_head}: {e}")
+
+    # Lease and run variants on one GPU until the coordinator says there is no more work
+    def device_loop(self, cuda_device):
+        failures = 0
+        while not self.stopped.is_set():
+            try:
+                answer = self.call('/lease', {'device': cuda_device})
+                failures = 0
+            except (OSError, CoordinatorError) as e:
+                # Give up once the coordinator has been unreachable for longer than a heartbeat timeout
+                failures += 1
+                if failures * self.heartbeat_interval > self.heartbeat_timeout:
+                    self.reporter.notice(f"Coordinator unreachable, stopping GPU {cuda_device}: {e}")
+                    return
+                self.stopped.wait(self.heartbeat_interval)
+                continue
+
+            # One "done" is meant for the whole agent; the other devices stop at their next poll
+            if answer.get('done'):
+                self.stopped.set()
+                return
+            if answer.get('wait'):
+                self.stopped.wait(answer['wait'])
+                continue
+            self.run_lease(answer['lease'], cuda_device)
+
+    # Register and work until every device loop has finished
+    def run(self):
+        self.register()
+        heartbeat_thread = threading.Thread(target=self.send_heartbeats, daemon=True)
+        heartbeat_thread.start()
+        threads = [threading.Thread(target=self.device_loop, args=(cuda_device,), daemon=True) for cuda_device in self.cuda_devices]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stopped.set()
+        heartbeat_thread.join()
+        self.remove_job_dirs()
+
+# Build the command line parser
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Quantization agent: runs variants handed out by a coordinator (quant_engine.py --serve)")
+    parser.add_argument('--coordinator', required=True, help="Coordinator URL, e.g. http://gpu-host-1:8765")
+    parser.add_argument('--name', default=socket.gethostname(), help="Name shown on the coordinator")
+    parser.add_argument('--cuda-device', default='0', help="Comma-separated CUDA devices of this host")
+    parser.add_argument('--venv-path', default='', help="Virtual environment containing exllamav2")
+    parser.add_argument('--exllamav2-dir', required=True, help="Directory containing exllamav2's convert.py")
+    parser.add_argument('--work-dir', default='agent_work', help="Where variants are built before they are uploaded")
+    parser.add_argument('--path-map', action='append', default=[], metavar='REMOTE=LOCAL', help="Map the coordinator's raw weights path prefix to this host's")
+    parser.add_argument('--execution-mode', default='subprocess', choices=quant_engine.EXECUTION_MODES)
+    parser.add_argument('--token', help="Shared token configured on the coordinator")
+    parser.add_argument('--metrics-dir', default='', help="Write metrics as JSON lines and a Prometheus textfile to this directory")
+    parser.add_argument('--phase-timeouts', default='', help="Most minutes per convert.py phase, e.g. quantize=480")
+    parser.add_argument('--stall-timeout', default=quant_engine.DEFAULT_JOB['stall_timeout_min'], help="Kill convert.py after this many minutes without output (0 to disable)")
+    return parser
+
+# Command line entry point
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    path_map = [tuple(mapping.split('=', 1)) for mapping in args.path_map]
+    worker_pool = convert_worker.WorkerPool() if args.execution_mode == 'warm' else None
+    limits = process_control.build_limits(args.phase_timeouts, args.stall_timeout)
+    agent = Agent(args.coordinator, args.name, quant_engine.parse_cuda_devices(args.cuda_device), args.venv_path, args.exllamav2_dir, args.work_dir, path_map, args.token, worker_pool, limits, metrics.get_recorder(args.metrics_dir))
+    try:
+        agent.run()
+    except (OSError, CoordinatorError) as e:
+        print(f"Agent stopped: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if worker_pool:
+            worker_pool.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1365 @@
+import argparse
+import configparser
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import convert_worker
+import disk_planner
+import event_bus
+import measurement_cache
+import metrics
+import output_dedup
+import postprocess
+import process_control
+import progress_parser
+import timing_db
+import variant_plan
+import vram_scheduler
+import weights_staging
+from coordinator import AGENT_WAIT_TIMEOUT, Coordinator
+from job_manifest import JobManifest, MANIFEST_NAME, variant_key
+
+# Timing history next to the scripts, so it does not depend on the directory they are started from
+TIMING_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'timings.sqlite')
+
+# Default settings for a single quantization job
+DEFAULT_JOB = {
+    'model_name': '',
+    'raw_weights_dir': '',
+    'bits_per_head': ['6'],
+    'bpw_values': [],
+    'venv_path': '',
+    'author_name': '',
+    'exllamav2_dir': '',
+    'cuda_device': '0',
+    'measurement_path': '',
+    'measurement_cache_dir': 'measurement_cache',
+    'measurement_cache_max_mb': '512',
+    'output_root': '',
+    'execution_mode': 'subprocess',
+    'scratch_dir': '',
+    'disk_preflight': 'on',
+    'scheduler': 'per_gpu',
+    'vram_budget_gb': '',
+    'memory_provider': 'auto',
+    'postprocess_steps': '',
+    'postprocess_workers': '2',
+    'postprocess_queue': '4',
+    'weights_staging_dir': '',
+    'weights_staging_max_gb': '500',
+    'timing_db': TIMING_DB_PATH,
+    'schedule_order': 'as_entered',
+    'dedup_outputs': 'on',
+    'phase_timeouts': '',
+    'stall_timeout_min': '60',
+    'metrics_dir': '',
+    'measurement_devices': '',
+    'measurement_concurrency': '',
+    'measure_ahead': '2',
+}
+
+# How convert.py is run: a fresh shell and interpreter per call, or one warm worker per GPU
+EXECUTION_MODES = ('subprocess', 'warm')
+
+# How variants share the GPUs: one at a time per GPU, or packed by estimated VRAM
+SCHEDULERS = ('per_gpu', 'packed')
+
+# Orders the variants can be run in
+SCHEDULE_ORDERS = ('as_entered', 'shortest_first', 'longest_first')
+
+# Raised when a job is missing required input
+class JobInputError(ValueError):
+    pass
+
+# Receives progress and messages from the engine; the default prints to the console
+class Reporter:
+    def job_started(self, job, total_variants):
+        print(f"[{job['model_name']}] Quantizing {total_variants} variants")
+
+    def variant_finished(self, variant, cuda_device, succeeded):
+        bits_per_head, bpw = variant
+        status = "done" if succeeded else "FAILED"
+        print(f"[GPU {cuda_device}] {bpw}bpw H{bits_per_head}: {status}")
+
+    def progress(self, variant, event):
+        print(describe_progress(variant, event))
+
+    def variant_skipped(self, variant):
+        bits_per_head, bpw = variant
+        print(f"{bpw}bpw H{bits_per_head}: already complete, skipping")
+
+    def notice(self, message):
+        print(message)
+
+    def info(self, title, message):
+        print(f"{title}: {message}")
+
+    def warning(self, title, message):
+        print(f"{title}: {message}", file=sys.stderr)
+
+    def error(self, title, message):
+        print(f"{title}: {message}", file=sys.stderr)
+
+# One-line description of a progress event, e.g. "4bpw H6: quantize 12/65, 1.20 modules/s | Job 35%, ETA 0:12:00"
+def describe_progress(variant, event):
+    label = "Measurement" if variant is None else f"{variant[1]}bpw H{variant[0]}"
+    module = ""
+    if event.get('module_count') and event.get('module_index', -1) >= 0:
+        module = f" {event['module_index'] + 1}/{event['module_count']}"
+    rate = f", {event['rate']:.2f} modules/s" if event.get('rate') else ""
+    eta = progress_parser.format_duration(event.get('eta'))
+    return f"{label}: {event['phase']}{module}{rate} | Job {event['job_fraction']:.0%}, ETA {eta}"
+
+# Function to check and update the configuration file version
+# Returns a (title, message) pair to show the user, or None
+def check_config_version():
+    config = configparser.ConfigParser()
+    config_file = 'config.ini'
+
+    # Check if the config file exists
+    if os.path.exists(config_file):
+        config.read(config_file)
+
+        # Check if the 'Settings' section exists
+        if 'Settings' not in config:
+            config['Settings'] = {}
+
+        # Get the current version number
+        current_version = config['Settings'].get('version', '0.0')
+
+        # Compare the current version with the required version
+        if float(current_version) < 3.22:
+            # Delete the existing config file
+            os.remove(config_file)
+            config['Settings'] = {}
+            config['Settings']['version'] = '3.22'
+            with open(config_file, 'w') as configfile:
+                config.write(configfile)
+            return "Config Updated", "The configuration file has been updated to version 3.22."
+        else:
+            # Ensure the version number is set in the config
+            config['Settings']['version'] = '3.22'
+            with open(config_file, 'w') as configfile:
+                config.write(configfile)
+    else:  # Create a new config file with version 3.22
+        config['Settings'] = {}
+        config['Settings']['version'] = '3.22'
+        with open(config_file, 'w') as configfile:
+            config.write(configfile)
+        return "Config Created", "A new configuration file has been created with version 3.22."
+    return None
+
+# Load configuration from config.ini
+def load_config():
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+
+    # Ensure the 'Settings' section exists
+    if 'Settings' not in config:
+        config['Settings'] = {}
+
+    # Retrieve configuration values with default values if not present
+    values = {
+        'model_name': config['Settings'].get('model_name', ''),
+        'raw_weights_dir': config['Settings'].get('raw_weights_dir', ''),
+        'bits_per_head': config['Settings'].get('bits_per_head', '6'),
+        'bpw_values': config['Settings'].get('bpw_values', ''),
+        'venv_path': config['Settings'].get('venv_path', ''),
+        'author_name': config['Settings'].get('author_name', ''),
+        'exllamav2_dir': config['Settings'].get('exllamav2_dir', ''),
+        'cuda_device': config['Settings'].get('cuda_device', '0'),
+        'measurement_cache_dir': config['Settings'].get('measurement_cache_dir', 'measurement_cache'),
+        'measurement_cache_max_mb': config['Settings'].get('measurement_cache_max_mb', '512'),
+        'execution_mode': config['Settings'].get('execution_mode', 'subprocess'),
+        'scratch_dir': config['Settings'].get('scratch_dir', ''),
+        'disk_preflight': config['Settings'].get('disk_preflight', 'on'),
+        'scheduler': config['Settings'].get('scheduler', 'per_gpu'),
+        'vram_budget_gb': config['Settings'].get('vram_budget_gb', ''),
+        'memory_provider': config['Settings'].get('memory_provider', 'auto'),
+        'postprocess_steps': config['Settings'].get('postprocess_steps', ''),
+        'postprocess_workers': config['Settings'].get('postprocess_workers', '2'),
+        'postprocess_queue': config['Settings'].get('postprocess_queue', '4'),
+        'weights_staging_dir': config['Settings'].get('weights_staging_dir', ''),
+        'weights_staging_max_gb': config['Settings'].get('weights_staging_max_gb', '500'),
+        'timing_db': config['Settings'].get('timing_db', TIMING_DB_PATH),
+        'schedule_order': config['Settings'].get('schedule_order', 'as_entered'),
+        'dedup_outputs': config['Settings'].get('dedup_outputs', 'on'),
+        'phase_timeouts': config['Settings'].get('phase_timeouts', ''),
+        'stall_timeout_min': config['Settings'].get('stall_timeout_min', '60'),
+        'metrics_dir': config['Settings'].get('metrics_dir', ''),
+        'measurement_devices': config['Settings'].get('measurement_devices', ''),
+        'measurement_concurrency': config['Settings'].get('measurement_concurrency', ''),
+        'measure_ahead': config['Settings'].get('measure_ahead', '2'),
+        'version': config['Settings'].get('version', '3.22')  # Ensure version is included
+    }
+    return values
+
+# Save configuration to config.ini
+def save_config(values):
+    config = configparser.ConfigParser()
+    config['Settings'] = values
+    with open('config.ini', 'w') as configfile:
+        config.write(configfile)
+
+# Split a comma-separated string (or pass through a list) into clean string values
+def split_values(values):
+    if isinstance(values, (list, tuple)):
+        values = [str(value) for value in values]
+    else:
+        values = str(values).split(',')
+    return [value.strip() for value in values if value.strip()]
+
+# Fill in defaults and turn comma-separated fields into lists
+def normalize_job(job):
+    normalized = dict(DEFAULT_JOB)
+    normalized.update(job)
+    normalized['bits_per_head'] = split_values(normalized['bits_per_head'])
+    normalized['bpw_values'] = split_values(normalized['bpw_values'])
+    normalized['cuda_device'] = ','.join(split_values(normalized['cuda_device']))
+    return normalized
+
+# Parse the CUDA device field into a list of device ids (e.g. "0,1,2,3")
+def parse_cuda_devices(cuda_device):
+    devices = [device.strip() for device in str(cuda_device).split(',') if device.strip()]
+    return devices if devices else ['0']
+
+# Get activate command based on OS
+def get_activate_command(venv_path):
+    if os.name == 'nt':  # Windows
+        return f'"{venv_path}\\Scripts\\activate.bat"'
+    else:  # Unix or Linux
+        return f'. "{venv_path}/bin/activate"'
+
+# Quote convert.py arguments for the shell
+def quote_convert_args(convert_args):
+    return ' '.join(f'"{arg}"' for arg in convert_args)
+
+# Build the shell command that runs exllamav2's convert.py inside the venv
+def build_convert_command(venv_path, exllamav2_dir, convert_args):
+    convert_script_path = os.path.join(exllamav2_dir, 'convert.py')
+    command = f'python "{convert_script_path}" {quote_convert_args(convert_args)}'
+
+    # Only activate the virtual environment if one was given
+    if venv_path:
+        command = f'{get_activate_command(venv_path)} && {command}'
+    return command
+
+# Build the shell command that starts a warm conversion worker inside the venv
+def build_worker_command(venv_path, exllamav2_dir):
+    worker_script_path = os.path.abspath(convert_worker.__file__)
+    command = f'python -u "{worker_script_path}" --exllamav2-dir "{os.path.abspath(exllamav2_dir)}"'
+    if venv_path:
+        command = f'{get_activate_command(venv_path)} && {command}'
+    return command
+
+# Run convert.py with the given arguments pinned to a single CUDA device.
+# Output is streamed to log_path and parsed into progress events passed to on_event.
+# With a worker pool the job runs in that GPU's warm worker instead of a fresh process.
+# limits (process_control.build_limits) stop a run that hangs or is cancelled, raising ConvertStopped.
+def run_convert(venv_path, exllamav2_dir, convert_args, cuda_device, log_path=None, on_event=None, module_count=None, worker_pool=None, limits=None):
+    if worker_pool is None:
+        # Pass the device through the environment so it reaches the python child on every OS
+        env = os.environ.copy()
+        env['CUDA_VISIBLE_DEVICES'] = str(cuda_device)
+        command = build_convert_command(venv_path, exllamav2_dir, convert_args)
+        progress_parser.run_streaming(command, env, log_path, on_event, module_count, limits)
+        return
+
+    handler = progress_parser.OutputHandler(log_path, on_event, module_count)
+    try:
+        with worker_pool.lease(build_worker_command(venv_path, exllamav2_dir), cuda_device) as worker:
+            returncode = worker.run(convert_args, handler, process_control.Watchdog(handler.parser, limits))
+    finally:
+        handler.close()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ['convert.py'] + convert_args)
+
+# Run convert.py through run(on_event), recording the stage's duration, convert.py's phases, the raw bytes read
+# and how long the GPU sat idle before the run. Without a recorder (metrics off) it only runs.
+def run_recorded(recorder, stage, context, raw_weights_dir, cuda_device, on_event, run):
+    if recorder is None:
+        return run(on_event)
+
+    phase_timer = recorder.phase_timer(context)
+
+    def timed_event(event):
+        phase_timer(event)
+        if on_event:
+            on_event(event)
+
+    recorder.gpu_busy(cuda_device, context)
+    started = time.monotonic()
+    try:
+        run(timed_event)
+    finally:
+        phase_timer.finish()
+        recorder.gpu_released(cuda_device)
+        recorder.stage(stage, time.monotonic() - started, context)
+    recorder.bytes_read(metrics.directory_size(raw_weights_dir), context)
+
+# Per-variant and measurement log files live in the job directory
+def job_log_path(job_dir, name):
+    return os.path.join(job_dir, 'logs', f"{name}.log")
+
+# Name of the final output directory for a variant
+def variant_output_dir(job_dir, model_name, author_name, bits_per_head, bpw):
+    # Construct the final output directory with _EXL2_ in the name
+    output_dir = os.path.join(job_dir, f"{model_name}_EXL2_{bpw}bpw_H{bits_per_head}")
+
+    # If an author name is provided, include it in the output directory name
+    if author_name:
+        output_dir = os.path.join(job_dir, f"{author_name}_{model_name}_EXL2_{bpw}bpw_H{bits_per_head}")
+    return output_dir
+
+# Name of the temporary quantization directory for a variant
+def variant_temp_dir(work_dir, model_name, bits_per_head, bpw):
+    return os.path.join(work_dir, f"temp_{model_name}_{bpw}bpw_H{bits_per_head}")
+
+# Directory holding a job's temporary files: the job directory itself, or its twin on the scratch disk
+def job_work_dir(job_dir, scratch_dir):
+    if not scratch_dir:
+        return job_dir
+    return os.path.join(os.path.abspath(scratch_dir), os.path.basename(job_dir))
+
+# Function to run quantization on a specific GPU
+# With resume=True an existing temp directory is kept so convert.py can continue where it stopped.
+# With a separate work_dir (scratch disk) the output is assembled there and then moved into the job directory.
+# A run stopped by limits (timeouts, the no-output watchdog or a cancel) is marked failed like any other.
+# After convert.py finishes, the output is handed to the post-processor (or post-processed inline without one);
+# on_finished(succeeded) is called once the variant is completely done or has failed.
+# With a metrics recorder, stage and phase durations, bytes, scratch usage and the result are recorded.
+def run_quantization_on_gpu(model_name, raw_weights_dir, bits_per_head, bpw, venv_path, author_name, cuda_device, exllamav2_dir, job_dir, measurement_json_path, reporter, manifest=None, resume=False, on_event=None, module_count=None, worker_pool=None, work_dir=None, postprocessor=None, on_finished=None, limits=None, recorder=None):
+    report_finished = on_finished or (lambda succeeded: None)
+    context = {'model': model_name, 'bits_per_head': bits_per_head, 'bpw': bpw, 'device': str(cuda_device)}
+    started = time.monotonic()
+
+    def on_finished(succeeded):
+        if recorder:
+            recorder.variant_finished(succeeded, context)
+        report_finished(succeeded)
+
+    # Record a failure and tell the caller, also when the manifest cannot be written
+    def fail(title, message, error):
+        try:
+            if manifest:
+                manifest.update_variant(bits_per_head, bpw, state='failed', error=str(error))
+            reporter.error(title, message)
+        finally:
+            on_finished(False)
+
+    try:
+        # Construct the temporary quantization and final output directories
+        work_dir = work_dir or job_dir
+        temp_quant_dir = variant_temp_dir(work_dir, model_name, bits_per_head, bpw)
+        output_dir = variant_output_dir(job_dir, model_name, author_name, bits_per_head, bpw)
+        compile_dir = os.path.join(work_dir, os.path.basename(output_dir))
+
+        if manifest:
+            manifest.update_variant(bits_per_head, bpw, state='running', phase='prepare', cuda_device=cuda_device, started=datetime.now().isoformat(timespec='seconds'), error=None)
+
+        # Remove existing temp quant directory if it exists, unless it holds a run we can resume
+        if os.path.exists(temp_quant_dir) and not resume:
+            shutil.rmtree(temp_quant_dir)
+
+        # Create new temp quant directory
+        os.makedirs(temp_quant_dir, exist_ok=True)
+
+        # Remove existing output directory if it exists
+        if os.path.exists(compile_dir):
+            shutil.rmtree(compile_dir)
+
+        # Create new output directory
+        os.makedirs(compile_dir)
+
+        # Construct the quantization command
+        quant_args = [
+            '-i', raw_weights_dir,
+            '-o', temp_quant_dir,
+            '-m', measurement_json_path,
+            '-cf', compile_dir,
+            '-b', str(bpw),
+            '-hb', str(bits_per_head),
+        ]
+
+        # Run the quantization command
+        if manifest:
+            manifest.update_variant(bits_per_head, bpw, phase='convert')
+        log_path = job_log_path(job_dir, variant_key(bits_per_head, bpw))
+        if recorder:
+            recorder.stage('prepare', time.monotonic() - started, context)
+        run_recorded(recorder, 'convert', context, raw_weights_dir, cuda_device, on_event, lambda on_event: run_convert(venv_path, exllamav2_dir, quant_args, cuda_device, log_path, on_event, module_count, worker_pool, limits))
+
+    except process_control.ConvertStopped as e:
+        fail("Variant Stopped", f"{bpw}bpw H{bits_per_head} on GPU {cuda_device} was stopped: {e.reason}", e)
+        return False
+    except subprocess.CalledProcessError as e:
+        fail("Command Error", f"An error occurred while running a command on GPU {cuda_device}: {e}", e)
+        return False
+    except Exception as e:
+        fail("Error", f"An unexpected error occurred on GPU {cuda_device}: {e}", e)
+        return False
+
+    # Clean up, place the output and run any extra steps, off the GPU thread when there is a post-processor
+    if manifest:
+        manifest.update_variant(bits_per_head, bpw, phase='finalize')
+    if recorder:
+        used_bytes = metrics.directory_size(temp_quant_dir) + metrics.directory_size(compile_dir)
+        recorder.scratch_usage(used_bytes, disk_planner.free_space(work_dir), context)
+    postprocess_started = time.monotonic()
+    item = {
+        'variant': (bits_per_head, bpw),
+        'job_dir': job_dir,
+        'temp_quant_dir': temp_quant_dir,
+        'compile_dir': compile_dir,
+        'output_dir': output_dir,
+        'measurement_json_path': measurement_json_path,
+        'manifest': manifest,
+    }
+
+    def on_postprocessed(error):
+        if recorder:
+            recorder.stage('postprocess', time.monotonic() - postprocess_started, context)
+            if error is None:
+                recorder.bytes_written(metrics.directory_size(output_dir), context)
+        if error is None:
+            on_finished(True)
+        else:
+            fail("Post-processing Error", f"Post-processing {bpw}bpw H{bits_per_head} failed: {error}", error)
+
+    if postprocessor:
+        postprocessor.submit(item, on_postprocessed)
+        return True
+    error = postprocess.run_steps(postprocess.build_steps(), item)
+    on_postprocessed(error)
+    return error is None
+
+# Run every variant on a pool of per-GPU workers, one variant per GPU at a time
+def run_variants_on_gpus(variants, cuda_devices, run_variant):
+    variant_queue = queue.Queue()
+    for variant in variants:
+        variant_queue.put(variant)
+
+    results = {}
+    results_lock = threading.Lock()
+
+    # Each worker pulls the next variant until the queue is empty
+    def gpu_worker(cuda_device):
+        while True:
+            try:
+                variant = variant_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                succeeded = run_variant(variant, cuda_device)
+            except Exception:
+                succeeded = False
+            with results_lock:
+                results[variant] = succeeded
+
+    workers = [threading.Thread(target=gpu_worker, args=(cuda_device,), daemon=True) for cuda_device in cuda_devices]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    # Return results in the order the variants were given
+    return [(variant, results.get(variant, False)) for variant in variants]
+
+# Create a new job directory named after the model and the current date and time.
+# Jobs of a batch can start within the same second, so a taken name gets a numbered suffix.
+def create_job_dir(output_root, model_name):
+    base_path = os.path.abspath(os.path.join(output_root, f"{model_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"))
+    os.makedirs(output_root, exist_ok=True)
+    job_dir = base_path
+    suffix = 1
+    while True:
+        try:
+            os.makedirs(job_dir)
+            return job_dir
+        except FileExistsError:
+            suffix += 1
+            job_dir = f"{base_path}_{suffix}"
+
+# Run the measurement pass and every quantization variant of one model
+# Passing job_dir resumes the job recorded there instead of starting a new one
+# Returns a list of ((bits_per_head, bpw), succeeded) pairs
+def run_job(job, reporter=None, job_dir=None, worker_pool=None, dispatcher=None, staged_weights_dir=None, cancel_token=None):
+    reporter = reporter or Reporter()
+    job = normalize_job(job)
+    resume = job_dir is not None
+
+    # Check the execution mode
+    if job['execution_mode'] not in EXECUTION_MODES:
+        raise JobInputError(f"Unknown execution mode '{job['execution_mode']}', expected one of: {', '.join(EXECUTION_MODES)}.")
+
+    # Check the scheduler
+    if job['scheduler'] not in SCHEDULERS:
+        raise JobInputError(f"Unknown scheduler '{job['scheduler']}', expected one of: {', '.join(SCHEDULERS)}.")
+
+    # Check the scheduling policy
+    if job['schedule_order'] not in SCHEDULE_ORDERS:
+        raise JobInputError(f"Unknown schedule order '{job['schedule_order']}', expected one of: {', '.join(SCHEDULE_ORDERS)}.")
+
+    # Check the post-processing steps
+    try:
+        steps = postprocess.build_steps(job['postprocess_steps'], job['dedup_outputs'] != 'off')
+    except (ValueError, ImportError, AttributeError) as e:
+        raise JobInputError(str(e))
+
+    # Check the timeouts; every convert.py run of the job is watched with them
+    try:
+        limits = process_control.build_limits(job['phase_timeouts'], job['stall_timeout_min'], cancel_token)
+    except ValueError as e:
+        raise JobInputError(str(e))
+
+    # Warm workers are shared across a batch when the caller passes a pool, otherwise they live for this job
+    if job['execution_mode'] != 'warm':
+        worker_pool = None
+    elif worker_pool is None:
+        worker_pool = convert_worker.WorkerPool()
+        try:
+            return run_job(job, reporter, job_dir, worker_pool, dispatcher, cancel_token=cancel_token)
+        finally:
+            worker_pool.close()
+
+    # Read the raw weights from a local staged copy, kept from eviction while the job runs.
+    # A coordinator only reads them once for the measurement, so it reads the source directly.
+    if staged_weights_dir is None and dispatcher is None and job['weights_staging_dir'] and os.path.isdir(job['raw_weights_dir']):
+        staged_weights_dir = stage_job_weights(job, reporter, hold=True) or ''
+        try:
+            return run_job(job, reporter, job_dir, worker_pool, dispatcher, staged_weights_dir, cancel_token)
+        finally:
+            if staged_weights_dir:
+                weights_staging.release_staged(staged_weights_dir)
+
+    # Get user inputs
+    model_name = job['model_name']
+    raw_weights_dir = staged_weights_dir or job['raw_weights_dir']
+    bits_per_head_values = job['bits_per_head']
+    bpw_values = job['bpw_values']
+    venv_path = job['venv_path']
+    author_name = job['author_name']
+    exllamav2_dir = job['exllamav2_dir']
+    cuda_devices = parse_cuda_devices(job['cuda_device'])
+
+    # Check if bpw_values is empty
+    if not bpw_values:
+        raise JobInputError("Please select or enter at least one bpw value.")
+
+    # Check if bits_per_head_values is empty
+    if not bits_per_head_values:
+        raise JobInputError("Please select at least one bits per head value.")
+
+    # A new job's matrix is canonicalized and checked before anything runs; a resumed job keeps the variants it recorded
+    if not resume:
+        plan = variant_plan.plan_variants(bits_per_head_values, bpw_values)
+        if plan['errors']:
+            raise JobInputError('\n'.join(plan['errors']))
+        for note in plan['notes']:
+            reporter.notice(note)
+        job['bits_per_head'] = bits_per_head_values = plan['bits_per_head']
+        job['bpw_values'] = bpw_values = plan['bpw_values']
+    variants = [(bits_per_head, bpw) for bits_per_head in bits_per_head_values for bpw in bpw_values]
+
+    if resume:
+        job_dir = os.path.abspath(job_dir)
+        manifest = JobManifest.load(job_dir)
+    else:
+        job_dir = create_job_dir(job['output_root'] or os.getcwd(), model_name)
+        manifest = JobManifest.create(job_dir, job, variants)
+
+    # Temporary files go to the scratch directory when one is configured
+    work_dir = job_work_dir(job_dir, job['scratch_dir'])
+
+    # Metrics are only collected when a metrics directory is set
+    recorder = metrics.get_recorder(job['metrics_dir'])
+    job_context = {'model': model_name, 'job_dir': job_dir}
+    job_started = time.monotonic()
+
+    # Track progress over the measurement plus every variant for the job-wide ETA
+    module_count = progress_parser.count_modules(raw_weights_dir)
+    job_progress = progress_parser.JobProgress(len(variants) + 1)
+    reporter.job_started(job, len(variants))
+
+    # baseline marks work finished before this run, which the ETA leaves out of its rate
+    def report_progress(variant, event, baseline=False):
+        job_progress.update(variant, event['fraction'], baseline)
+        event = dict(event, job_fraction=job_progress.fraction(), eta=job_progress.eta())
+        reporter.progress(variant, event)
+
+    # Skip variants that already finished and whose outputs are intact
+    pending_variants = []
+    for variant in variants:
+        if resume and manifest.is_variant_verified(*variant):
+            report_progress(variant, {'phase': 'skipped', 'fraction': 1.0}, baseline=True)
+            reporter.variant_skipped(variant)
+        else:
+            pending_variants.append(variant)
+
+    # Step 3: Check if measurement.json is provided
+    measurement_json_path = os.path.join(job_dir, "measurement.json")
+    measurement_path = job['measurement_path']
+
+    # A resumed job reuses the measurement it already finished
+    if resume and manifest.data['measurement'].get('state') == 'done' and os.path.exists(measurement_json_path):
+        measurement_path = measurement_json_path
+
+    # Otherwise look for a cached measurement of the same weights and exllamav2 checkout
+    measurement_cache_dir = job['measurement_cache_dir']
+    measurement_key = None
+    if not (measurement_path and os.path.exists(measurement_path)) and measurement_cache_dir:
+        measurement_key = measurement_cache.compute_measurement_key(raw_weights_dir, exllamav2_dir)
+        cached_measurement_path = measurement_cache.lookup_measurement(measurement_cache_dir, measurement_key)
+        if cached_measurement_path:
+            measurement_path = cached_measurement_path
+    needs_measurement = not (measurement_path and os.path.exists(measurement_path))
+
+    # Predict the job's duration from past runs and order the variants by the scheduling policy
+    timing = timing_context(job, raw_weights_dir, cuda_devices[0])
+    predicted_seconds, pending_variants = predict_job(timing, pending_variants, needs_measurement, len(cuda_devices), job['schedule_order'])
+    if predicted_seconds is not None:
+        reporter.notice(f"Predicted duration: {progress_parser.format_duration(predicted_seconds)}")
+
+    # Decide how the variants share the GPUs
+    packer = None
+    concurrency = len(cuda_devices)
+    if job['scheduler'] == 'packed' and pending_variants:
+        packer = build_vram_packer(job, pending_variants, cuda_devices)
+        concurrency = packer.max_concurrency()
+
+    # Refuse (or reorder) the job before any GPU work if it will not fit on disk
+    if job['disk_preflight'] != 'off' and pending_variants:
+        pending_variants = check_disk_space(job, pending_variants, needs_measurement, job_dir, work_dir, concurrency, reporter)
+
+    # Step 2: Set up directories
+    temp_measurement_dir = os.path.join(work_dir, "temp_measurement")
+
+    # Remove existing temp directory if it exists (a resumed measurement keeps its progress)
+    if os.path.exists(temp_measurement_dir) and not resume:
+        shutil.rmtree(temp_measurement_dir)
+
+    # Create new temp directory
+    os.makedirs(temp_measurement_dir, exist_ok=True)
+
+    if not needs_measurement:
+        # Check if measurement.json is already in the correct location
+        if os.path.abspath(measurement_path) != os.path.abspath(measurement_json_path):
+            # Copy measurement.json to the job directory
+            shutil.copy(measurement_path, measurement_json_path)
+    else:
+        # First command to take measurements (runs once, on the first GPU)
+        manifest.update_measurement(state='running')
+        measurement_args = [
+            '-i', raw_weights_dir,
+            '-o', temp_measurement_dir,
+            '-om', measurement_json_path,
+        ]
+
+        # Run the measurement command
+        try:
+            on_event = lambda event: report_progress(None, event)
+            started = time.monotonic()
+            measurement_context = dict(job_context, device=cuda_devices[0])
+            run_recorded(recorder, 'measurement', measurement_context, raw_weights_dir, cuda_devices[0], on_event, lambda on_event: run_convert(venv_path, exllamav2_dir, measurement_args, cuda_devices[0], job_log_path(job_dir, 'measurement'), on_event, module_count, worker_pool, limits))
+            record_timing(timing, 'measurement', time.monotonic() - started)
+        except Exception as e:
+            manifest.update_measurement(state='failed', error=str(e))
+            if recorder:
+                recorder.job_finished(False, time.monotonic() - job_started, job_context)
+            raise
+
+        # Keep the new measurement for later jobs on the same model
+        if measurement_key:
+            max_bytes = int(float(job['measurement_cache_max_mb']) * 1024 * 1024)
+            measurement_cache.store_measurement(measurement_cache_dir, measurement_key, measurement_json_path, max_bytes)
+    manifest.update_measurement(state='done', error=None)
+    report_progress(None, {'phase': 'done', 'fraction': 1.0}, baseline=not needs_measurement)
+
+    # Finished variants are cleaned up and placed by a CPU thread pool while the GPUs move on
+    postprocessor = postprocess.PostProcessor(steps, int(job['postprocess_workers']), int(job['postprocess_queue']))
+    final_results = {}
+    final_results_lock = threading.Lock()
+
+    # Record a variant that is completely done or has failed
+    def finish_variant(variant, cuda_device, succeeded):
+        with final_results_lock:
+            final_results[variant] = succeeded
+        report_progress(variant, {'phase': 'done' if succeeded else 'failed', 'fraction': 1.0})
+        reporter.variant_finished(variant, cuda_device, succeeded)
+
+    # Variants the measurement cannot reach fail here, before they take a GPU
+    bpw_range = variant_plan.measurement_bpw_range(measurement_json_path)
+    if bpw_range:
+        for variant in list(pending_variants):
+            bits_per_head, bpw = variant
+            if not bpw_range[0] <= float(bpw) <= bpw_range[1]:
+                message = f"{bpw}bpw is outside the {bpw_range[0]:.2f} to {bpw_range[1]:.2f} bpw this model's measurement allows."
+                manifest.update_variant(bits_per_head, bpw, state='failed', error=message)
+                reporter.error("Input Error", message)
+                pending_variants.remove(variant)
+                job_progress.update(variant, 1.0, baseline=True)
+                finish_variant(variant, '-', False)
+
+    # Run quantization tasks across the available GPUs
+    def run_variant(variant, cuda_device):
+        bits_per_head, bpw = variant
+        # After a cancel the remaining variants stay pending, so a resume picks them up
+        if cancel_token and cancel_token.is_cancelled():
+            return False
+        # An interrupted variant keeps its temp directory so convert.py can resume it
+        resume_variant = resume and manifest.variant(bits_per_head, bpw).get('state') in ('running', 'failed')
+        on_event = lambda event: report_progress(variant, event)
+        on_finished = lambda succeeded: finish_variant(variant, cuda_device, succeeded)
+        started = time.monotonic()
+        succeeded = run_quantization_on_gpu(model_name, raw_weights_dir, bits_per_head, bpw, venv_path, author_name, cuda_device, exllamav2_dir, job_dir, measurement_json_path, reporter, manifest, resume_variant, on_event, module_count, worker_pool, work_dir, postprocessor, on_finished, limits, recorder)
+
+        # A resumed conversion only did part of the work, so it would skew the history
+        if succeeded and not resume_variant:
+            record_timing(timing, 'quantize', time.monotonic() - started, bits_per_head, bpw)
+        return succeeded
+
+    try:
+        # A coordinator hands the variants to remote agents instead of the local GPUs
+        if dispatcher:
+            dispatcher.run(pending_variants, {
+                'job': job,
+                'job_dir': job_dir,
+                'measurement_json_path': measurement_json_path,
+                'manifest': manifest,
+                'postprocessor': postprocessor,
+                'reporter': reporter,
+                'report_progress': report_progress,
+                'finish_variant': finish_variant,
+                'output_dir_for': lambda variant: variant_output_dir(job_dir, model_name, author_name, *variant),
+            }, cancel_token)
+        elif packer:
+            packer.run(pending_variants, run_variant)
+        else:
+            run_variants_on_gpus(pending_variants, cuda_devices, run_variant)
+    finally:
+        postprocessor.close()
+        output_dedup.forget_index(job_dir)
+    results = [(variant, final_results.get(variant, variant not in pending_variants)) for variant in variants]
+    if recorder:
+        recorder.job_finished(all(succeeded for _, succeeded in results), time.monotonic() - job_started, job_context)
+
+    # Keep measurement.json and the measurement temp directory until every variant is done, so the job can be resumed
+    if all(succeeded for _, succeeded in results):
+        # Remove measurement.json from the job directory
+        if os.path.exists(measurement_json_path):
+            os.remove(measurement_json_path)
+
+        # Remove temp_measurement directory, and the job's scratch directory if it has its own
+        if os.path.exists(temp_measurement_dir):
+            shutil.rmtree(temp_measurement_dir)
+        if work_dir != job_dir and os.path.isdir(work_dir) and not os.listdir(work_dir):
+            os.rmdir(work_dir)
+    elif cancel_token and cancel_token.is_cancelled():
+        reporter.warning("Job Cancelled", f"The job was cancelled. Resume it from {job_dir} to finish the remaining variants.")
+    else:
+        reporter.warning("Job Incomplete", f"Some variants failed. Resume the job from {job_dir} to retry only those variants.")
+
+    return results
+
+# Copy a job's raw weights to the local staging directory; returns the staged path, or None to read the source.
+# With background=True the copy runs in a thread, e.g. for the next job of a batch.
+def stage_job_weights(job, reporter, hold=False, background=False):
+    job = normalize_job(job)
+    raw_weights_dir = job['raw_weights_dir']
+    if not job['weights_staging_dir'] or not os.path.isdir(raw_weights_dir):
+        return None
+    max_bytes = int(float(job['weights_staging_max_gb']) * 1024 ** 3)
+    if background:
+        weights_staging.prefetch_weights(raw_weights_dir, job['weights_staging_dir'], max_bytes, reporter.notice)
+        return None
+    staged_weights_dir = weights_staging.stage_weights(raw_weights_dir, job['weights_staging_dir'], max_bytes, reporter.notice, hold)
+    if staged_weights_dir is None:
+        reporter.notice(f"Not enough staging space for {raw_weights_dir}; reading it in place")
+    return staged_weights_dir
+
+# What the timing database needs to know about a job's model and setup, or None when it is disabled
+def timing_context(job, raw_weights_dir, cuda_device):
+    if not job['timing_db']:
+        return None
+    try:
+        model = timing_db.describe_model(raw_weights_dir)
+    except (OSError, ValueError, KeyError):
+        return None
+    return {
+        'db_path': job['timing_db'],
+        'model': model,
+        'gpu_model': timing_db.describe_gpu(cuda_device),
+        'exllamav2_version': timing_db.describe_exllamav2_version(job['exllamav2_dir']),
+    }
+
+# Record a finished run; the history is only a convenience, so failures to write it are ignored
+def record_timing(timing, kind, seconds, bits_per_head=None, bpw=None):
+    if timing is None:
+        return
+    try:
+        timing_db.record_run(timing['db_path'], kind, timing['model'], timing['gpu_model'], timing['exllamav2_version'], seconds, bits_per_head, bpw)
+    except Exception:
+        pass
+
+# Predict a job from the timing history and order its variants by the scheduling policy.
+# Returns (total seconds, or None without enough history, ordered variants)
+def predict_job(timing, variants, needs_measurement, device_count, schedule_order):
+    if timing is None:
+        return None, list(variants)
+
+    # Predict one run, or None
+    def predict(kind, bits_per_head=None, bpw=None):
+        try:
+            return timing_db.predict_run(timing['db_path'], kind, timing['model'], timing['gpu_model'], timing['exllamav2_version'], bits_per_head, bpw)
+        except Exception:
+            return None
+
+    predictions = {variant: predict('quantize', *variant) for variant in variants}
+    variants = order_variants(variants, predictions, schedule_order)
+    measurement_seconds = predict('measurement') if needs_measurement else 0.0
+    if measurement_seconds is None or any(seconds is None for seconds in predictions.values()):
+        return None, variants
+    return measurement_seconds + timing_db.predict_makespan([predictions[variant] for variant in variants], device_count), variants
+
+# Order variants by predicted duration; variants without history count as the average of the others
+def order_variants(variants, predictions, schedule_order):
+    if schedule_order == 'as_entered':
+        return list(variants)
+    known = [seconds for seconds in predictions.values() if seconds is not None]
+    fallback = sum(known) / len(known) if known else 0.0
+    ordered = sorted(variants, key=lambda variant: predictions.get(variant) if predictions.get(variant) is not None else fallback)
+    return ordered[::-1] if schedule_order == 'longest_first' else ordered
+
+# Plan a new job before it is started: canonical variant matrix, dropped duplicates, errors and estimated cost.
+# Nothing runs on a GPU. The plan's 'job' is the job with its canonical matrix, which a saved plan reruns.
+def plan_job(job):
+    job = normalize_job(job)
+    if not os.path.isdir(job['raw_weights_dir']):
+        raise JobInputError(f"Raw weights directory not found: {job['raw_weights_dir']}")
+    cuda_devices = parse_cuda_devices(job['cuda_device'])
+
+    # The measurement is skipped when one is provided or cached; a known one also bounds the bpw
+    measurement_path = job['measurement_path'] if job['measurement_path'] and os.path.exists(job['measurement_path']) else None
+    if measurement_path is None and job['measurement_cache_dir']:
+        measurement_key = measurement_cache.compute_measurement_key(job['raw_weights_dir'], job['exllamav2_dir'])
+        measurement_path = measurement_cache.lookup_measurement(job['measurement_cache_dir'], measurement_key)
+    bpw_range = variant_plan.measurement_bpw_range(measurement_path) if measurement_path else None
+
+    plan = variant_plan.plan_variants(job['bits_per_head'], job['bpw_values'], bpw_range)
+    if not plan['variants'] and not plan['errors']:
+        plan['errors'].append("Please select or enter at least one bpw and one bits per head value.")
+    job['bits_per_head'] = plan['bits_per_head']
+    job['bpw_values'] = plan['bpw_values']
+
+    timing = timing_context(job, job['raw_weights_dir'], cuda_devices[0])
+    seconds, variants = predict_job(timing, plan['variants'], measurement_path is None, len(cuda_devices), job['schedule_order'])
+
+    # Disk estimates, when the weights can be read
+    output_bytes = scratch_bytes = None
+    try:
+        parameter_count = disk_planner.read_parameter_count(job['raw_weights_dir'])
+        config = disk_planner.read_model_config(job['raw_weights_dir'])
+        companion_bytes = disk_planner.companion_files_size(job['raw_weights_dir'])
+        estimates = [disk_planner.estimate_variant(parameter_count, config, companion_bytes, bits_per_head, bpw) for bits_per_head, bpw in variants]
+        output_bytes = sum(estimate['output_bytes'] for estimate in estimates)
+        scratch_bytes = max([estimate['scratch_bytes'] for estimate in estimates] + [disk_planner.estimate_measurement_scratch(config) if measurement_path is None else 0])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    return {
+        'model_name': job['model_name'],
+        'variants': variants,
+        'notes': plan['notes'],
+        'errors': plan['errors'],
+        'measurement': measurement_path or 'to be measured',
+        'bpw_range': bpw_range,
+        'estimated_seconds': seconds,
+        'estimated_output_bytes': output_bytes,
+        'estimated_scratch_bytes': scratch_bytes,
+        'job': job,
+    }
+
+# Predict a new job before it is started, for --predict: returns seconds or None
+def estimate_job(job):
+    return plan_job(job)['estimated_seconds']
+
+# Describe a plan for the user, one fact per line
+def format_plan(plan):
+    lines = [f"{plan['model_name'] or 'Job'}: {len(plan['variants'])} variants"]
+    for bits_per_head in dict.fromkeys(bits_per_head for bits_per_head, _ in plan['variants']):
+        bpw_values = [bpw for head_bits, bpw in plan['variants'] if head_bits == bits_per_head]
+        lines.append(f"  H{bits_per_head}: {', '.join(bpw_values)} bpw")
+    lines.append(f"Measurement: {plan['measurement']}")
+    if plan['bpw_range']:
+        lines.append(f"The measurement allows {plan['bpw_range'][0]:.2f} to {plan['bpw_range'][1]:.2f} bpw")
+    if plan['estimated_seconds'] is not None:
+        lines.append(f"Estimated time: {progress_parser.format_duration(plan['estimated_seconds'])}")
+    else:
+        lines.append("Estimated time: unknown (not enough history)")
+    if plan['estimated_output_bytes'] is not None:
+        lines.append(f"Estimated disk: {disk_planner.format_bytes(plan['estimated_output_bytes'])} of outputs, {disk_planner.format_bytes(plan['estimated_scratch_bytes'])} peak scratch")
+    lines.extend(plan['notes'])
+    lines.extend(f"Error: {error}" for error in plan['errors'])
+    return '\n'.join(lines)
+
+# Estimate each variant's VRAM from config.json and size each GPU's share from its free memory and the budget
+def build_vram_packer(job, variants, cuda_devices):
+    config = disk_planner.read_model_config(job['raw_weights_dir'])
+    estimates = {(bits_per_head, bpw): vram_scheduler.estimate_variant_vram(config, bits_per_head, bpw) for bits_per_head, bpw in variants}
+    budget_bytes = int(float(job['vram_budget_gb']) * 1024 ** 3) if job['vram_budget_gb'] else None
+    memory_provider = vram_scheduler.get_memory_provider(job['memory_provider'])
+    capacities = vram_scheduler.device_capacities(cuda_devices, memory_provider, budget_bytes)
+    return vram_scheduler.VramPacker(capacities, estimates)
+
+# Estimate the disk use of the pending variants and check it fits the output and scratch disks.
+# Returns the variants in the order they should run; raises JobInputError if they do not fit.
+def check_disk_space(job, variants, needs_measurement, job_dir, work_dir, concurrency, reporter):
+    raw_weights_dir = job['raw_weights_dir']
+    if not os.path.isdir(raw_weights_dir):
+        raise JobInputError(f"Raw weights directory not found: {raw_weights_dir}")
+    parameter_count = disk_planner.read_parameter_count(raw_weights_dir)
+    config = disk_planner.read_model_config(raw_weights_dir)
+    companion_bytes = disk_planner.companion_files_size(raw_weights_dir)
+    staged_output = work_dir != job_dir
+
+    estimates = {}
+    for bits_per_head, bpw in variants:
+        estimates[(bits_per_head, bpw)] = disk_planner.estimate_variant(parameter_count, config, companion_bytes, bits_per_head, bpw, staged_output)
+    measurement_scratch = disk_planner.estimate_measurement_scratch(config) if needs_measurement else 0
+
+    try:
+        ordered, _ = disk_planner.plan_disk_usage(variants, estimates, measurement_scratch, job_dir, work_dir, concurrency)
+    except disk_planner.DiskSpaceError as e:
+        raise JobInputError(str(e))
+
+    if ordered != list(variants):
+        reporter.notice("Variants reordered so the ones needing the most scratch space run first and the job fits on disk.")
+    return ordered
+
+# Resume the job recorded in job_dir, optionally overriding settings such as cuda_device
+def resume_job(job_dir, reporter=None, overrides=None, worker_pool=None, dispatcher=None, cancel_token=None):
+    if not JobManifest.exists(job_dir):
+        raise JobInputError(f"No {MANIFEST_NAME} found in {job_dir}.")
+    job = dict(JobManifest.load(job_dir).data['job'])
+    job.update(overrides or {})
+    return run_job(job, reporter, job_dir=job_dir, worker_pool=worker_pool, dispatcher=dispatcher, cancel_token=cancel_token)
+
+# Summarize a job's results as a (title, message, succeeded) triple
+def summarize_results(results):
+    failed = [f"{bpw}bpw H{bits_per_head}" for (bits_per_head, bpw), succeeded in results if not succeeded]
+    if failed:
+        return "Finished With Errors", f"{len(failed)} of {len(results)} variants failed: {', '.join(failed)}", False
+    return "Success", "All processes completed.", True
+
+# Load a batch file: {"defaults": {...}, "jobs": [{...}, ...]}
+# Each job inherits the defaults, so a batch can list many models with their own variant matrices
+def load_batch(batch_path):
+    with open(batch_path) as f:
+        batch = json.load(f)
+
+    # A bare list is treated as a list of jobs with no shared defaults
+    if isinstance(batch, list):
+        batch = {'jobs': batch}
+
+    defaults = batch.get('defaults', {})
+    jobs = []
+    for job in batch.get('jobs', []):
+        merged = dict(defaults)
+        merged.update(job)
+        jobs.append(merged)
+    return jobs
+
+# Name used for a job in batch messages
+def job_label(job):
+    return job.get('model_name') or job.get('resume_dir', '')
+
+# Take a job's measurement ahead of its quantization, on a measurement device.
+# Returns (measurement path, or None when the job has or measures its own, directory to remove once the job has run, or None)
+def measure_ahead(job, cuda_device, reporter, worker_pool=None, cancel_token=None):
+    if job.get('resume_dir'):
+        return None, None
+    job = normalize_job(job)
+    raw_weights_dir = job['raw_weights_dir']
+    if (job['measurement_path'] and os.path.exists(job['measurement_path'])) or not os.path.isdir(raw_weights_dir):
+        return None, None
+
+    # A cached measurement needs no work at all
+    measurement_key = None
+    if job['measurement_cache_dir']:
+        measurement_key = measurement_cache.compute_measurement_key(raw_weights_dir, job['exllamav2_dir'])
+        cached_measurement_path = measurement_cache.lookup_measurement(job['measurement_cache_dir'], measurement_key)
+        if cached_measurement_path:
+            return cached_measurement_path, None
+
+    output_root = job['output_root'] or os.getcwd()
+    os.makedirs(output_root, exist_ok=True)
+    measure_dir = tempfile.mkdtemp(prefix=f"{job['model_name']}_measurement_", dir=output_root)
+    measurement_json_path = os.path.join(measure_dir, 'measurement.json')
+    temp_measurement_dir = os.path.join(measure_dir, 'temp_measurement')
+    measurement_args = ['-i', raw_weights_dir, '-o', temp_measurement_dir, '-om', measurement_json_path]
+    limits = process_control.build_limits(job['phase_timeouts'], job['stall_timeout_min'], cancel_token)
+    worker_pool = worker_pool if job['execution_mode'] == 'warm' else None
+    timing = timing_context(job, raw_weights_dir, cuda_device)
+    context = {'model': job['model_name'], 'device': str(cuda_device)}
+    log_path = os.path.join(measure_dir, 'measurement.log')
+
+    reporter.notice(f"[{job['model_name']}] Measuring ahead on GPU {cuda_device}")
+    started = time.monotonic()
+    try:
+        run_recorded(metrics.get_recorder(job['metrics_dir']), 'measurement', context, raw_weights_dir, cuda_device, None, lambda on_event: run_convert(job['venv_path'], job['exllamav2_dir'], measurement_args, cuda_device, log_path, on_event, progress_parser.count_modules(raw_weights_dir), worker_pool, limits))
+    except Exception:
+        # Keep the log for inspection
+        shutil.rmtree(temp_measurement_dir, ignore_errors=True)
+        reporter.notice(f"[{job['model_name']}] Measurement failed, see {log_path}")
+        raise
+    record_timing(timing, 'measurement', time.monotonic() - started)
+    shutil.rmtree(temp_measurement_dir, ignore_errors=True)
+
+    if measurement_key:
+        max_bytes = int(float(job['measurement_cache_max_mb']) * 1024 * 1024)
+        measurement_cache.store_measurement(job['measurement_cache_dir'], measurement_key, measurement_json_path, max_bytes)
+    reporter.notice(f"[{job['model_name']}] Measurement ready")
+    return measurement_json_path, measure_dir
+
+# First stage of a batch pipeline: measures the batch's models ahead of the quantization stage, on devices of its own.
+# At most `ahead` jobs past the one being quantized are measured, `concurrency` at a time, spread over cuda_devices.
+# The quantization stage collects each job's measurement with wait(index).
+class MeasurementStage:
+    def __init__(self, jobs, cuda_devices, concurrency, ahead, reporter, worker_pool=None, cancel_token=None):
+        self.jobs = jobs
+        self.ahead = max(0, ahead)
+        self.reporter = reporter
+        self.worker_pool = worker_pool
+        self.cancel_token = cancel_token
+        self.results = {}
+        self.next_index = 0
+        self.current_index = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+
+        # One slot per concurrent measurement; with more slots than devices, devices take several at once
+        concurrency = max(1, concurrency)
+        self.devices = queue.Queue()
+        for slot in range(concurrency):
+            self.devices.put(cuda_devices[slot % len(cuda_devices)])
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def is_stopped(self):
+        return self.stopped or (self.cancel_token is not None and self.cancel_token.is_cancelled())
+
+    # Measure the next job once it is within reach of the quantization stage
+    def worker(self):
+        while True:
+            with self.condition:
+                while not self.is_stopped() and self.next_index < len(self.jobs) and self.next_index > self.current_index + self.ahead:
+                    self.condition.wait()
+                if self.is_stopped() or self.next_index >= len(self.jobs):
+                    return
+                index = self.next_index
+                self.next_index += 1
+
+            cuda_device = self.devices.get()
+            try:
+                result = ('done', measure_ahead(self.jobs[index], cuda_device, self.reporter, self.worker_pool, self.cancel_token))
+            except Exception as e:
+                result = ('failed', e)
+            finally:
+                self.devices.put(cuda_device)
+            with self.condition:
+                self.results[index] = result
+                self.condition.notify_all()
+
+    # The quantization stage has reached job `index`: let the stage move further ahead and wait for its measurement.
+    # Returns (measurement path or None, directory to remove or None); raises the error if the measurement failed.
+    def wait(self, index):
+        with self.condition:
+            self.current_index = index
+            self.condition.notify_all()
+            while index not in self.results:
+                if self.is_stopped():
+                    return None, None
+                self.condition.wait(process_control.POLL_INTERVAL)
+            state, value = self.results.pop(index)
+        if state == 'failed':
+            raise value
+        return value
+
+    # Stop measuring further jobs. Not waiting for a running measurement keeps Ctrl+C prompt: the cancel that follows
+    # kills it, and after a normal batch every measurement has already been collected.
+    # Measurements the quantization stage never collected are removed.
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+            results = list(self.results.values())
+            self.results = {}
+        for state, value in results:
+            if state == 'done' and value[1]:
+                shutil.rmtree(value[1], ignore_errors=True)
+
+# Check that the measure-ahead devices of a batch (see run_batch) are not also quantizing one of its jobs:
+# the VRAM packer does not account for a measurement sharing its GPU. Raises JobInputError.
+def check_measurement_devices(jobs):
+    settings = normalize_job(jobs[0]) if jobs else DEFAULT_JOB
+    if not settings['measurement_devices'] or len(jobs) < 2:
+        return
+    measurement_devices = parse_cuda_devices(settings['measurement_devices'])
+    for job in jobs:
+        settings = job
+        if job.get('resume_dir') and 'cuda_device' not in job and JobManifest.exists(job['resume_dir']):
+            settings = JobManifest.load(job['resume_dir']).data['job']
+        shared = [device for device in parse_cuda_devices(normalize_job(settings)['cuda_device']) if device in measurement_devices]
+        if shared:
+            raise JobInputError(f"[{job_label(job)}] cuda_device {', '.join(shared)} is also in measurement_devices; measuring ahead needs GPUs of its own.")
+
+# Run several jobs back to back; a failing job does not stop the rest
+# A job with a 'resume_dir' resumes that job directory, using its other keys as overrides
+# Warm workers are kept alive across the whole batch, so models sharing a venv and GPU reuse them
+# With a dispatcher (coordinator), variants run on remote agents instead of the local GPUs
+# A cancel (cancel_token) stops the running job and skips the rest of the batch
+# With measurement_devices set (taken from the first job, i.e. the batch defaults and command line), measurements run
+# ahead as a separate pipeline stage on those devices while the job's own devices quantize the previous models
+# Returns a list of (job, results or None) pairs
+def run_batch(jobs, reporter=None, dispatcher=None, cancel_token=None):
+    reporter = reporter or Reporter()
+    check_measurement_devices(jobs)
+    worker_pool = convert_worker.WorkerPool()
+    batch_results = []
+    stage = None
+    settings = normalize_job(jobs[0]) if jobs else DEFAULT_JOB
+    if settings['measurement_devices'] and len(jobs) > 1:
+        measurement_devices = parse_cuda_devices(settings['measurement_devices'])
+        concurrency = int(settings['measurement_concurrency'] or len(measurement_devices))
+        stage = MeasurementStage(jobs, measurement_devices, concurrency, int(settings['measure_ahead']), reporter, worker_pool, cancel_token)
+    try:
+        run_batch_jobs(jobs, reporter, worker_pool, batch_results, dispatcher, cancel_token, stage)
+    finally:
+        if stage:
+            stage.close()
+        worker_pool.close()
+    return batch_results
+
+# Run each job of a batch, appending (job, results or None) to batch_results
+# With a measurement stage, each job first takes the measurement the stage made for it
+def run_batch_jobs(jobs, reporter, worker_pool, batch_results, dispatcher=None, cancel_token=None, stage=None):
+    for index, job in enumerate(jobs):
+        if cancel_token and cancel_token.is_cancelled():
+            break
+        measure_dir = None
+        try:
+            run_settings = job
+            if stage:
+                measurement_path, measure_dir = stage.wait(index)
+                if measurement_path:
+                    run_settings = dict(job, measurement_path=measurement_path)
+
+            # Stage this model's weights first, then the next model's in the background while this one quantizes
+            next_job = jobs[index + 1] if index + 1 < len(jobs) else None
+            if dispatcher is None and next_job and not next_job.get('resume_dir'):
+                if not job.get('resume_dir'):
+                    stage_job_weights(job, reporter)
+                stage_job_weights(next_job, reporter, background=True)
+
+            if job.get('resume_dir'):
+                overrides = {key: value for key, value in job.items() if key != 'resume_dir'}
+                results = resume_job(job['resume_dir'], reporter, overrides, worker_pool, dispatcher, cancel_token)
+            else:
+                results = run_job(run_settings, reporter, worker_pool=worker_pool, dispatcher=dispatcher, cancel_token=cancel_token)
+            title, message, _ = summarize_results(results)
+            reporter.info(title, f"[{job_label(job)}] {message}")
+            batch_results.append((job, results))
+        except JobInputError as e:
+            reporter.error("Input Error", f"[{job_label(job)}] {e}")
+            batch_results.append((job, None))
+        except subprocess.CalledProcessError as e:
+            reporter.error("Command Error", f"[{job_label(job)}] An error occurred while running a command: {e}")
+            batch_results.append((job, None))
+        except Exception as e:
+            reporter.error("Error", f"[{job_label(job)}] An unexpected error occurred: {e}")
+            batch_results.append((job, None))
+        finally:
+            # The job directory has its own copy of the measurement by now
+            if measure_dir:
+                shutil.rmtree(measure_dir, ignore_errors=True)
+
+# Build the command line parser
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Headless EXL2 quantization engine")
+    parser.add_argument('--batch', help="JSON batch file listing models and variant matrices")
+    parser.add_argument('--model-name', help="Model name for a single job")
+    parser.add_argument('--raw-weights-dir', help="Directory containing the fp16 weights")
+    parser.add_argument('--bits-per-head', help="Comma-separated head bits, e.g. 6,8")
+    parser.add_argument('--bpw', help="Comma-separated bpw values, e.g. 4,4.5,5")
+    parser.add_argument('--venv-path', help="Virtual environment containing exllamav2")
+    parser.add_argument('--author-name', help="Author name used in output directory names")
+    parser.add_argument('--exllamav2-dir', help="Directory containing exllamav2's convert.py")
+    parser.add_argument('--cuda-device', help="Comma-separated CUDA devices, e.g. 0,1")
+    parser.add_argument('--measurement-path', help="Existing measurement.json to reuse")
+    parser.add_argument('--execution-mode', choices=EXECUTION_MODES, help="'warm' keeps one convert worker per GPU alive instead of starting a new process per call")
+    parser.add_argument('--scratch-dir', help="Fast disk for temporary files; finished outputs are moved into the job directory")
+    parser.add_argument('--no-disk-preflight', action='store_true', help="Skip the disk space check before starting")
+    parser.add_argument('--scheduler', choices=SCHEDULERS, help="'packed' runs several variants per GPU when their estimated VRAM fits")
+    parser.add_argument('--vram-budget-gb', help="Most VRAM per GPU the packed scheduler may plan for")
+    parser.add_argument('--memory-provider', help="Free VRAM source for packing: auto, nvml or static:<GB>")
+    parser.add_argument('--postprocess-steps', help="Extra comma-separated post-processing steps (names or module:function)")
+    parser.add_argument('--no-dedup', action='store_true', help="Keep separate copies of identical companion files in the outputs")
+    parser.add_argument('--weights-staging-dir', help="Local disk to stage the raw weights on before converting (empty: read them in place)")
+    parser.add_argument('--schedule-order', choices=SCHEDULE_ORDERS, help="Run variants as entered, or shortest/longest predicted first")
+    parser.add_argument('--timing-db', help="SQLite file recording run durations (empty to disable)")
+    parser.add_argument('--phase-timeouts', help="Most minutes per convert.py phase, e.g. measure=240,quantize=480")
+    parser.add_argument('--stall-timeout', help="Kill convert.py after this many minutes without output (0 to disable)")
+    parser.add_argument('--metrics-dir', help="Write metrics as JSON lines and a Prometheus textfile to this directory (empty: off)")
+    parser.add_argument('--plan', action='store_true', help="Print the checked variant plan of each job with its estimated cost and exit")
+    parser.add_argument('--save-plan', metavar='PATH', help="With --plan, also save the plans as a batch file that --batch reruns")
+    parser.add_argument('--measurement-devices', help="Batch pipeline: CUDA devices that measure the next models while the others quantize")
+    parser.add_argument('--measurement-concurrency', help="Measurements running at once in the batch pipeline (default: one per measurement device)")
+    parser.add_argument('--measure-ahead', help="How many jobs past the one quantizing may be measured ahead (default 2)")
+    parser.add_argument('--predict', action='store_true', help="Print the predicted duration of the job from past runs and exit")
+    parser.add_argument('--output-root', help="Where job directories are created (default: current directory)")
+    parser.add_argument('--resume', metavar='JOB_DIR', help="Resume an interrupted job, skipping variants that already finished")
+    parser.add_argument('--use-config', action='store_true', help="Start from the settings saved in config.ini")
+    parser.add_argument('--events', metavar='PATH', help="Also write every engine event as a JSON line to PATH ('-' for standard output instead of the usual messages)")
+    parser.add_argument('--serve', metavar='HOST:PORT', help="Act as coordinator: hand the variants to quant_agent.py agents instead of the local GPUs")
+    parser.add_argument('--token', help="Shared token agents must send to the coordinator")
+    parser.add_argument('--agent-wait-timeout', type=float, default=AGENT_WAIT_TIMEOUT / 60, help="As coordinator, fail the pending variants after this many minutes without a live agent")
+    return parser
+
+# Command line entry point
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+
+    # Command line options override config.ini, which overrides the built-in defaults
+    overrides = {
+        'model_name': args.model_name,
+        'raw_weights_dir': args.raw_weights_dir,
+        'bits_per_head': args.bits_per_head,
+        'bpw_values': args.bpw,
+        'venv_path': args.venv_path,
+        'author_name': args.author_name,
+        'exllamav2_dir': args.exllamav2_dir,
+        'cuda_device': args.cuda_device,
+        'measurement_path': args.measurement_path,
+        'output_root': args.output_root,
+        'execution_mode': args.execution_mode,
+        'scratch_dir': args.scratch_dir,
+        'disk_preflight': 'off' if args.no_disk_preflight else None,
+        'scheduler': args.scheduler,
+        'vram_budget_gb': args.vram_budget_gb,
+        'memory_provider': args.memory_provider,
+        'postprocess_steps': args.postprocess_steps,
+        'weights_staging_dir': args.weights_staging_dir,
+        'schedule_order': args.schedule_order,
+        'timing_db': args.timing_db,
+        'dedup_outputs': 'off' if args.no_dedup else None,
+        'phase_timeouts': args.phase_timeouts,
+        'stall_timeout_min': args.stall_timeout,
+        'metrics_dir': args.metrics_dir,
+        'measurement_devices': args.measurement_devices,
+        'measurement_concurrency': args.measurement_concurrency,
+        'measure_ahead': args.measure_ahead,
+    }
+    overrides = {key: value for key, value in overrides.items() if value is not None}
+    base = load_config() if args.use_config else {}
+    base.pop('version', None)
+
+    # A resumed job takes its settings from its manifest; only explicit options override them
+    if args.resume:
+        merged_jobs = [dict(overrides, resume_dir=args.resume)]
+    else:
+        jobs = load_batch(args.batch) if args.batch else [{}]
+        merged_jobs = []
+        for job in jobs:
+            merged = dict(base)
+            merged.update(job)
+            merged.update(overrides)
+            merged_jobs.append(merged)
+
+    try:
+        check_measurement_devices(merged_jobs)
+    except JobInputError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    # Only print the checked plan of each job, and save it for a later run
+    if args.plan:
+        plans = []
+        failed = False
+        for job in merged_jobs:
+            if job.get('resume_dir'):
+                print(f"[{job_label(job)}] A resumed job keeps the plan it was started with")
+                continue
+            try:
+                plan = plan_job(job)
+            except JobInputError as e:
+                print(f"[{job_label(job)}] {e}", file=sys.stderr)
+                failed = True
+                continue
+            print(format_plan(plan))
+            failed = failed or bool(plan['errors'])
+            plans.append(plan)
+        if args.save_plan:
+            if failed:
+                print("Plan not saved: fix the errors above first.", file=sys.stderr)
+            else:
+                variant_plan.save_plans(plans, args.save_plan)
+                print(f"Plan saved; run it with: python quant_engine.py --batch {args.save_plan}")
+        return 1 if failed else 0
+
+    # Only print what each job is expected to take
+    if args.predict:
+        for job in merged_jobs:
+            if job.get('resume_dir'):
+                print(f"[{job_label(job)}] Predictions cover new jobs only")
+                continue
+            try:
+                seconds = estimate_job(job)
+            except JobInputError as e:
+                print(f"[{job_label(job)}] {e}", file=sys.stderr)
+                continue
+            prediction = progress_parser.format_duration(seconds) if seconds is not None else "unknown (not enough history)"
+            print(f"[{job_label(job)}] Predicted duration: {prediction}")
+        return 0
+
+    # As coordinator, the variants go to remote agents; the measurement still runs here unless it is provided or cached
+    dispatcher = None
+    if args.serve:
+        host, _, port = args.serve.rpartition(':')
+        dispatcher = Coordinator(host or '127.0.0.1', int(port), args.token, agent_wait_timeout=args.agent_wait_timeout * 60)
+    # With --events the engine publishes to an event bus, read by the JSON-lines writer and the console
+    reporter = None
+    stop_consumers = []
+    if args.events:
+        bus = event_bus.EventBus()
+        reporter = event_bus.BusReporter(bus)
+        if args.events != '-':
+            console = Reporter()
+            stop_consumers.append(event_bus.start_consumer(bus, lambda event: event_bus.replay(event, console)))
+        stop_consumers.append(event_bus.start_json_lines_writer(bus, args.events))
+
+    # Ctrl+C no longer reaches convert.py in its own process group, so it cancels the batch instead
+    cancel_token = process_control.CancelToken()
+    try:
+        batch_results = run_batch(merged_jobs, reporter, dispatcher, cancel_token)
+    except KeyboardInterrupt:
+        cancel_token.cancel()
+        print("Cancelled; resume the job directory to finish the remaining variants.", file=sys.stderr)
+        return 130
+    finally:
+        if dispatcher:
+            dispatcher.close()
+        for stop_consumer in stop_consumers:
+            stop_consumer()
+    all_succeeded = all(results is not None and summarize_results(results)[2] for _, results in batch_results)
+    return 0 if all_succeeded else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
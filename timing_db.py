@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import sqlite3
+import statistics
+import time
+from disk_planner import read_model_config, read_parameter_count
+from measurement_cache import describe_exllamav2_checkout
+
+# Runs kept per key when predicting; older ones no longer reflect the current setup
+RECENT_RUNS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    parameter_count INTEGER NOT NULL,
+    architecture TEXT NOT NULL,
+    bpw REAL,
+    bits_per_head INTEGER,
+    gpu_model TEXT NOT NULL,
+    exllamav2_version TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs (kind, architecture, gpu_model, exllamav2_version);
+"""
+
+# Open the database, creating it on first use
+def connect(db_path):
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+# Parameter count and architecture of a model, the model part of a timing key
+def describe_model(raw_weights_dir):
+    config = read_model_config(raw_weights_dir)
+    with open(os.path.join(raw_weights_dir, 'config.json')) as f:
+        full_config = json.load(f)
+    architecture = (full_config.get('architectures') or [config.get('model_type', 'unknown')])[0]
+    return {'parameter_count': read_parameter_count(raw_weights_dir), 'architecture': architecture}
+
+# exllamav2 version from its version.py, or the checkout's git commit
+def describe_exllamav2_version(exllamav2_dir):
+    try:
+        with open(os.path.join(exllamav2_dir, 'exllamav2', 'version.py')) as f:
+            match = re.search(r"__version__\s*=\s*['\"]([^'\"]+)", f.read())
+        if match:
+            return match.group(1)
+    except OSError:
+        pass
+    return describe_exllamav2_checkout(exllamav2_dir).get('git_head', 'unknown')
+
+# Name of the GPU behind a CUDA device, through NVML when it is available
+def describe_gpu(cuda_device):
+    try:
+        import pynvml
+        pynvml.nvmlInit()
+        name = pynvml.nvmlDeviceGetName(pynvml.nvmlDeviceGetHandleByIndex(int(cuda_device)))
+        return name.decode() if isinstance(name, bytes) else name
+    except Exception:
+        return 'unknown'
+
+# Record how long one measurement or quantization run took
+def record_run(db_path, kind, model, gpu_model, exllamav2_version, seconds, bits_per_head=None, bpw=None):
+    connection = connect(db_path)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT INTO runs (kind, parameter_count, architecture, bpw, bits_per_head, gpu_model, exllamav2_version, seconds, recorded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, model['parameter_count'], model['architecture'], None if bpw is None else float(bpw), None if bits_per_head is None else int(bits_per_head), gpu_model, exllamav2_version, seconds, time.time()),
+            )
+    finally:
+        connection.close()
+
+# Predict the seconds of a run from past runs, or None without any usable history.
+# Exact matches are preferred; otherwise runs of the same kind are scaled by parameter count (and by bpw for
+# quantization runs, so the variants of a new model still differ), closest setup first (same architecture,
+# GPU and exllamav2 version, then fewer of them).
+def predict_run(db_path, kind, model, gpu_model, exllamav2_version, bits_per_head=None, bpw=None):
+    if not os.path.exists(db_path):
+        return None
+    connection = connect(db_path)
+    try:
+        exact = connection.execute(
+            "SELECT seconds FROM runs WHERE kind = ? AND parameter_count = ? AND architecture = ? AND bpw IS ? AND bits_per_head IS ? AND gpu_model = ? AND exllamav2_version = ? ORDER BY recorded DESC LIMIT ?",
+            (kind, model['parameter_count'], model['architecture'], None if bpw is None else float(bpw), None if bits_per_head is None else int(bits_per_head), gpu_model, exllamav2_version, RECENT_RUNS),
+        ).fetchall()
+        if exact:
+            return statistics.median(seconds for seconds, in exact)
+
+        for conditions, values in (
+            ("architecture = ? AND gpu_model = ? AND exllamav2_version = ?", (model['architecture'], gpu_model, exllamav2_version)),
+            ("gpu_model = ?", (gpu_model,)),
+            ("1 = 1", ()),
+        ):
+            rows = connection.execute(
+                f"SELECT seconds, parameter_count, bpw FROM runs WHERE kind = ? AND parameter_count > 0 AND {conditions} ORDER BY recorded DESC LIMIT ?",
+                (kind,) + values + (RECENT_RUNS,),
+            ).fetchall()
+            if rows and model['parameter_count']:
+                if bpw is None:
+                    return statistics.median(seconds / parameter_count for seconds, parameter_count, _ in rows) * model['parameter_count']
+                return statistics.median(seconds / (parameter_count * (row_bpw or float(bpw))) for seconds, parameter_count, row_bpw in rows) * model['parameter_count'] * float(bpw)
+        return None
+    finally:
+        connection.close()
+
+# Wall time of running variants in order on several devices, each taking the next variant when it is free
+def predict_makespan(durations, device_count):
+    free_at = [0.0] * max(1, device_count)
+    for seconds in durations:
+        index = free_at.index(min(free_at))
+        free_at[index] += seconds
+    return max(free_at)
@@ -0,0 +1,156 @@
+# Benchmark of the quantizer's own orchestration cost: process spawn, venv activation,
+# directory churn, measurement.json copies and idle GPU gaps between variants.
+# It runs the full engine pipeline headlessly against tools/fake_exllamav2/convert.py,
+# whose "GPU work" is a configurable sleep, and reports the results as JSON.
+#
+#   python tools/bench_orchestration.py --bpw 3,4,5,6 --devices 0,1 --quant-delay 0.5
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import quant_engine  # noqa: E402
+
+FAKE_EXLLAMAV2_DIR = os.path.join(REPO_DIR, 'tools', 'fake_exllamav2')
+
+# Reporter that keeps quiet apart from errors
+class QuietReporter(quant_engine.Reporter):
+    def job_started(self, job, total_variants):
+        pass
+
+    def progress(self, variant, event):
+        pass
+
+    def variant_finished(self, variant, cuda_device, succeeded):
+        pass
+
+    def variant_skipped(self, variant):
+        pass
+
+    def notice(self, message):
+        pass
+
+    def info(self, title, message):
+        pass
+
+# Write a tiny synthetic model: a config.json and a safetensors file with one small tensor
+def make_synthetic_model(model_dir, num_layers):
+    os.makedirs(model_dir, exist_ok=True)
+    with open(os.path.join(model_dir, 'config.json'), 'w') as f:
+        json.dump({'num_hidden_layers': num_layers, 'hidden_size': 64, 'vocab_size': 128}, f)
+    header = json.dumps({'weight': {'dtype': 'F16', 'shape': [64, 64], 'data_offsets': [0, 64 * 64 * 2]}}).encode('utf-8')
+    with open(os.path.join(model_dir, 'model.safetensors'), 'wb') as f:
+        f.write(struct.pack('<Q', len(header)) + header + b'\0' * (64 * 64 * 2))
+
+# Merge overlapping [start, end] intervals and return their total length
+def busy_seconds(intervals):
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+# Run one benchmark job and return its metrics
+def run_benchmark(args, work_dir):
+    model_dir = os.path.join(work_dir, 'model')
+    trace_path = os.path.join(work_dir, 'trace.jsonl')
+    make_synthetic_model(model_dir, args.layers)
+
+    os.environ['FAKE_CONVERT_MEASURE_DELAY'] = str(args.measure_delay)
+    os.environ['FAKE_CONVERT_QUANT_DELAY'] = str(args.quant_delay)
+    os.environ['FAKE_CONVERT_OUTPUT_BYTES'] = str(int(args.output_mb * 1024 * 1024))
+    os.environ['FAKE_CONVERT_TRACE'] = trace_path
+
+    job = {
+        'model_name': 'Bench',
+        'raw_weights_dir': model_dir,
+        'bits_per_head': args.bits_per_head,
+        'bpw_values': args.bpw,
+        'venv_path': args.venv_path,
+        'exllamav2_dir': FAKE_EXLLAMAV2_DIR,
+        'cuda_device': args.devices,
+        'measurement_cache_dir': '',
+        'timing_db': '',
+        'output_root': os.path.join(work_dir, 'out'),
+        'scratch_dir': args.scratch_dir,
+        'execution_mode': args.execution_mode,
+    }
+
+    started = time.monotonic()
+    results = quant_engine.run_job(job, QuietReporter())
+    wall_seconds = time.monotonic() - started
+
+    # Per-device busy time from the fake convert.py trace
+    intervals = {}
+    with open(trace_path) as f:
+        for line in f:
+            record = json.loads(line)
+            intervals.setdefault(record['device'], []).append((record['start'], record['end']))
+
+    devices = quant_engine.parse_cuda_devices(args.devices)
+    busy_by_device = {device: busy_seconds(intervals.get(device, [])) for device in devices}
+    total_busy = sum(busy_by_device.values())
+    device_seconds = wall_seconds * len(devices)
+    variant_count = len(results)
+
+    return {
+        'wall_seconds': wall_seconds,
+        'variants': variant_count,
+        'failed_variants': sum(1 for _, succeeded in results if not succeeded),
+        'gpu_busy_seconds': busy_by_device,
+        'gpu_idle_fraction': 1.0 - total_busy / device_seconds if device_seconds else 0.0,
+        # Device time not spent on simulated GPU work, spread over every convert.py call (variants + measurement)
+        'overhead_per_variant_seconds': (device_seconds - total_busy) / (variant_count + 1),
+    }
+
+# Build the command line parser
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the quantizer's orchestration overhead with a fake convert.py")
+    parser.add_argument('--bpw', default='3,4,5,6', help="Comma-separated bpw values")
+    parser.add_argument('--bits-per-head', default='6', help="Comma-separated head bits")
+    parser.add_argument('--devices', default='0', help="Comma-separated fake CUDA devices")
+    parser.add_argument('--layers', type=int, default=8, help="Layers in the synthetic model")
+    parser.add_argument('--measure-delay', type=float, default=0.5, help="Seconds of simulated GPU work in the measurement pass")
+    parser.add_argument('--quant-delay', type=float, default=0.5, help="Seconds of simulated GPU work per variant")
+    parser.add_argument('--output-mb', type=float, default=1.0, help="Size of each fake quantized output, in MB")
+    parser.add_argument('--execution-mode', default='subprocess', choices=quant_engine.EXECUTION_MODES)
+    parser.add_argument('--venv-path', default='', help="Virtual environment to activate, to include activation cost")
+    parser.add_argument('--scratch-dir', default='', help="Scratch directory for temporary files")
+    parser.add_argument('--repeat', type=int, default=1, help="Number of runs; each run is reported")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    return parser
+
+# Command line entry point
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    runs = []
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory(prefix='exl2_bench_') as work_dir:
+            runs.append(run_benchmark(args, work_dir))
+
+    report = {
+        'settings': vars(args),
+        'runs': runs,
+        'best_wall_seconds': min(run['wall_seconds'] for run in runs),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    return 0 if all(run['failed_variants'] == 0 for run in runs) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
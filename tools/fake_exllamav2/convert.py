@@ -0,0 +1,103 @@
+# Stand-in for exllamav2's convert.py, used to exercise the quantizer without a GPU.
+# Point the "Exllamav2 Directory" field at tools/fake_exllamav2 to use it.
+# It prints the same kind of progress lines as the real script.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+parser = argparse.ArgumentParser(description="Fake exllamav2 convert.py")
+parser.add_argument('-i', '--in_dir', required=True)
+parser.add_argument('-o', '--out_dir', required=True)
+parser.add_argument('-om', '--measurement_output')
+parser.add_argument('-m', '--measurement')
+parser.add_argument('-cf', '--compile_full')
+parser.add_argument('-b', '--bits', type=float)
+parser.add_argument('-hb', '--head_bits', type=int)
+args = parser.parse_args()
+
+# How long each phase sleeps, in seconds (FAKE_CONVERT_DELAY sets both)
+delay = float(os.environ.get('FAKE_CONVERT_DELAY', '1'))
+measure_delay = float(os.environ.get('FAKE_CONVERT_MEASURE_DELAY', delay))
+quant_delay = float(os.environ.get('FAKE_CONVERT_QUANT_DELAY', delay))
+
+# Size of the fake quantized weights written to the output directory
+output_bytes = int(os.environ.get('FAKE_CONVERT_OUTPUT_BYTES', '1024'))
+
+# Optional JSON-lines file recording when this process was "busy on the GPU"
+trace_path = os.environ.get('FAKE_CONVERT_TRACE')
+
+# Optionally fail on purpose so error handling can be checked
+if os.environ.get('FAKE_CONVERT_FAIL_BPW') and args.bits is not None:
+    if float(os.environ['FAKE_CONVERT_FAIL_BPW']) == args.bits:
+        print(f"Fake failure for {args.bits} bpw", file=sys.stderr)
+        sys.exit(1)
+
+# Optionally hang halfway through quantizing, with a child process holding on too, so the watchdog can be checked
+hang_bpw = os.environ.get('FAKE_CONVERT_HANG_BPW')
+hangs = bool(hang_bpw) and args.bits is not None and float(hang_bpw) == args.bits
+
+# Step through as many layers as the model's config.json declares
+num_layers = 4
+config_path = os.path.join(args.in_dir, 'config.json')
+if os.path.exists(config_path):
+    with open(config_path) as f:
+        num_layers = json.load(f).get('num_hidden_layers', num_layers)
+modules = [f"model.layers.{i} ({kind})" for i in range(num_layers) for kind in ('Attention', 'MLP')]
+modules.append("lm_head (Linear)")
+
+os.makedirs(args.out_dir, exist_ok=True)
+print(f" -- Fake convert on CUDA_VISIBLE_DEVICES={os.environ.get('CUDA_VISIBLE_DEVICES', '')}")
+print(" -- Tokenizing samples (measurement)...")
+print(" -- Token embeddings (measurement)...")
+
+# Walk the modules, sleeping a share of the phase delay in each
+def walk_modules(header, phase, phase_delay):
+    print(f" -- {header}...")
+    started = time.time()
+    for index, module in enumerate(modules):
+        print(f" -- Layer: {module}")
+        time.sleep(phase_delay / len(modules))
+        if hangs and phase == 'quantize' and index == len(modules) // 2:
+            subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(3600)'])
+            time.sleep(3600)
+    if trace_path:
+        with open(trace_path, 'a') as f:
+            f.write(json.dumps({
+                'device': os.environ.get('CUDA_VISIBLE_DEVICES', ''),
+                'phase': phase,
+                'bits': args.bits,
+                'start': started,
+                'end': time.time(),
+            }) + '\n')
+
+# Measurement pass
+if args.measurement_output:
+    walk_modules("Measuring quantization impact", 'measure', measure_delay)
+    with open(args.measurement_output, 'w') as f:
+        json.dump({'fake': True, 'in_dir': args.in_dir}, f)
+
+# Quantization pass
+if args.compile_full:
+    walk_modules("Quantizing", 'quantize', quant_delay)
+    print(" -- Compiling output file...")
+    os.makedirs(args.compile_full, exist_ok=True)
+    with open(os.path.join(args.compile_full, 'output.safetensors'), 'wb') as f:
+        remaining = output_bytes
+        while remaining > 0:
+            chunk = min(remaining, 1 << 20)
+            f.write(b'\0' * chunk)
+            remaining -= chunk
+    with open(os.path.join(args.compile_full, 'config.json'), 'w') as f:
+        json.dump({'bits': args.bits, 'head_bits': args.head_bits}, f)
+
+    # Like the real script, copy the model's other files (tokenizer, generation config, ...) next to the weights
+    for file_name in os.listdir(args.in_dir):
+        path = os.path.join(args.in_dir, file_name)
+        if os.path.isfile(path) and file_name != 'config.json' and not file_name.endswith('.safetensors'):
+            shutil.copy(path, args.compile_full)
+
+print(" -- Finished")
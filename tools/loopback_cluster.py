@@ -0,0 +1,95 @@
+# Loopback test of the coordinator/agent mode: a coordinator and several agents on this machine,
+# each agent a separate quant_agent.py process with its own fake CUDA device, all using
+# tools/fake_exllamav2/convert.py. Optionally kills one agent mid-job to exercise reassignment.
+#
+#   python tools/loopback_cluster.py --agents 2 --bpw 3,4,5,6 --kill-agent-after 1.0
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+import quant_engine  # noqa: E402
+from bench_orchestration import FAKE_EXLLAMAV2_DIR, QuietReporter, make_synthetic_model  # noqa: E402
+from coordinator import Coordinator  # noqa: E402
+
+# Start one agent process
+def start_agent(url, index, work_dir):
+    command = [
+        sys.executable, os.path.join(REPO_DIR, 'quant_agent.py'),
+        '--coordinator', url,
+        '--name', f"loopback-{index}",
+        '--cuda-device', str(index),
+        '--exllamav2-dir', FAKE_EXLLAMAV2_DIR,
+        '--work-dir', os.path.join(work_dir, f"agent_{index}"),
+    ]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+# Run one job through a loopback coordinator and return a summary
+def run_loopback(args, work_dir):
+    model_dir = os.path.join(work_dir, 'model')
+    make_synthetic_model(model_dir, args.layers)
+    os.environ['FAKE_CONVERT_MEASURE_DELAY'] = str(args.measure_delay)
+    os.environ['FAKE_CONVERT_QUANT_DELAY'] = str(args.quant_delay)
+
+    coordinator = Coordinator('127.0.0.1', 0, heartbeat_interval=args.heartbeat_interval, heartbeat_timeout=args.heartbeat_timeout)
+    agents = [start_agent(coordinator.url(), index, work_dir) for index in range(args.agents)]
+
+    # Simulate a host going down in the middle of the job
+    if args.kill_agent_after is not None:
+        threading.Timer(args.measure_delay + args.kill_agent_after, agents[0].kill).start()
+
+    job = {
+        'model_name': 'Loopback',
+        'raw_weights_dir': model_dir,
+        'bpw_values': args.bpw,
+        'exllamav2_dir': FAKE_EXLLAMAV2_DIR,
+        'measurement_cache_dir': '',
+        'timing_db': '',
+        'output_root': os.path.join(work_dir, 'out'),
+    }
+    started = time.monotonic()
+    try:
+        results = quant_engine.run_job(job, QuietReporter(), dispatcher=coordinator)
+    finally:
+        coordinator.close()
+    wall_seconds = time.monotonic() - started
+
+    exit_codes = [agent.wait(timeout=30) for agent in agents]
+    job_dir = os.path.join(work_dir, 'out', os.listdir(os.path.join(work_dir, 'out'))[0])
+    return {
+        'wall_seconds': wall_seconds,
+        'variants': len(results),
+        'failed_variants': sum(1 for _, succeeded in results if not succeeded),
+        'outputs': sorted(name for name in os.listdir(job_dir) if '_EXL2_' in name),
+        'agent_exit_codes': exit_codes,
+    }
+
+# Build the command line parser
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Run a coordinator and agents on this machine against a fake convert.py")
+    parser.add_argument('--agents', type=int, default=2, help="Number of agent processes")
+    parser.add_argument('--bpw', default='3,4,5,6', help="Comma-separated bpw values")
+    parser.add_argument('--layers', type=int, default=4, help="Layers in the synthetic model")
+    parser.add_argument('--measure-delay', type=float, default=0.2, help="Seconds of simulated GPU work in the measurement pass")
+    parser.add_argument('--quant-delay', type=float, default=1.0, help="Seconds of simulated GPU work per variant")
+    parser.add_argument('--heartbeat-interval', type=float, default=0.5)
+    parser.add_argument('--heartbeat-timeout', type=float, default=2.0)
+    parser.add_argument('--kill-agent-after', type=float, help="Kill the first agent this many seconds after the measurement")
+    return parser
+
+# Command line entry point
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='exl2_loopback_') as work_dir:
+        summary = run_loopback(args, work_dir)
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['failed_variants'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+import json
+import math
+import os
+
+# Head bits exllamav2 can quantize the output layer to
+HEAD_BITS = (2, 3, 4, 5, 6, 8)
+
+# Target bpw exllamav2 can reach: layers are stored with 2 to 8 bit weights
+MIN_BPW = 2.0
+MAX_BPW = 8.0
+
+# Canonical text of a bpw value, so 4, 4.0 and 4.00 all name the same variant and output directory
+def canonical_bpw(value):
+    bpw = float(value)
+    if not math.isfinite(bpw):
+        raise ValueError(value)
+    return format(bpw, 'g')
+
+# Canonical text of a head bits value
+def canonical_head_bits(value):
+    head_bits = float(value)
+    if not head_bits.is_integer():
+        raise ValueError(value)
+    return str(int(head_bits))
+
+# Lowest and highest average bpw a measurement.json allows, from the cheapest and costliest option of every layer.
+# Returns None when the file does not look like an exllamav2 measurement.
+def measurement_bpw_range(measurement_path):
+    try:
+        with open(measurement_path) as f:
+            layers = json.load(f).get('measurement')
+        low_bits = high_bits = numel = 0
+        for options in layers.values():
+            bits = [option['total_bits'] for option in options]
+            low_bits += min(bits)
+            high_bits += max(bits)
+            numel += options[0]['numel']
+    except (OSError, ValueError, AttributeError, KeyError, TypeError, IndexError):
+        return None
+    if not numel:
+        return None
+    return low_bits / numel, high_bits / numel
+
+# Parse, canonicalize and check a variant matrix. Empty entries and duplicates (4 and 4.0) are dropped with a note;
+# values exllamav2 cannot use are errors. With bpw_range (from measurement_bpw_range) bpw is also checked against it.
+# Returns {'bits_per_head': [...], 'bpw_values': [...], 'variants': [(bits_per_head, bpw), ...], 'notes': [...], 'errors': [...]}
+def plan_variants(bits_per_head_values, bpw_values, bpw_range=None):
+    notes = []
+    errors = []
+
+    # Canonical values in the order they were entered, without duplicates
+    def canonicalize(values, canonical, check, label):
+        kept = []
+        for value in values:
+            value = str(value).strip()
+            if not value:
+                continue
+            try:
+                canonical_value = canonical(value)
+            except ValueError:
+                errors.append(f"'{value}' is not a valid {label} value.")
+                continue
+            if canonical_value in kept:
+                same = "listed twice" if canonical_value == value else f"the same as {canonical_value}"
+                notes.append(f"Dropped {label} '{value}': {same}.")
+                continue
+            problem = check(float(canonical_value))
+            if problem:
+                errors.append(f"{label} {canonical_value}: {problem}")
+                continue
+            kept.append(canonical_value)
+        return kept
+
+    def check_head_bits(head_bits):
+        if int(head_bits) not in HEAD_BITS:
+            return f"exllamav2 supports {', '.join(str(bits) for bits in HEAD_BITS)} head bits."
+        return None
+
+    def check_bpw(bpw):
+        if not MIN_BPW <= bpw <= MAX_BPW:
+            return f"outside the {MIN_BPW:g} to {MAX_BPW:g} bpw exllamav2 can quantize to."
+        if bpw_range and not bpw_range[0] <= bpw <= bpw_range[1]:
+            return f"outside the {bpw_range[0]:.2f} to {bpw_range[1]:.2f} bpw this model's measurement allows."
+        return None
+
+    bits_per_head = canonicalize(bits_per_head_values, canonical_head_bits, check_head_bits, 'head bits')
+    bpw = canonicalize(bpw_values, canonical_bpw, check_bpw, 'bpw')
+    return {
+        'bits_per_head': bits_per_head,
+        'bpw_values': bpw,
+        'variants': [(head_bits, value) for head_bits in bits_per_head for value in bpw],
+        'notes': notes,
+        'errors': errors,
+    }
+
+# Save plans as a batch file: the canonical jobs under "jobs" (so --batch reruns them) and the plan summaries beside them
+def save_plans(plans, plan_path):
+    with open(plan_path + '.tmp', 'w') as f:
+        summaries = [{key: value for key, value in plan.items() if key != 'job'} for plan in plans]
+        json.dump({'plans': summaries, 'jobs': [plan['job'] for plan in plans]}, f, indent=2)
+    os.replace(plan_path + '.tmp', plan_path)
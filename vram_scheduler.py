@@ -0,0 +1,158 @@
+import threading
+
+# Fixed VRAM cost of a CUDA context plus torch's allocator slack
+CUDA_CONTEXT_BYTES = 768 * 1024 ** 2
+
+# Calibration tokens convert.py pushes through a layer at once
+CALIBRATION_LENGTH = 2048
+
+# Headroom over the estimate for fragmentation and allocator caching
+VRAM_SAFETY_MARGIN = 1.25
+
+# Estimate the peak VRAM of one conversion from the model's config.json, in bytes.
+# convert.py works one layer at a time: the layer's fp16 weights, the float32 Hessian of its widest
+# input, and activations for a calibration row are resident together. The head is done on its own,
+# with its fp16 weights, a quantized copy and the float32 logits of a calibration row.
+def estimate_variant_vram(config, bits_per_head, bpw):
+    hidden_size = config.get('hidden_size', 0)
+    intermediate_size = config.get('intermediate_size', 4 * hidden_size)
+    vocab_size = config.get('vocab_size', 0)
+    num_heads = config.get('num_attention_heads', 1) or 1
+    num_kv_heads = config.get('num_key_value_heads', num_heads) or num_heads
+    num_experts = config.get('num_local_experts', 1) or 1
+
+    # Attention (q, o full width; k, v scaled by grouped-query heads) and a gated MLP per expert
+    attention_parameters = 2 * hidden_size * hidden_size + 2 * hidden_size * hidden_size * num_kv_heads // num_heads
+    mlp_parameters = 3 * hidden_size * intermediate_size * num_experts
+    layer_weight_bytes = (attention_parameters + mlp_parameters) * 2
+
+    widest_input = max(hidden_size, intermediate_size)
+    hessian_bytes = widest_input * widest_input * 4
+    activation_bytes = CALIBRATION_LENGTH * widest_input * 4 * 4
+    layer_peak = layer_weight_bytes + hessian_bytes + activation_bytes
+
+    head_weight_bytes = vocab_size * hidden_size * 2
+    head_quantized_bytes = vocab_size * hidden_size * float(bits_per_head) / 8
+    logits_bytes = CALIBRATION_LENGTH * vocab_size * 4
+    head_peak = head_weight_bytes + head_quantized_bytes + logits_bytes + hidden_size * hidden_size * 4
+
+    # Lower bpw targets try more quantization options per layer; allow a little extra for them
+    option_factor = 1.0 + max(0.0, 4.0 - float(bpw)) * 0.05
+
+    return int((CUDA_CONTEXT_BYTES + max(layer_peak, head_peak) * option_factor) * VRAM_SAFETY_MARGIN)
+
+# Free and total VRAM through NVML (pynvml / nvidia-ml-py)
+class NvmlMemoryProvider:
+    def __init__(self):
+        import pynvml
+        pynvml.nvmlInit()
+        self.pynvml = pynvml
+
+    # CUDA device ids are mapped to NVML indices directly; set CUDA_DEVICE_ORDER=PCI_BUS_ID so they agree
+    def memory_info(self, cuda_device):
+        handle = self.pynvml.nvmlDeviceGetHandleByIndex(int(cuda_device))
+        info = self.pynvml.nvmlDeviceGetMemoryInfo(handle)
+        return info.free, info.total
+
+# Stand-in provider reporting the same fixed amount of free VRAM on every device.
+# Used when NVML is not available, and for testing the packing without hardware.
+class StaticMemoryProvider:
+    def __init__(self, free_bytes):
+        self.free_bytes = free_bytes
+
+    def memory_info(self, cuda_device):
+        return self.free_bytes, self.free_bytes
+
+# Pick a memory provider: 'nvml', 'static:<GB>', or 'auto' (NVML when it loads, otherwise nothing)
+def get_memory_provider(spec):
+    spec = (spec or 'auto').strip()
+    if spec.startswith('static:'):
+        return StaticMemoryProvider(int(float(spec[len('static:'):]) * 1024 ** 3))
+    try:
+        return NvmlMemoryProvider()
+    except Exception:
+        if spec == 'nvml':
+            raise
+        return None
+
+# VRAM each device can give to conversions: its free memory, capped by the configured budget.
+# Without a provider or a budget nothing is known, so each device falls back to one variant at a time.
+def device_capacities(cuda_devices, memory_provider, budget_bytes=None):
+    capacities = {}
+    for cuda_device in cuda_devices:
+        capacity = 0
+        if memory_provider is not None:
+            capacity = memory_provider.memory_info(cuda_device)[0]
+            if budget_bytes:
+                capacity = min(capacity, budget_bytes)
+        elif budget_bytes:
+            capacity = budget_bytes
+        capacities[cuda_device] = capacity
+    return capacities
+
+# Runs variants concurrently, packing as many onto each GPU as fit its VRAM capacity.
+# A variant larger than any capacity still runs, alone, on an otherwise idle GPU.
+class VramPacker:
+    def __init__(self, capacities, estimates):
+        self.capacities = capacities
+        self.estimates = estimates
+
+    # Most variants that could ever run at once, for the disk space check
+    def max_concurrency(self):
+        if not self.estimates:
+            return len(self.capacities)
+        smallest = min(self.estimates.values())
+        return sum(max(1, capacity // smallest) for capacity in self.capacities.values())
+
+    # Run every variant through run_variant(variant, cuda_device); returns [(variant, succeeded)] in input order
+    def run(self, variants, run_variant):
+        pending = list(variants)
+        reserved = {cuda_device: 0 for cuda_device in self.capacities}
+        running = {cuda_device: 0 for cuda_device in self.capacities}
+        results = {}
+        condition = threading.Condition()
+        threads = []
+
+        def run_one(variant, cuda_device):
+            try:
+                succeeded = run_variant(variant, cuda_device)
+            except Exception:
+                succeeded = False
+            with condition:
+                results[variant] = succeeded
+                reserved[cuda_device] -= self.estimates[variant]
+                running[cuda_device] -= 1
+                condition.notify_all()
+
+        # Device with the most room left that can take the variant, or None
+        def pick_device(variant):
+            estimate = self.estimates[variant]
+            best = None
+            for cuda_device, capacity in self.capacities.items():
+                room = capacity - reserved[cuda_device]
+                fits = estimate <= room or running[cuda_device] == 0
+                if fits and (best is None or room > self.capacities[best] - reserved[best]):
+                    best = cuda_device
+            return best
+
+        with condition:
+            while pending:
+                # Later, smaller variants may start while a large one waits for room
+                started = False
+                for variant in list(pending):
+                    cuda_device = pick_device(variant)
+                    if cuda_device is None:
+                        continue
+                    pending.remove(variant)
+                    reserved[cuda_device] += self.estimates[variant]
+                    running[cuda_device] += 1
+                    thread = threading.Thread(target=run_one, args=(variant, cuda_device), daemon=True)
+                    threads.append(thread)
+                    thread.start()
+                    started = True
+                if not started:
+                    condition.wait()
+
+        for thread in threads:
+            thread.join()
+        return [(variant, results.get(variant, False)) for variant in variants]
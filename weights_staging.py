@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from disk_planner import free_space
+
+# Record written next to a staged copy once it is complete
+STAGED_RECORD_NAME = '.staged.json'
+
+# Large files are copied in chunks of this size, several at once
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Chunks copied at once; network storage usually needs several requests in flight to reach full speed
+COPY_WORKERS = 8
+
+# Guards the staging directory: entries being staged, in use, and evictions
+staging_lock = threading.Lock()
+key_locks = {}
+active_entries = {}
+
+# Size and mtime of every top-level file of a weights directory, keyed by name.
+# convert.py only reads the top level, so subdirectories (e.g. original/*.pth) are not staged.
+def list_source_files(raw_weights_dir):
+    files = {}
+    for entry in os.scandir(raw_weights_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+# Name of the staged copy of a weights directory
+def staging_key(raw_weights_dir):
+    return hashlib.sha256(os.path.abspath(raw_weights_dir).encode('utf-8')).hexdigest()[:24]
+
+# Read the record of a staged copy, or None when it is missing or incomplete
+def read_staged_record(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, STAGED_RECORD_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Check a staged copy against the source: same files, sizes and mtimes, and nothing missing locally
+def verify_staged_copy(entry_dir, source_files):
+    record = read_staged_record(entry_dir)
+    if record is None or record.get('files') != source_files:
+        return False
+    for relative_path, (size, mtime_ns) in source_files.items():
+        try:
+            stat = os.stat(os.path.join(entry_dir, relative_path))
+        except OSError:
+            return False
+        if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+            return False
+    return True
+
+# Copy one chunk of a file with its own file handles, so chunks can be copied in parallel
+def copy_chunk(source, destination, offset, length):
+    with open(source, 'rb') as source_file, open(destination, 'r+b') as destination_file:
+        source_file.seek(offset)
+        destination_file.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = source_file.read(min(remaining, 8 * 1024 * 1024))
+            if not data:
+                raise OSError(f"{source} shrank while it was being copied")
+            destination_file.write(data)
+            remaining -= len(data)
+
+# Copy every source file into destination_dir with parallel chunked reads, keeping mtimes for verification
+def copy_files(raw_weights_dir, destination_dir, source_files, workers=COPY_WORKERS):
+    tasks = []
+    for relative_path, (size, _) in source_files.items():
+        destination = os.path.join(destination_dir, relative_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(destination, 'wb') as f:
+            f.truncate(size)
+        for offset in range(0, size, COPY_CHUNK_SIZE):
+            tasks.append((os.path.join(raw_weights_dir, relative_path), destination, offset, min(COPY_CHUNK_SIZE, size - offset)))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in [executor.submit(copy_chunk, *task) for task in tasks]:
+            future.result()
+
+    for relative_path, (_, mtime_ns) in source_files.items():
+        os.utime(os.path.join(destination_dir, relative_path), ns=(time.time_ns(), mtime_ns))
+
+# Size of a staged copy
+def staged_size(entry_dir):
+    record = read_staged_record(entry_dir)
+    if record is None:
+        return sum(os.path.getsize(os.path.join(dir_path, file_name)) for dir_path, _, file_names in os.walk(entry_dir) for file_name in file_names)
+    return sum(size for size, _ in record['files'].values())
+
+# Remove the least recently used staged copies until `needed` more bytes fit under max_bytes.
+# Copies in use by a running job (and `keep`) are never removed. Caller holds staging_lock.
+def evict_staged(staging_dir, max_bytes, needed, keep=None):
+    entries = []
+    for name in os.listdir(staging_dir):
+        entry_dir = os.path.join(staging_dir, name)
+        if not os.path.isdir(entry_dir):
+            continue
+        record = read_staged_record(entry_dir) or {}
+        entries.append((record.get('last_used', 0), staged_size(entry_dir), name, entry_dir))
+
+    total_bytes = sum(size for _, size, _, _ in entries)
+    for _, size, name, entry_dir in sorted(entries):
+        if total_bytes + needed <= max_bytes:
+            break
+        if name == keep or name.endswith('.partial') or active_entries.get(name) or name in key_locks and key_locks[name].locked():
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_bytes -= size
+    return total_bytes + needed <= max_bytes
+
+# Mark a staged copy as just used
+def touch_staged(entry_dir):
+    record = read_staged_record(entry_dir)
+    record['last_used'] = time.time()
+    path = os.path.join(entry_dir, STAGED_RECORD_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+# Make sure a verified local copy of raw_weights_dir exists and return its path.
+# Returns None when the copy cannot fit in the staging directory, so the caller reads the source instead.
+# With hold=True the copy is protected from eviction until release_staged() is called.
+# on_notice(message) is told when a copy starts.
+def stage_weights(raw_weights_dir, staging_dir, max_bytes, on_notice=None, hold=False):
+    key = staging_key(raw_weights_dir)
+    entry_dir = os.path.join(staging_dir, key)
+    with staging_lock:
+        os.makedirs(staging_dir, exist_ok=True)
+        key_lock = key_locks.setdefault(key, threading.Lock())
+
+    # One copy per model at a time; a prefetch and the job needing it wait for each other
+    with key_lock:
+        source_files = list_source_files(raw_weights_dir)
+        if verify_staged_copy(entry_dir, source_files):
+            touch_staged(entry_dir)
+            if hold:
+                acquire_staged(entry_dir)
+            return entry_dir
+
+        needed = sum(size for size, _ in source_files.values())
+        if needed > max_bytes:
+            return None
+        with staging_lock:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            if not evict_staged(staging_dir, max_bytes, needed, keep=key) or needed > free_space(staging_dir):
+                return None
+
+        if on_notice:
+            on_notice(f"Staging {raw_weights_dir} to {entry_dir}")
+        partial_dir = entry_dir + '.partial'
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        copy_files(raw_weights_dir, partial_dir, source_files)
+
+        # The source must not have changed while it was copied
+        if list_source_files(raw_weights_dir) != source_files:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            return None
+        with open(os.path.join(partial_dir, STAGED_RECORD_NAME), 'w') as f:
+            json.dump({'source': os.path.abspath(raw_weights_dir), 'files': source_files, 'last_used': time.time()}, f, indent=2)
+        os.replace(partial_dir, entry_dir)
+        if hold:
+            acquire_staged(entry_dir)
+        return entry_dir
+
+# Protect a staged copy from eviction while a job reads it
+def acquire_staged(entry_dir):
+    name = os.path.basename(entry_dir)
+    with staging_lock:
+        active_entries[name] = active_entries.get(name, 0) + 1
+
+# Allow a staged copy to be evicted again
+def release_staged(entry_dir):
+    name = os.path.basename(entry_dir)
+    with staging_lock:
+        active_entries[name] -= 1
+
+# Stage a model in the background, e.g. the next job of a batch while the current one quantizes
+def prefetch_weights(raw_weights_dir, staging_dir, max_bytes, on_notice=None):
+    def prefetch():
+        try:
+            stage_weights(raw_weights_dir, staging_dir, max_bytes, on_notice)
+        except OSError:
+            # The job itself retries staging, or falls back to the source
+            pass
+
+    thread = threading.Thread(target=prefetch, daemon=True)
+    thread.start()
+    return thread